@@ -11,8 +11,18 @@ Modo de funcionamiento:
 """
 
 import os
+import sys
 import gradio as gr
 
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.chat_sessions import ChatSessions
+from ollama_backend.compaction import default_compactor
+from ollama_backend.deadlines import DeadlineExceeded
+from ollama_backend.scheduler import MAX_IN_FLIGHT, MAX_QUEUE
+from ollama_backend.residency import default_residency
+from ollama_backend import prefix_cache
+
 # Try to import the official Ollama Python client. If it's not available,
 # we'll handle it later and return a helpful error message from the
 # generation function instead of crashing at import time.
@@ -25,13 +35,35 @@ except Exception:
 # Modelo por defecto (ajustar según lo que tenga instalado en Ollama)
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")
 
+# Cola de Gradio: deja entrar en el handler tantas peticiones como admite el
+# planificador compartido (en curso + en cola) y rechaza las demás.
+GRADIO_CONCURRENCY = int(os.environ.get("GRADIO_CONCURRENCY", str(MAX_IN_FLIGHT + MAX_QUEUE)))
+GRADIO_QUEUE_SIZE = int(os.environ.get("GRADIO_QUEUE_SIZE", "64"))
+
+# Mensajes anteriores que se muestran encima del turno en curso; el botón de
+# mensajes anteriores carga otra página de este tamaño (0 = todos).
+HISTORY_PAGE = int(os.environ.get("GRADIO_HISTORY_PAGE", "20"))
+
+# Conversación de cada sesión de Gradio, guardada en el servidor: la visible (el
+# navegador envía solo el mensaje nuevo en lugar de subir el chat completo en cada
+# turno) y el contexto que se envía al modelo, una ventana por presupuesto de tokens
+# cuyos turnos antiguos se resumen en segundo plano tras cada respuesta.
+_CHATS = ChatSessions(compactor=default_compactor())
+
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS y sigue qué hay cargado en
+# cada servidor (ver ollama_backend.residency)
+default_residency().start()
 
-def generate_with_ollama(prompt , model: str = OLLAMA_MODEL, timeout: int = 60) -> str:
+
+def generate_with_ollama(prompt , model: str = OLLAMA_MODEL, timeout: int = 60, state=None) -> str:
     """Call the Ollama Python client to get a model response.
 
     If the `ollama` package isn't installed this function returns a helpful
     message. It returns the assistant content as plain text on success, or an
     error string starting with [Error ...] on failure.
+
+    `state` is the per-session dict used to reuse the evaluated context
+    across turns (see `ollama_backend.prefix_cache`).
     """
     if chat is None:
         return (
@@ -49,7 +81,8 @@ def generate_with_ollama(prompt , model: str = OLLAMA_MODEL, timeout: int = 60)
             # If a single string was provided, wrap as a single user message
             messages = [{"role": "user", "content": str(prompt)}]
 
-        response = chat(model=model, messages=messages)
+        # keep_alive keeps the model loaded so the next turn reuses its KV cache
+        response = prefix_cache.chat(model=model, messages=messages, state=state)
 
         # Response can be dict-like or have attribute access depending on version.
         # Try dictionary access first.
@@ -71,30 +104,80 @@ def generate_with_ollama(prompt , model: str = OLLAMA_MODEL, timeout: int = 60)
         return f"[Error] Unexpected error calling ollama: {e}"
 
 
-def respond(message, chat_history, model=OLLAMA_MODEL):
-    """Maneja una nueva entrada del usuario y actualiza el historial de chat en formato OpenAI (role/content)."""
-    chat_history = chat_history or []
-    # Añadir mensaje del usuario al historial (role: user)
-    chat_history.append({"role": "user", "content": message})
-
-    # Preparar prompt concatenando el historial para dar contexto simple al modelo
-    """conversation = []
-    for msg in chat_history:
-        role = msg.get("role", "")
-        content = msg.get("content", "")
-        speaker = "Usuario" if role == "user" else "Assistant"
-        conversation.append(f"{speaker}: {content}")
-    prompt = "\n".join(conversation) + "\nAssistant:"
+def stream_with_ollama(messages, model: str = OLLAMA_MODEL, state=None):
+    """Return an iterator with the raw chunks of the answer, read as a stream.
+
+    Even though this variant shows the answer only once it is complete, reading
+    it as a stream lets a cancel close the HTTP response instead of waiting for
+    the whole answer, keeping the text received so far. Failures are yielded
+    as a single {"error": "..."} dict, like `stream_with_ollama` in
+    test1B_gpt_gradio_v2.py.
+    """
+    if chat is None:
+        yield {"error": "[Error] Python package 'ollama' no está instalado. Instale con: pip install ollama"}
+        return
+
+    try:
+        for part in prefix_cache.chat(model=model, messages=messages, stream=True, state=state):
+            yield part
+    except ResponseError as e:
+        err = getattr(e, "error", str(e))
+        yield {"error": f"[Error invoking ollama] {err}"}
+    except DeadlineExceeded as e:
+        # Ollama did not start answering or stalled mid-answer: the partial text
+        # is kept and the error is shown below it
+        yield {"error": f"[Error] {e}"}
+    except Exception as e:
+        yield {"error": f"[Error] Unexpected error calling ollama: {e}"}
+
+
+def _chat(entries):
+    """Mensajes para el Chatbot (formato role/content) a partir de los (role, content) guardados."""
+    return [{"role": role, "content": content} for role, content in entries]
+
+
+def _session_id(request):
+    return request.session_hash if request is not None else "default"
+
+
+def respond(message, model=OLLAMA_MODEL, shown=HISTORY_PAGE, request: gr.Request = None):
+    """Maneja una nueva entrada del usuario y actualiza el historial de chat en formato OpenAI (role/content).
+
+    Devuelve (historial, turno en curso, cuadro de texto); el historial es solo
+    la última página de mensajes anteriores (`shown`). Se lee de `_CHATS`, no
+    del navegador. Esta variante no hace streaming: espera su turno en la cola
+    sin mostrar la posición y pinta la respuesta completa.
     """
 
-    # Llamar a Ollama
-    response = generate_with_ollama(chat_history, model=model)
+    def _produce(messages, state):
+        return stream_with_ollama(messages, model=model, state=state)
+
+    for older, turn in _CHATS.respond(_session_id(request), message, _produce, shown, stream=False):
+        return _chat(older), _chat(turn), ""
+    # El usuario ya envió otro mensaje: esa petición continúa la conversación,
+    # así que no se toca el chat que ya está mostrando
+    return gr.update(), gr.update(), gr.update()
+
 
-    # Añadir respuesta al historial (role: assistant)
-    chat_history.append({"role": "assistant", "content": response})
+def stop_generation(request: gr.Request = None):
+    """Botón Detener: corta la respuesta que se está generando en esta sesión."""
+    _CHATS.stop(_session_id(request))
 
-    # Devuelve el historial actualizado y limpia el cuadro de texto
-    return chat_history, ""
+
+def load_older(shown, request: gr.Request = None):
+    """Botón de mensajes anteriores: añade otra página al Chatbot de historial."""
+    shown += HISTORY_PAGE
+    return _chat(_CHATS.older(_session_id(request), shown)), shown
+
+
+def end_session(request: gr.Request = None):
+    """Al cerrar la pestaña se libera la conversación de la sesión (visible y contexto del modelo)."""
+    _CHATS.end(_session_id(request))
+
+
+def warm_model(model):
+    """Precarga en segundo plano el modelo escrito en la caja, antes del primer mensaje."""
+    default_residency().warm(model)
 
 
 with gr.Blocks(title="Chat con Ollama (local)") as demo:
@@ -102,14 +185,27 @@ with gr.Blocks(title="Chat con Ollama (local)") as demo:
 
     with gr.Row():
         model_input = gr.Textbox(label="Modelo Ollama (usar el nombre tal cual)", value=OLLAMA_MODEL)
-    # Usar el formato moderno de mensajes
-    chatbot = gr.Chatbot(type="messages")
+    # Usar el formato moderno de mensajes. Los mensajes anteriores se muestran por
+    # páginas, aparte del turno en curso
+    older = gr.Button("Mostrar mensajes anteriores", visible=HISTORY_PAGE > 0)
+    history = gr.Chatbot(type="messages", label="Mensajes anteriores")
+    chatbot = gr.Chatbot(type="messages", label="Turno actual")
+    shown = gr.State(HISTORY_PAGE)
     msg = gr.Textbox(placeholder="Escribe tu mensaje aquí...", show_label=False)
-    send = gr.Button("Enviar")
-
-    # Conectar eventos
-    send.click(respond, inputs=[msg, chatbot, model_input], outputs=[chatbot, msg])
-    msg.submit(respond, inputs=[msg, chatbot, model_input], outputs=[chatbot, msg])
+    with gr.Row():
+        send = gr.Button("Enviar")
+        stop = gr.Button("Detener")
+
+    # Conectar eventos; Detener va fuera de la cola para no esperar detrás de la respuesta
+    # Solo se envía el mensaje nuevo; el historial lo guarda el servidor (_CHATS)
+    send.click(respond, inputs=[msg, model_input, shown], outputs=[history, chatbot, msg])
+    msg.submit(respond, inputs=[msg, model_input, shown], outputs=[history, chatbot, msg])
+    older.click(load_older, inputs=shown, outputs=[history, shown], queue=False)
+    stop.click(stop_generation, queue=False)
+    demo.unload(end_session)
+    model_input.blur(warm_model, inputs=model_input, queue=False)
+
+demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_QUEUE_SIZE)
 
 
 if __name__ == "__main__":
@@ -11,8 +11,18 @@ Modo de funcionamiento:
 """
 
 import os
+import sys
 import gradio as gr
 
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.chat_sessions import ChatSessions
+from ollama_backend.compaction import default_compactor
+from ollama_backend.deadlines import DeadlineExceeded
+from ollama_backend.scheduler import MAX_IN_FLIGHT, MAX_QUEUE
+from ollama_backend.residency import default_residency
+from ollama_backend import prefix_cache
+
 # Try to import the official Ollama Python client. If it's not available,
 # we'll handle it later and return a helpful error message from the
 # generation function instead of crashing at import time.
@@ -25,12 +35,40 @@ except Exception:
 # Modelo por defecto (ajustar según lo que tenga instalado en Ollama)
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")
 
+# Ventana de agrupación del streaming: se repinta el chat como mucho cada
+# STREAM_FLUSH_MS milisegundos o cuando se acumulan STREAM_FLUSH_CHARS caracteres.
+STREAM_FLUSH_MS = int(os.environ.get("GRADIO_STREAM_FLUSH_MS", "50"))
+STREAM_FLUSH_CHARS = int(os.environ.get("GRADIO_STREAM_FLUSH_CHARS", "64"))
+
+# Cola de Gradio: deja entrar en el handler tantas peticiones como admite el
+# planificador compartido (en curso + en cola) y rechaza las demás.
+GRADIO_CONCURRENCY = int(os.environ.get("GRADIO_CONCURRENCY", str(MAX_IN_FLIGHT + MAX_QUEUE)))
+GRADIO_QUEUE_SIZE = int(os.environ.get("GRADIO_QUEUE_SIZE", "64"))
+
+# Earlier messages shown above the current turn; the "older messages" button
+# loads another page of this size (0 = all of them).
+HISTORY_PAGE = int(os.environ.get("GRADIO_HISTORY_PAGE", "20"))
+
+# Conversation of each Gradio session, kept on the server: the visible one (the
+# browser sends only the new message instead of uploading the whole chat on every
+# turn) and the model context, a token-budget window whose oldest turns are
+# summarized in the background after each answer.
+_CHATS = ChatSessions(
+    compactor=default_compactor(), flush_interval=STREAM_FLUSH_MS / 1000.0, flush_chars=STREAM_FLUSH_CHARS
+)
+
+# Preload and pin the OLLAMA_PRELOAD_MODELS models and track what is loaded on
+# each server (see ollama_backend.residency)
+default_residency().start()
+
 
-def stream_with_ollama(messages, model: str = OLLAMA_MODEL):
+def stream_with_ollama(messages, model: str = OLLAMA_MODEL, state=None):
     """Return an iterator that yields partial chunks from Ollama chat streaming.
 
     Each yielded item is the raw chunk returned by the Ollama client. The
-    caller should handle dict shapes and error objects.
+    caller should handle dict shapes and error objects. `state` is the
+    per-session dict used to reuse the evaluated context across turns (see
+    `ollama_backend.prefix_cache`).
     """
     if chat is None:
         # Yield a single error object so caller can display it
@@ -38,71 +76,66 @@ def stream_with_ollama(messages, model: str = OLLAMA_MODEL):
         return
 
     try:
-        for part in chat(model=model, messages=messages, stream=True):
+        for part in prefix_cache.chat(model=model, messages=messages, stream=True, state=state):
             yield part
     except ResponseError as e:
         err = getattr(e, "error", str(e))
         yield {"error": f"[Error invoking ollama] {err}"}
+    except DeadlineExceeded as e:
+        # Ollama did not start answering or stalled mid-answer: the caller keeps
+        # the text received so far and shows the error below it
+        yield {"error": f"[Error] {e}"}
     except Exception as e:
         yield {"error": f"[Error] Unexpected error calling ollama: {e}"}
 
 
-def respond(message, chat_history, model=OLLAMA_MODEL):
+def _chat(entries):
+    """Chatbot messages (role/content format) from (role, content) transcript entries."""
+    return [{"role": role, "content": content} for role, content in entries]
+
+
+def _session_id(request):
+    return request.session_hash if request is not None else "default"
+
+
+def respond(message, model=OLLAMA_MODEL, shown=HISTORY_PAGE, request: gr.Request = None):
     """Generator-based responder that streams partial assistant output to Gradio.
 
-    Yields tuples matching the Gradio outputs: (chat_history, textbox_value).
-    The function appends the user's message, inserts a placeholder assistant
-    message, then updates that assistant message as chunks arrive from the
-    Ollama streaming API.
+    Yields tuples matching the Gradio outputs: (history, current_turn,
+    textbox_value). Only the first update carries the earlier messages (the
+    last `shown`); the streaming updates carry just the current turn, so what
+    Gradio postprocesses and diffs per update does not grow with the
+    conversation. The history comes from `_CHATS`, not from the browser;
+    `ChatSessions.respond` takes care of the queue, cancellation and model context.
     """
-    chat_history = chat_history or []
-
-    # Append the user message
-    chat_history.append({"role": "user", "content": message})
-
-    # Insert a placeholder assistant message we will update in-place
-    chat_history.append({"role": "assistant", "content": ""})
-
-    # Immediately yield so UI shows the user's message and an empty assistant
-    yield chat_history, ""
-
-    # Stream from Ollama
-    stream = stream_with_ollama(chat_history, model=model)
-
-    assistant_text = ""
-    for part in stream:
-        # If the stream yields an error dict, show it and finish
-        if isinstance(part, dict) and part.get("error"):
-            chat_history[-1]["content"] = part.get("error")
-            yield chat_history, ""
-            return
-
-        # Extract content from the chunk. Ollama streaming chunks typically
-        # have the shape {'message': {'content': '...'}}; but be permissive.
-        chunk_text = ""
-        try:
-            if isinstance(part, dict):
-                msg = part.get("message") or {}
-                # preserve original whitespace (do not strip) so fragments join correctly
-                chunk_text = msg.get("content") if msg.get("content") is not None else part.get("content") or ""
-            else:
-                # part may be an object with .message.content; preserve whitespace
-                try:
-                    chunk_text = part.message.content
-                except Exception:
-                    chunk_text = str(part)
-        except Exception:
-            chunk_text = str(part)
-
-        # Append chunk as-is (no extra space) so tokens form full words across chunks
-        assistant_text += chunk_text
-        chat_history[-1]["content"] = assistant_text
-
-        # Yield updated history so Gradio can render the partial response
-        yield chat_history, ""
-
-    # Final yield to ensure UI shows the full response (redundant but safe)
-    yield chat_history, ""
+
+    def _produce(messages, state):
+        # Stream from Ollama with the session context, reusing its evaluated prefix
+        return stream_with_ollama(messages, model=model, state=state)
+
+    for older, turn in _CHATS.respond(_session_id(request), message, _produce, shown):
+        yield (gr.update() if older is None else _chat(older)), _chat(turn), ""
+
+
+def stop_generation(request: gr.Request = None):
+    """Stop button: cut the answer currently being generated for this session."""
+    _CHATS.stop(_session_id(request))
+
+
+def load_older(shown, request: gr.Request = None):
+    """Older messages button: add another page to the history Chatbot."""
+    shown += HISTORY_PAGE
+    return _chat(_CHATS.older(_session_id(request), shown)), shown
+
+
+def end_session(request: gr.Request = None):
+    """Tab closed: free the session conversation (visible transcript and model context)."""
+    _CHATS.end(_session_id(request))
+
+
+def warm_model(model):
+    """Preload the model typed in the box in the background, before the first message."""
+    default_residency().warm(model)
 
 
 with gr.Blocks(title="Chat con Ollama (local)") as demo:
@@ -110,14 +143,28 @@ with gr.Blocks(title="Chat con Ollama (local)") as demo:
 
     with gr.Row():
         model_input = gr.Textbox(label="Modelo Ollama (usar el nombre tal cual)", value=OLLAMA_MODEL)
-    # Usar el formato moderno de mensajes
-    chatbot = gr.Chatbot(type="messages")
+    # Usar el formato moderno de mensajes. Los mensajes anteriores (una página, que
+    # se envía una vez por turno) van aparte del turno en curso, que es lo único
+    # que se reenvía con cada fragmento
+    older = gr.Button("Mostrar mensajes anteriores", visible=HISTORY_PAGE > 0)
+    history = gr.Chatbot(type="messages", label="Mensajes anteriores")
+    chatbot = gr.Chatbot(type="messages", label="Turno actual")
+    shown = gr.State(HISTORY_PAGE)
     msg = gr.Textbox(placeholder="Escribe tu mensaje aquí...", show_label=False)
-    send = gr.Button("Enviar")
-
-    # Conectar eventos
-    send.click(respond, inputs=[msg, chatbot, model_input], outputs=[chatbot, msg])
-    msg.submit(respond, inputs=[msg, chatbot, model_input], outputs=[chatbot, msg])
+    with gr.Row():
+        send = gr.Button("Enviar")
+        stop = gr.Button("Detener")
+
+    # Conectar eventos; Detener va fuera de la cola para no esperar detrás de la respuesta
+    # Solo se envía el mensaje nuevo; el historial lo guarda el servidor (_CHATS)
+    send.click(respond, inputs=[msg, model_input, shown], outputs=[history, chatbot, msg])
+    msg.submit(respond, inputs=[msg, model_input, shown], outputs=[history, chatbot, msg])
+    older.click(load_older, inputs=shown, outputs=[history, shown], queue=False)
+    stop.click(stop_generation, queue=False)
+    demo.unload(end_session)
+    model_input.blur(warm_model, inputs=model_input, queue=False)
+
+demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_QUEUE_SIZE)
 
 
 if __name__ == "__main__":
@@ -6,61 +6,151 @@ Requisitos:
 - Tener gradio instalado: pip install gradio
 
 Modo de funcionamiento:
-- Usa la CLI `ollama run <model> "prompt"` para obtener la respuesta del modelo local.
+- Usa la CLI `ollama run <model>` para obtener la respuesta del modelo local, a través de
+  un pool de procesos persistentes (ver `ollama_backend/cli_pool.py`).
+- La respuesta se muestra en streaming a medida que la CLI la va escribiendo.
 - Ajustar la variable OLLAMA_MODEL o el campo de la UI si se desea otro modelo.
 """
 
 import os
+import sys
 import subprocess
 import gradio as gr
 
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.cli_pool import CLIError, run_prompt, stream_prompt
+from ollama_backend.deadlines import DeadlineExceeded
+from ollama_backend.chat_sessions import ChatSessions
+from ollama_backend.compaction import default_compactor
+from ollama_backend.prompt import PromptBuilder
+from ollama_backend.scheduler import MAX_IN_FLIGHT, MAX_QUEUE
+from ollama_backend.residency import default_residency
+
 # Modelo por defecto (ajustar según lo que tenga instalado en Ollama)
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")
 
+# Ventana de agrupación del streaming: se repinta el chat como mucho cada
+# STREAM_FLUSH_MS milisegundos o cuando se acumulan STREAM_FLUSH_CHARS caracteres.
+STREAM_FLUSH_MS = int(os.environ.get("GRADIO_STREAM_FLUSH_MS", "50"))
+STREAM_FLUSH_CHARS = int(os.environ.get("GRADIO_STREAM_FLUSH_CHARS", "64"))
+
+# Cola de Gradio: deja entrar en el handler tantas peticiones como admite el
+# planificador compartido (en curso + en cola) y rechaza las demás.
+GRADIO_CONCURRENCY = int(os.environ.get("GRADIO_CONCURRENCY", str(MAX_IN_FLIGHT + MAX_QUEUE)))
+GRADIO_QUEUE_SIZE = int(os.environ.get("GRADIO_QUEUE_SIZE", "64"))
+
+# Mensajes anteriores que se muestran encima del turno en curso; el botón de
+# mensajes anteriores carga otra página de este tamaño (0 = todos).
+HISTORY_PAGE = int(os.environ.get("GRADIO_HISTORY_PAGE", "20"))
+
+# Conversación de cada sesión de Gradio, guardada en el servidor: la visible (el
+# navegador envía solo el mensaje nuevo en lugar de subir el chat completo en cada
+# turno) y el contexto que se envía al modelo, una ventana por presupuesto de tokens
+# cuyos turnos antiguos se resumen en segundo plano tras cada respuesta.
+_CHATS = ChatSessions(
+    compactor=default_compactor("cli"), flush_interval=STREAM_FLUSH_MS / 1000.0, flush_chars=STREAM_FLUSH_CHARS
+)
+
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS y sigue qué hay cargado en
+# cada servidor (ver ollama_backend.residency)
+default_residency().start()
+
 
 def generate_with_ollama(prompt: str, model: str = OLLAMA_MODEL, timeout: int = 60) -> str:
     """Llama a la CLI de Ollama y devuelve la salida como texto.
     Requiere que el comando `ollama` esté en PATH y que el modelo esté instalado localmente.
     """
-    # Construir comando como lista para evitar problemas de shell
-    cmd = ["ollama", "run", model, prompt]
     try:
-        proc = subprocess.run(cmd, capture_output=True, encoding="utf-8", timeout=timeout)
-        if proc.returncode == 0:
-            # Normalmente la respuesta está en stdout
-            return proc.stdout.strip()
-        else:
-            return f"[Error invoking ollama] {proc.stderr.strip()}"
+        # Reutiliza un `ollama run` ya arrancado en lugar de lanzar un proceso nuevo
+        return run_prompt(prompt, model=model, timeout=timeout)
+    except CLIError as e:
+        return f"[Error invoking ollama] {e}"
     except FileNotFoundError:
         return "[Error] Comando 'ollama' no encontrado. Asegúrese de que Ollama esté instalado y en PATH."
     except subprocess.TimeoutExpired:
         return "[Error] La llamada a Ollama expiró (timeout)."
+    except DeadlineExceeded as e:
+        return f"[Error] {e}"
 
 
-def respond(message, chat_history, model=OLLAMA_MODEL):
-    """Maneja una nueva entrada del usuario y actualiza el historial de chat en formato OpenAI (role/content)."""
-    chat_history = chat_history or []
-    # Añadir mensaje del usuario al historial (role: user)
-    chat_history.append({"role": "user", "content": message})
+def stream_with_ollama(prompt: str, model: str = OLLAMA_MODEL, timeout: int = 60):
+    """Devuelve un iterador con los fragmentos de texto que va escribiendo la CLI.
 
-    # Preparar prompt concatenando el historial para dar contexto simple al modelo
-    conversation = []
- 
-    for msg in chat_history:
-        role = msg.get("role", "")
-        content = msg.get("content", "")
-        speaker = "Usuario" if role == "user" else "Assistant"
-        conversation.append(f"{speaker}: {content}") 
-    prompt = "\n".join(conversation) + "\nAssistant:"
+    En caso de error produce un único dict {"error": "..."} para que el
+    llamador lo muestre, igual que `stream_with_ollama` en test1B_gpt_gradio_v2.py.
+    """
+    try:
+        for fragment in stream_prompt(prompt, model=model, timeout=timeout):
+            yield fragment
+    except CLIError as e:
+        yield {"error": f"[Error invoking ollama] {e}"}
+    except FileNotFoundError:
+        yield {"error": "[Error] Comando 'ollama' no encontrado. Asegúrese de que Ollama esté instalado y en PATH."}
+    except subprocess.TimeoutExpired:
+        yield {"error": "[Error] La llamada a Ollama expiró (timeout)."}
+    except DeadlineExceeded as e:
+        # Plazo vencido (Ollama no empezó o se quedó a medias): el llamador
+        # conserva lo recibido hasta ahora y muestra el error debajo
+        yield {"error": f"[Error] {e}"}
+
+
+def _render_message(m):
+    """Línea del prompt para un mensaje del contexto de la sesión."""
+    speaker = {"user": "Usuario", "system": "Sistema"}.get(m["role"], "Assistant")
+    return f"{speaker}: {m['content']}"
 
-    # Llamar a Ollama
-    response = generate_with_ollama(prompt, model=model)
 
-    # Añadir respuesta al historial (role: assistant)
-    chat_history.append({"role": "assistant", "content": response})
+def _chat(entries):
+    """Mensajes para el Chatbot (formato role/content) a partir de los (role, content) guardados."""
+    return [{"role": role, "content": content} for role, content in entries]
 
-    # Devuelve el historial actualizado y limpia el cuadro de texto
-    return chat_history, ""
+
+def _session_id(request):
+    return request.session_hash if request is not None else "default"
+
+
+def respond(message, model=OLLAMA_MODEL, shown=HISTORY_PAGE, request: gr.Request = None):
+    """Maneja una nueva entrada del usuario y actualiza el historial de chat en formato OpenAI (role/content).
+
+    Es un generador: Gradio repinta el chat con cada fragmento de la respuesta.
+    Devuelve (historial, turno en curso, cuadro de texto): solo la primera
+    actualización lleva los mensajes anteriores (los últimos `shown`); las del
+    streaming llevan solo el turno en curso, así que lo que Gradio procesa y
+    compara en cada una no crece con la conversación. El historial se lee de
+    `_CHATS`, no del navegador; la cola, la cancelación y el contexto del
+    modelo los lleva `ChatSessions.respond`.
+    """
+
+    def _produce(messages, state):
+        # Prompt con el contexto de la sesión; solo se renderizan los mensajes nuevos
+        # desde el turno anterior (ver ollama_backend.prompt)
+        builder = state.setdefault("prompt", PromptBuilder(_render_message, suffix="\nAssistant:"))
+        return stream_with_ollama(builder.build(messages), model=model)
+
+    for older, turn in _CHATS.respond(_session_id(request), message, _produce, shown):
+        yield (gr.update() if older is None else _chat(older)), _chat(turn), ""
+
+
+def stop_generation(request: gr.Request = None):
+    """Botón Detener: corta la respuesta que se está generando en esta sesión."""
+    _CHATS.stop(_session_id(request))
+
+
+def load_older(shown, request: gr.Request = None):
+    """Botón de mensajes anteriores: añade otra página al Chatbot de historial."""
+    shown += HISTORY_PAGE
+    return _chat(_CHATS.older(_session_id(request), shown)), shown
+
+
+def end_session(request: gr.Request = None):
+    """Al cerrar la pestaña se libera la conversación de la sesión (visible y contexto del modelo)."""
+    _CHATS.end(_session_id(request))
+
+
+def warm_model(model):
+    """Precarga en segundo plano el modelo escrito en la caja, antes del primer mensaje."""
+    default_residency().warm(model)
 
 
 with gr.Blocks(title="Chat con Ollama (local)") as demo:
@@ -68,14 +158,28 @@ with gr.Blocks(title="Chat con Ollama (local)") as demo:
 
     with gr.Row():
         model_input = gr.Textbox(label="Modelo Ollama (usar el nombre tal cual)", value=OLLAMA_MODEL)
-    # Usar el formato moderno de mensajes
-    chatbot = gr.Chatbot(type="messages")
+    # Usar el formato moderno de mensajes. Los mensajes anteriores (una página, que
+    # se envía una vez por turno) van aparte del turno en curso, que es lo único
+    # que se reenvía con cada fragmento
+    older = gr.Button("Mostrar mensajes anteriores", visible=HISTORY_PAGE > 0)
+    history = gr.Chatbot(type="messages", label="Mensajes anteriores")
+    chatbot = gr.Chatbot(type="messages", label="Turno actual")
+    shown = gr.State(HISTORY_PAGE)
     msg = gr.Textbox(placeholder="Escribe tu mensaje aquí...", show_label=False)
-    send = gr.Button("Enviar")
-
-    # Conectar eventos
-    send.click(respond, inputs=[msg, chatbot, model_input], outputs=[chatbot, msg])
-    msg.submit(respond, inputs=[msg, chatbot, model_input], outputs=[chatbot, msg])
+    with gr.Row():
+        send = gr.Button("Enviar")
+        stop = gr.Button("Detener")
+
+    # Conectar eventos; Detener va fuera de la cola para no esperar detrás de la respuesta
+    # Solo se envía el mensaje nuevo; el historial lo guarda el servidor (_CHATS)
+    send.click(respond, inputs=[msg, model_input, shown], outputs=[history, chatbot, msg])
+    msg.submit(respond, inputs=[msg, model_input, shown], outputs=[history, chatbot, msg])
+    older.click(load_older, inputs=shown, outputs=[history, shown], queue=False)
+    stop.click(stop_generation, queue=False)
+    demo.unload(end_session)
+    model_input.blur(warm_model, inputs=model_input, queue=False)
+
+demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_QUEUE_SIZE)
 
 
 if __name__ == "__main__":
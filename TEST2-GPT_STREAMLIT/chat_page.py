@@ -0,0 +1,168 @@
+"""
+Página de chat común a las dos variantes de Streamlit (CLI y librería).
+
+Cada script solo aporta cómo se obtiene la respuesta: `render()` pinta la barra
+lateral y la conversación y, para cada mensaje, llama a `produce(messages,
+state, model_name)` con el contexto del modelo (ventana por presupuesto de
+tokens) y el dict de la sesión para el backend, que devuelve el stream de
+texto. La cola y la cancelación las lleva `ollama_backend.chat_sessions.Turn`.
+"""
+
+import uuid
+from typing import Any, Callable, Dict, Iterable, List
+
+import streamlit as st
+
+from ollama_backend.chat_sessions import Turn
+from ollama_backend.compaction import Compactor
+from ollama_backend.residency import default_residency
+from ollama_backend.window import HistoryWindow
+
+STOPPED = "_[Respuesta detenida]_"
+
+Produce = Callable[[List[Dict[str, str]], Dict[str, Any], str], Iterable[str]]
+
+
+def _init_session(history_page: int) -> None:
+    if 'messages' not in st.session_state:
+        st.session_state.messages = []
+    if 'session_id' not in st.session_state:
+        # Identifica la sesión en el planificador compartido (reparto de la cola por usuario)
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'window' not in st.session_state:
+        # Contexto que se envía al modelo: ventana por presupuesto de tokens cuyos
+        # turnos antiguos se resumen en segundo plano (ver ollama_backend.compaction)
+        st.session_state.window = HistoryWindow()
+    if 'backend_state' not in st.session_state:
+        # Estado del backend en esta sesión: el prompt ya renderizado de la CLI (ver
+        # ollama_backend.prompt) o el contexto ya evaluado (ver ollama_backend.prefix_cache)
+        st.session_state.backend_state = {}
+    if 'history_shown' not in st.session_state:
+        # Cuántos de los últimos mensajes se pintan; "Mostrar anteriores" añade otra página
+        st.session_state.history_shown = history_page
+
+
+@st.fragment
+def model_settings(model: str):
+    """Caja del modelo; como fragmento, escribir en ella no repinta la conversación."""
+    model = st.text_input("Modelo Ollama", value=model, key="model")
+    if st.session_state.get('warmed_model') != model:
+        # Precarga en segundo plano el modelo elegido, antes del primer mensaje
+        st.session_state['warmed_model'] = model
+        default_residency().warm(model)
+
+
+def _sidebar(model: str, history_page: int) -> None:
+    with st.sidebar:
+        st.header("Configuración")
+        model_settings(model)
+        clear = st.button("Limpiar chat")
+        # Los botones fuera de los fragmentos reinician el script entero, lo que corta
+        # la respuesta en curso (ver _stream_response); este solo sirve para eso
+        st.button("Detener respuesta")
+        if clear:
+            st.session_state.messages = []
+            st.session_state.history_shown = history_page
+            st.session_state.window = HistoryWindow()
+            st.session_state.backend_state = {}
+            try:
+                st.experimental_rerun()
+            except Exception:
+                pass
+
+
+def _submit(user_input_val: str) -> None:
+    """Add the user message to the visible history and to the model context."""
+    st.session_state.messages.append({"role": "user", "content": user_input_val})
+    st.session_state.window.append("user", user_input_val)
+
+
+def _stream_response(produce: Produce, model_name: str, compactor: Compactor, error_prefix: str) -> None:
+    """Stream the answer for the last user message inside the assistant bubble and store it in the history.
+
+    Fragments are rendered as they arrive with `st.write_stream`, so the user
+    sees the answer from the first token instead of after the full generation.
+    """
+    window = st.session_state.window
+    status = st.empty()
+    reply = None
+    error = None
+    # Detener, un mensaje nuevo o cerrar la pestaña reinician el script, que se
+    # interrumpe en la siguiente llamada a `st`: el turno se cancela al salir del
+    # bloque y el stream se cierra (el `ollama run` en curso o la respuesta HTTP)
+    interrupted = True
+    try:
+        # Turno en el planificador compartido (límite de generaciones simultáneas y cola
+        # repartida por sesiones); QueueFull si la cola está llena
+        with Turn(st.session_state.session_id) as reply:
+            for position in reply.waiting():
+                status.markdown(f"_En cola (posición {position})..._")
+            status.empty()
+            # Contexto del modelo: resumen de los turnos antiguos + turnos recientes que
+            # caben en el presupuesto de tokens del prompt
+            stream = produce(window.messages(), st.session_state.backend_state, model_name)
+            st.write_stream(reply.fragments(stream))
+        interrupted = False
+    except Exception as e:
+        interrupted = False
+        # Se conserva lo recibido antes del fallo (p. ej. un plazo vencido) y el
+        # error se muestra debajo; al contexto del modelo solo va el texto
+        error = f"{error_prefix}: {e}"
+    finally:
+        if interrupted and reply is not None and reply.text.strip():
+            # Se conserva lo generado hasta el corte
+            st.session_state.messages.append({"role": "assistant", "content": reply.outcome(STOPPED)})
+            window.append("assistant", reply.text.strip())
+    if error:
+        st.error(error)
+
+    response_text = reply.text.strip() if reply is not None else ""
+    st.session_state.messages.append({"role": "assistant", "content": response_text, "error": error})
+    if response_text:
+        window.append("assistant", response_text)
+    # Resume en segundo plano los turnos antiguos si el contexto se acerca al límite
+    compactor.maybe_compact(window)
+
+
+@st.fragment
+def chat_area(produce: Produce, history_page: int, compactor: Compactor, error_prefix: str):
+    """Conversation area (last messages, input and streaming answer).
+
+    As a fragment it is the only part of the page rerun when a message is sent or
+    older messages are loaded, and it only renders the last `history_shown`
+    messages, so reruns don't grow with the length of the conversation.
+    """
+    messages = st.session_state.messages
+    shown = st.session_state.history_shown
+    hidden = len(messages) - shown if shown else 0
+    if hidden > 0 and st.button(f"Mostrar mensajes anteriores ({hidden})", key="show_older"):
+        st.session_state.history_shown += history_page
+        hidden -= history_page
+    for m in messages[max(hidden, 0):]:
+        with st.chat_message(m.get("role")):
+            if m.get("content"):
+                st.markdown(m["content"])
+            if m.get("error"):
+                st.error(m["error"])
+
+    # `st.chat_input` sigue activo mientras se genera la respuesta: enviar otro
+    # mensaje vuelve a ejecutar el fragmento y corta la respuesta en curso
+    user_input = st.chat_input("Tu mensaje:")
+    if user_input:
+        _submit(user_input)
+        with st.chat_message("user"):
+            st.markdown(user_input)
+        with st.chat_message("assistant"):
+            _stream_response(produce, st.session_state.model, compactor, error_prefix)
+
+
+def render(produce: Produce, model: str, history_page: int, compactor: Compactor, error_prefix: str) -> None:
+    """Barra lateral (modelo, limpiar, detener) y conversación paginada de la sesión.
+
+    `history_page` es cuántos mensajes se pintan y cuántos más carga "Mostrar
+    anteriores" (0 = todos); `compactor` resume la ventana tras cada respuesta y
+    `error_prefix` encabeza los errores del backend que se muestran en el chat.
+    """
+    _init_session(history_page)
+    _sidebar(model, history_page)
+    chat_area(produce, history_page, compactor, error_prefix)
@@ -1,97 +1,68 @@
 import streamlit as st
-import subprocess
-try:
-    import ollama
-    _HAS_OLLAMA_PY = True
-except Exception:
-    _HAS_OLLAMA_PY = False
+import importlib.util
 import os
-from typing import List, Dict, Any
+import sys
+
+# La librería se importa en `ollama_backend` al crear el cliente; aquí solo se comprueba que exista
+_HAS_OLLAMA_PY = importlib.util.find_spec("ollama") is not None
+
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo y
+# la página de chat común a las dos variantes (chat_page.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ollama_backend.compaction import default_compactor
+from ollama_backend import prefix_cache
+from ollama_backend.residency import default_residency
+from ollama_backend.streaming import chunk_text
+from chat_page import render
 
 # Config
 MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")  # Default model name, user can set OLLAMA_MODEL env var
+# Mensajes visibles del chat; los anteriores se cargan por páginas bajo demanda (0 = todos)
+HISTORY_PAGE = int(os.environ.get("STREAMLIT_HISTORY_PAGE", "20"))
+
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS y sigue qué hay cargado en
+# cada servidor (ver ollama_backend.residency); solo arranca una vez por proceso
+default_residency().start()
 
 st.set_page_config(page_title="Chat con Ollama", layout="wide")
 
 st.title("Chat con Ollama")
 
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
-
-# UI
-with st.sidebar:
-    st.header("Configuración")
-    model = st.text_input("Modelo Ollama", value=MODEL)
-    clear = st.button("Limpiar chat")
-    if clear:
-        st.session_state.messages = []
-        st.session_state['user_input'] = ''
-        try:
-            st.experimental_rerun()
-        except Exception:
-            pass
 
+def call_ollama(messages, model_name: str, state=None) -> str:
+    """Llama a Ollama con la librería Python y devuelve la respuesta completa como texto.
 
+    Lanza RuntimeError si la librería no está instalada o la llamada falla, en
+    lugar de devolver None (que la UI mostraría como "None").
+    """
+    if not _HAS_OLLAMA_PY:
+        raise RuntimeError("La librería 'ollama' no está instalada (pip install ollama).")
+    try:
+        resp = prefix_cache.chat(model=model_name, messages=messages, state=state)
+    except Exception as e:
+        raise RuntimeError(f"Error al invocar la librería Ollama: {e}")
+    return chunk_text(resp).strip()
 
 
-def call_ollama(prompt: str, model_name: str, timeout: int = 60) -> str:
-    """Llama a Ollama usando la librería Python si está disponible, si no usa la CLI.
-    Devuelve la respuesta como texto.
-    """
-   
+def stream_ollama(messages, model_name: str, state=None):
+    """Igual que `call_ollama` pero produce la respuesta por fragmentos según se genera."""
+    if not _HAS_OLLAMA_PY:
+        raise RuntimeError("La librería 'ollama' no está instalada (pip install ollama).")
     try:
-            # Usar una API genérica: ollama.chat(...) o similar
-            # Intentamos varias firmas comunes para ser robustos
-            if hasattr(ollama, "chat"):
-                print("llamada1")
-                resp = ollama.chat(model=model_name, messages=prompt)
-                # resp puede ser dict o str
-                if isinstance(resp, dict):
-                    return resp.get("message", {}).get("content", "").strip()
-                else:
-                    return resp.message.content.strip()
-            else:
-                # No reconocemos la API; fallback a CLI
-                raise RuntimeError("La librería 'ollama' está presente pero su API no es conocida.")
+        for part in prefix_cache.chat(model=model_name, messages=messages, stream=True, state=state):
+            yield chunk_text(part)
     except Exception as e:
-            # Fallback a CLI si la biblioteca falla
-            print(f"ollama lib error, fallback a CLI: {e}")
+        raise RuntimeError(f"Error al invocar la librería Ollama: {e}")
 
 
+def _produce(messages, state, model_name: str):
+    """Stream de la librería para el contexto del modelo, reutilizando el ya evaluado (ver ollama_backend.prefix_cache)."""
+    return stream_ollama(messages, model_name, state=state)
 
-def _handle_submit(model_name: str, timeout: int = 60):
-    """Callback to handle form submit: read user_input from session_state, call Ollama, append messages and clear input."""
-    user_input_val = st.session_state.get('user_input', '')
-    if not user_input_val:
-        return
-    # Añadir mensaje de usuario
-    st.session_state.messages.append({"role": "user", "content": user_input_val})
-    response_text = None
-    try:
-        response_text = call_ollama(st.session_state.messages, model_name, timeout=timeout)
-    except Exception as e_cli:
-        response_text = f"Error llamando a Ollama via CLI: {e_cli}"
-
-    st.session_state.messages.append({"role": "assistant", "content": response_text})
-    # Clear the input field in session_state (safe inside callback)
-    st.session_state['user_input'] = ''
-
-
-# Use a form with a submit callback to handle sending and clearing reliably
-with st.form("chat_form"):
-    user_input = st.text_input("Tu mensaje:", key="user_input")
-    # form_submit_button supports on_click; pass the model name via args
-    send = st.form_submit_button("Enviar", on_click=_handle_submit, args=(model,))
-  
-
-# Display messages
-for m in st.session_state.messages:
-    role = m.get("role")
-    content = m.get("content")
-    if role == "user":
-        st.markdown(f"**Tú:** {content}")
-    else:
-        st.markdown(f"**Ollama:** {content}")
+
+# UI: barra lateral y conversación comunes con la variante de la CLI (chat_page.py)
+render(_produce, MODEL, HISTORY_PAGE, default_compactor(), "Error llamando a Ollama")
 
 
 # Small footer
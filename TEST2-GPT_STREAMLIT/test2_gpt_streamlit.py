@@ -1,86 +1,74 @@
 import streamlit as st
 import subprocess
 import os
-from typing import List, Dict, Any
+import sys
+
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo y
+# la página de chat común a las dos variantes (chat_page.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ollama_backend.cli_pool import CLIError, run_prompt, stream_prompt
+from ollama_backend.compaction import default_compactor
+from ollama_backend.prompt import PromptBuilder
+from ollama_backend.residency import default_residency
+from chat_page import render
 
 # Config
 MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")  # Default model name, user can set OLLAMA_MODEL env var
+# Mensajes visibles del chat; los anteriores se cargan por páginas bajo demanda (0 = todos)
+HISTORY_PAGE = int(os.environ.get("STREAMLIT_HISTORY_PAGE", "20"))
+
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS y sigue qué hay cargado en
+# cada servidor (ver ollama_backend.residency); solo arranca una vez por proceso
+default_residency().start()
 
 st.set_page_config(page_title="Chat con Ollama", layout="wide")
 
 st.title("Chat con Ollama")
 
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
-
-# UI
-with st.sidebar:
-    st.header("Configuración")
-    model = st.text_input("Modelo Ollama", value=MODEL)
-    clear = st.button("Limpiar chat")
-    if clear:
-        st.session_state.messages = []
-        st.session_state['user_input'] = ''
-        try:
-            st.experimental_rerun()
-        except Exception:
-            pass
-
-
-
 
 def call_ollama_cli(prompt: str, model_name: str, timeout: int = 60) -> str:
-    """Llama a ollama CLI usando subprocess.run(['ollama','run', model, prompt]) y devuelve la respuesta de texto.
-    Usa capture_output y encoding utf-8 tal como solicitaste.
+    """Llama a la CLI `ollama run <model>` y devuelve la respuesta de texto.
+    Usa el pool de procesos persistentes de `ollama_backend.cli_pool` (un proceso
+    por mensaje solo si el pool no está disponible).
     """
     try:
-        # Construir comando como lista para evitar problemas de shell
-        cmd = ["ollama", "run", model_name, prompt]
-        proc = subprocess.run(cmd, capture_output=True, encoding="utf-8", timeout=timeout)
-        if proc.returncode != 0:
-            raise RuntimeError(f"Ollama CLI error: {proc.stderr}")
-        return proc.stdout.strip()
+        return run_prompt(prompt, model_name, timeout=timeout)
+    except CLIError as e:
+        raise RuntimeError(f"Ollama CLI error: {e}")
     except FileNotFoundError:
         raise RuntimeError("Comando 'ollama' no encontrado. Instala Ollama y asegúrate de que esté en PATH.")
     except subprocess.TimeoutExpired:
         raise RuntimeError("La llamada a Ollama via CLI expiró (timeout).")
 
 
-def _handle_submit(model_name: str, timeout: int = 60):
-    """Callback to handle form submit: read user_input from session_state, call Ollama, append messages and clear input."""
-    user_input_val = st.session_state.get('user_input', '')
-    if not user_input_val:
-        return
-    # Añadir mensaje de usuario
-    st.session_state.messages.append({"role": "user", "content": user_input_val})
-    # Concatenate conversation into a single prompt for CLI
-    prompt = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages])
-    response_text = None
+def stream_ollama_cli(prompt: str, model_name: str, timeout: int = 60):
+    """Igual que `call_ollama_cli` pero produce la respuesta por fragmentos según se genera."""
     try:
-        response_text = call_ollama_cli(prompt, model_name, timeout=timeout)
-    except Exception as e_cli:
-        response_text = f"Error llamando a Ollama via CLI: {e_cli}"
-
-    st.session_state.messages.append({"role": "assistant", "content": response_text})
-    # Clear the input field in session_state (safe inside callback)
-    st.session_state['user_input'] = ''
-
-
-# Use a form with a submit callback to handle sending and clearing reliably
-with st.form("chat_form"):
-    user_input = st.text_input("Tu mensaje:", key="user_input")
-    # form_submit_button supports on_click; pass the model name via args
-    send = st.form_submit_button("Enviar", on_click=_handle_submit, args=(model,))
-  
-
-# Display messages
-for m in st.session_state.messages:
-    role = m.get("role")
-    content = m.get("content")
-    if role == "user":
-        st.markdown(f"**Tú:** {content}")
-    else:
-        st.markdown(f"**Ollama:** {content}")
+        for fragment in stream_prompt(prompt, model_name, timeout=timeout):
+            yield fragment
+    except CLIError as e:
+        raise RuntimeError(f"Ollama CLI error: {e}")
+    except FileNotFoundError:
+        raise RuntimeError("Comando 'ollama' no encontrado. Instala Ollama y asegúrate de que esté en PATH.")
+    except subprocess.TimeoutExpired:
+        raise RuntimeError("La llamada a Ollama via CLI expiró (timeout).")
+
+
+def _produce(messages, state, model_name: str):
+    """Stream de la CLI para el contexto del modelo.
+
+    El contexto (resumen de los turnos antiguos + turnos recientes que caben en el
+    presupuesto de tokens) se renderiza en un único prompt para la CLI, reutilizando
+    el prefijo ya renderizado: cada turno solo añade los mensajes nuevos y se rehace
+    si la ventana se recorta o se resume (ver ollama_backend.prompt).
+    """
+    builder = state.setdefault("prompt", PromptBuilder(lambda m: f"{m['role']}: {m['content']}"))
+    return stream_ollama_cli(builder.build(messages), model_name)
+
+
+# UI: barra lateral y conversación comunes con la variante de la librería (chat_page.py)
+render(_produce, MODEL, HISTORY_PAGE, default_compactor("cli"), "Error llamando a Ollama via CLI")
 
 
 # Small footer
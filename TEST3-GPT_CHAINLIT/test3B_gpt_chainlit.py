@@ -5,66 +5,78 @@ Versión alternativa que usa la librería Python de Ollama (si está disponible)
 en lugar de invocar el CLI por subprocess.
 
 Comportamiento principal:
- - Mantiene un historial global como lista de diccionarios: {'role': 'user'|'assistant'|'system', 'content': str}
+ - Mantiene un historial por sesión de Chainlit como lista de diccionarios:
+   {'role': 'user'|'assistant'|'system', 'content': str} (ver ollama_backend.history)
  - Al enviar la petición al modelo usa la interfaz de la librería (si existe)
    y pasa la lista de mensajes (no un único prompt concatenado).
+ - Usa el cliente asíncrono `ollama.AsyncClient` con `stream=True` y envía los
+   tokens a la UI con `cl.Message.stream_token` según llegan.
  - Variables de entorno:
      OLLAMA_MODEL: modelo por defecto (ej: 'llama2')
      OLLAMA_SYSTEM_PROMPT: (opcional) prompt system inicial
+     OLLAMA_HOSTS: (opcional) servidores Ollama entre los que repartir las peticiones
 
 Uso:
   chainlit run tres3B_gpt_chainlit.py
 
-Nota: adapta la función `call_ollama_lib` según la API exacta de la librería
-de Ollama que tengas instalada; el código intenta varios patrones y admite
-respuestas en distintos formatos.
+Nota: adapta la función `stream_ollama_lib` según la API exacta de la librería
+de Ollama que tengas instalada.
 """
 
-import os
 import asyncio
-from typing import Optional, List, Dict, Any
+import os
+import sys
+from typing import AsyncIterator, Optional, List, Dict, Any
 
 import chainlit as cl
-import ollama
-
-# Historial global: lista de dicts con keys: role, content
-HISTORY: List[Dict[str, str]] = []
-
-
-def _append_history(role: str, content: str, max_turns: int) -> None:
-    HISTORY.append({"role": role, "content": content})
-    max_msgs = max_turns * 2
-    if len(HISTORY) > max_msgs:
-        del HISTORY[0 : len(HISTORY) - max_msgs]
-
-
-def _build_messages(system_prompt: Optional[str]) -> List[Dict[str, str]]:
-    msgs: List[Dict[str, str]] = []
-    if system_prompt:
-        msgs.append({"role": "system", "content": system_prompt})
-
-    msgs.extend(HISTORY)
-    return msgs
-
-
-async def call_ollama_lib(messages: List[Dict[str, str]], model: str) -> str:
-    """Intenta usar la librería Python de Ollama para generar una respuesta
 
-    El comportamiento exacto depende de la versión de la librería. Aquí
-    intentamos varios patrones conocidos y parseamos el resultado de forma
-    flexible.
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.cancellation import default_cancellations
+from ollama_backend.compaction import default_compactor
+from ollama_backend.history import SessionHistoryStore
+from ollama_backend.residency import default_residency
+from ollama_backend.scheduler import QueueFull, default_scheduler
+from ollama_backend import prefix_cache
+from ollama_backend.streaming import chunk_text
+
+# Historial por sesión: cada sesión de Chainlit tiene su lista de dicts con
+# keys role, content, acotada por turnos y por presupuesto de tokens del prompt
+# (el system prompt queda fijado) y con expiración por inactividad. Los turnos
+# antiguos se resumen en segundo plano tras cada respuesta en lugar de perderse.
+HISTORY = SessionHistoryStore(
+    max_turns=int(os.getenv("OLLAMA_HISTORY_TURNS", "6")),
+    system_prompt=os.getenv("OLLAMA_SYSTEM_PROMPT"),
+    compactor=default_compactor(),
+)
+
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS, sigue qué hay cargado en
+# cada servidor y carga ya el modelo del chat (ver ollama_backend.residency)
+default_residency().start()
+default_residency().warm(os.getenv("OLLAMA_MODEL", "llama2"))
+
+
+def _append_history(session_id: str, role: str, content: str) -> None:
+    HISTORY.append(session_id, role, content)
+
+
+def _build_messages(session_id: str) -> List[Dict[str, str]]:
+    # System prompt + ventana del historial que cabe en el presupuesto de tokens
+    return HISTORY.messages(session_id)
+
+
+async def stream_ollama_lib(
+    messages: List[Dict[str, str]], model: str, state: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[str]:
+    """Usa la librería Python de Ollama (cliente asíncrono) y produce los
+    fragmentos de texto según los devuelve `AsyncClient.chat(..., stream=True)`.
+
+    `state` es el estado de la sesión en el que se guarda el contexto ya
+    evaluado por el modelo (ver `ollama_backend.prefix_cache`).
     """
-    
-
-    # Pattern 1: librería con función 'chat' o 'generate' estilo simple
     try:
-        if hasattr(ollama, "chat"):
-            print("call ollama lib chat")
-            resp = ollama.chat(model=model, messages=messages)
-            if isinstance(resp, dict):
-                    return resp.get("message", {}).get("content", "").strip()
-            else:
-                    return resp.message.content.strip()
+        async for part in await prefix_cache.achat(model=model, messages=messages, stream=True, state=state):
+            yield chunk_text(part)
     except Exception as e:
         raise RuntimeError(f"Error al invocar la librería Ollama: {e}")
 
@@ -81,31 +93,87 @@ async def main(message):
         await cl.Message(content="Escribe algo para enviar al modelo.").send()
         return
 
-    max_turns = int(os.getenv("OLLAMA_HISTORY_TURNS", "6"))
-    system_prompt = os.getenv("OLLAMA_SYSTEM_PROMPT")
     model = os.getenv("OLLAMA_MODEL", "llama2")
+    session_id = cl.context.session.id
 
-    # Añadir mensaje del usuario al historial (role/content dicts)
-    _append_history("user", prompt, max_turns)
+    # Añadir mensaje del usuario al historial de la sesión (role/content dicts)
+    _append_history(session_id, "user", prompt)
 
     # Construir la lista de mensajes (system + historial)
-    messages = _build_messages(system_prompt)
+    messages = _build_messages(session_id)
 
-    await cl.Message(content="Procesando con la librería Ollama...").send()
+    # Mensaje vacío que se va rellenando con los tokens según llegan
+    reply = cl.Message(content="")
+    await reply.send()
 
+    # El botón de parar de Chainlit cancela esta tarea (CancelledError); un mensaje
+    # nuevo de la sesión o cerrar el chat cancelan el token y se deja de leer. En
+    # ambos casos el stream se cierra y con él la generación en Ollama.
+    generation = default_cancellations().start(session_id)
     try:
-        resp_text = await asyncio.to_thread(lambda: asyncio.run(call_ollama_lib(messages, model)))
+        # Turno en el planificador compartido (límite de generaciones simultáneas y cola
+        # repartida por sesiones); QueueFull si la cola está llena
+        with generation, default_scheduler().enqueue(session_id) as ticket:
+            queued = False
+            async for position in ticket.await_turn():
+                if generation.cancelled:
+                    break
+                queued = True
+                reply.content = f"En cola (posición {position})..."
+                await reply.update()
+            if queued:
+                reply.content = ""
+                await reply.update()
+            stream = stream_ollama_lib(messages, model, state=HISTORY.state(session_id))
+            async for token in generation.aguard(stream, text=str):
+                await reply.stream_token(token)
+    except QueueFull as e:
+        reply.content = str(e)
+        await reply.update()
+        return
     except RuntimeError as e:
-        await cl.Message(content=f"Error al invocar librería Ollama: {e}").send()
+        # Se conserva lo recibido antes del fallo (p. ej. si venció un plazo)
+        if reply.content.strip():
+            _append_history(session_id, "assistant", reply.content.strip())
+        reply.content = f"{reply.content.strip()}\n\nError al invocar librería Ollama: {e}".strip()
+        await reply.update()
         return
+    except asyncio.CancelledError:
+        # Botón de parar: se conserva en el historial lo generado hasta el corte
+        if reply.content.strip():
+            _append_history(session_id, "assistant", reply.content.strip())
+        raise
     except Exception as e:
-        await cl.Message(content=f"Error inesperado: {e}").send()
+        reply.content = f"Error inesperado: {e}"
+        await reply.update()
         return
 
+    if generation.reason == "superseded":
+        # El usuario ya envió otro mensaje: esa petición continúa la conversación
+        reply.content = f"{reply.content.strip()}\n\n[Respuesta detenida]".strip()
+        await reply.update()
+        return
+
+    resp_text = reply.content.strip()
+
     # Añadir respuesta al historial
-    _append_history("assistant", resp_text, max_turns)
+    _append_history(session_id, "assistant", resp_text)
+
+    reply.content = resp_text
+    await reply.update()
+
+
+@cl.on_stop
+async def on_stop():
+    """Botón de parar: Chainlit cancela la tarea; se anota como parada del usuario."""
+    default_cancellations().cancel(cl.context.session.id)
+
 
-    await cl.Message(content=resp_text).send()
+@cl.on_chat_end
+async def on_chat_end():
+    """Libera el historial de la sesión al cerrarse el chat."""
+    default_cancellations().cancel(cl.context.session.id, "disconnect")
+    HISTORY.clear(cl.context.session.id)
 
 
 if __name__ == "__main__":
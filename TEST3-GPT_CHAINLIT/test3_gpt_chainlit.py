@@ -11,45 +11,34 @@ Uso:
   - ejecutar: `chainlit run tres3_gpt_chainlit.py`
 
 Notas:
-  - Este archivo usa llamadas de bloqueo a través de asyncio.to_thread para no
-    bloquear el loop de Chainlit.
+  - Las llamadas a la CLI usan el pool de sesiones `ollama run` persistentes
+    (ver `ollama_backend.cli_pool.astream_prompt`): no bloquean el loop de
+    Chainlit y solo ocupan un thread mientras un worker genera la respuesta.
+  - La respuesta se envía en streaming (`cl.Message.stream_token`) a medida
+    que la CLI la va escribiendo.
   - Asegúrate de tener Ollama instalado y el modelo descargado/instalado localmente.
 """
 
 import os
-import subprocess
+import sys
 import asyncio
-import shlex
-from typing import Optional, List, Tuple
+from typing import Optional
 
 import chainlit as cl
 
-
-def _call_ollama_sync(prompt: str, model: str) -> str:
-    """Llama a Ollama usando subprocess de forma sincrónica.
-
-    Por defecto construye el comando: ['ollama', 'run', model, '--prompt', prompt]
-    Si quieres usar un template distinto, exporta OLLAMA_CMD_TEMPLATE con
-    las variables {model} y {prompt} (se pasará a shell=False si es una lista
-    separada por espacios; para seguridad se recomienda no usar shell=True).
-    """
-
- 
-    cmd = ["ollama", "run", model, prompt]
-    try:
-        proc  = subprocess.run(cmd, capture_output=True, encoding="utf-8", timeout=60)
-        return proc.stdout.strip() or proc.stderr.strip() or "(sin salida)"
-    except subprocess.CalledProcessError as e:
-        # Devolver una descripción del error para mostrarla en la UI
-        stderr = e.stderr.strip() if e.stderr else ""
-        stdout = e.stdout.strip() if e.stdout else ""
-        raise RuntimeError(f"Ollama retornó código {e.returncode}. stdout={stdout} stderr={stderr}")
-    except FileNotFoundError:
-        raise RuntimeError("No se encontró el ejecutable 'ollama' en PATH. Instala Ollama y asegúrate que esté en PATH.")
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.cancellation import default_cancellations
+from ollama_backend.cli_pool import CLIError, arun_prompt, astream_prompt
+from ollama_backend.compaction import default_compactor
+from ollama_backend.history import SessionHistoryStore
+from ollama_backend.prompt import PromptBuilder
+from ollama_backend.residency import default_residency
+from ollama_backend.scheduler import default_scheduler
 
 
 async def call_ollama(prompt: str, model: Optional[str] = None) -> str:
-    """Wrapper asíncrono que ejecuta la llamada a Ollama en un thread.
+    """Llama a Ollama a través de la CLI sin bloquear el event loop.
 
     Args:
         prompt: texto del usuario
@@ -59,37 +48,65 @@ async def call_ollama(prompt: str, model: Optional[str] = None) -> str:
     """
     print("call ollama")
     model = model or os.getenv("OLLAMA_MODEL", "llama3.2")
-    # Ejecutar en thread para evitar bloquear el event loop
-    return await asyncio.to_thread(_call_ollama_sync, prompt, model)
+    try:
+        return await arun_prompt(prompt, model, timeout=60) or "(sin salida)"
+    except CLIError as e:
+        # Devolver una descripción del error para mostrarla en la UI
+        raise RuntimeError(f"Ollama retornó error: {e}")
+    except FileNotFoundError:
+        raise RuntimeError("No se encontró el ejecutable 'ollama' en PATH. Instala Ollama y asegúrate que esté en PATH.")
 
 
-# Simple historial en memoria (lista global de tuplas (role, content)).
-_HISTORY: List[Tuple[str, str]] = []
+async def stream_ollama(prompt: str, model: Optional[str] = None):
+    """Versión en streaming de `call_ollama`: produce fragmentos de texto según
+    los escribe la CLI, sin bloquear el event loop.
+    """
+    model = model or os.getenv("OLLAMA_MODEL", "llama3.2")
+    try:
+        async for fragment in astream_prompt(prompt, model, timeout=60):
+            yield fragment
+    except CLIError as e:
+        raise RuntimeError(f"Ollama retornó error: {e}")
+    except FileNotFoundError:
+        raise RuntimeError("No se encontró el ejecutable 'ollama' en PATH. Instala Ollama y asegúrate que esté en PATH.")
+
 
+# Historial en memoria por sesión de Chainlit (cada usuario tiene el suyo),
+# acotado por turnos y por presupuesto de tokens del prompt (el system prompt
+# queda fijado) y con expiración de sesiones inactivas. Los turnos antiguos se
+# resumen en segundo plano tras cada respuesta en lugar de perderse.
+_HISTORY = SessionHistoryStore(
+    max_turns=int(os.getenv("OLLAMA_HISTORY_TURNS", "10")),
+    system_prompt=os.getenv("OLLAMA_SYSTEM_PROMPT"),
+    compactor=default_compactor("cli"),
+)
 
-def _append_history(role: str, content: str, max_turns: int):
-    """Añade un (role, content) al historial global y recorta a max_turns."""
-    _HISTORY.append((role, content))
-    # Mantener solo los últimos (max_turns * 2) mensajes (user+assistant por turno)
-    max_msgs = max_turns * 2
-    if len(_HISTORY) > max_msgs:
-        del _HISTORY[0 : len(_HISTORY) - max_msgs]
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS, sigue qué hay cargado en
+# cada servidor y carga ya el modelo del chat (ver ollama_backend.residency)
+default_residency().start()
+default_residency().warm(os.getenv("OLLAMA_MODEL", "llama3.2"))
 
 
-def _build_prompt_from_history(system_prompt: Optional[str]) -> str:
-    parts: List[str] = []
-    if system_prompt:
-        parts.append(system_prompt.strip())
+def _append_history(session_id: str, role: str, content: str):
+    """Añade un (role, content) al historial de la sesión (el store recorta a max_turns y al presupuesto de tokens)."""
+    _HISTORY.append(session_id, role, content)
 
-    for role, content in _HISTORY:
-        if role == "user":
-            parts.append(f"User: {content}")
-        else:
-            parts.append(f"Assistant: {content}")
 
-    # Añadir una señal para que el modelo responda
-    parts.append("Assistant:")
-    return "\n".join(parts)
+def _render_message(m) -> str:
+    role, content = m["role"], m["content"]
+    if role == "system":
+        return content.strip()
+    elif role == "user":
+        return f"User: {content}"
+    return f"Assistant: {content}"
+
+
+def _build_prompt_from_history(session_id: str) -> str:
+    # El texto ya renderizado se guarda con la sesión y cada turno solo añade los
+    # mensajes nuevos (ver ollama_backend.prompt); al final, una señal para que el
+    # modelo responda
+    builder = _HISTORY.state(session_id).setdefault("prompt", PromptBuilder(_render_message, suffix="\nAssistant:"))
+    return builder.build(_HISTORY.messages(session_id))
 
 
 @cl.on_message
@@ -112,31 +129,79 @@ async def main(message):  # message puede ser str o un objeto Message de Chainli
         await cl.Message(content="Por favor escribe algo para enviar al modelo.").send()
         return
 
-    # Opciones de historial
-    max_turns = int(os.getenv("OLLAMA_HISTORY_TURNS", "10"))
-    system_prompt = os.getenv("OLLAMA_SYSTEM_PROMPT")
+    session_id = cl.context.session.id
 
-    # Añadir el mensaje del usuario al historial global
-    _append_history("user", prompt, max_turns)
+    # Añadir el mensaje del usuario al historial de la sesión
+    _append_history(session_id, "user", prompt)
 
-    # Construir prompt que incluye el historial global
-    assembled_prompt = _build_prompt_from_history(system_prompt)
+    # Construir prompt que incluye el historial de la sesión
+    assembled_prompt = _build_prompt_from_history(session_id)
 
-    # Feedback inmediato
-    await cl.Message(content="Procesando tu petición con Ollama...").send()
+    # Mensaje vacío que se va rellenando con la respuesta (feedback inmediato)
+    reply = cl.Message(content="")
+    await reply.send()
 
+    # El botón de parar de Chainlit cancela esta tarea (CancelledError); un mensaje
+    # nuevo de la sesión o cerrar el chat cancelan el token y se deja de leer. En
+    # ambos casos el stream se cierra y con él la generación en Ollama.
+    generation = default_cancellations().start(session_id)
     try:
-        response = await call_ollama(assembled_prompt)
+        # Turno en el planificador compartido (límite de generaciones simultáneas y cola
+        # repartida por sesiones); QueueFull si la cola está llena
+        with generation, default_scheduler().enqueue(session_id) as ticket:
+            queued = False
+            async for position in ticket.await_turn():
+                if generation.cancelled:
+                    break
+                queued = True
+                reply.content = f"En cola (posición {position})..."
+                await reply.update()
+            if queued:
+                reply.content = ""
+                await reply.update()
+            async for fragment in generation.aguard(stream_ollama(assembled_prompt), text=str):
+                await reply.stream_token(fragment)
+    except asyncio.CancelledError:
+        # Botón de parar: se conserva en el historial lo generado hasta el corte
+        if reply.content.strip():
+            _append_history(session_id, "assistant", reply.content.strip())
+        raise
     except Exception as e:
-        # Mostrar error al usuario
-        await cl.Message(content=f"Error al invocar Ollama: {e}").send()
+        # Mostrar error al usuario debajo de lo recibido antes del fallo (p. ej. si
+        # venció un plazo), que se conserva en el historial
+        if reply.content.strip():
+            _append_history(session_id, "assistant", reply.content.strip())
+        reply.content = f"{reply.content.strip()}\n\nError al invocar Ollama: {e}".strip()
+        await reply.update()
         return
 
+    if generation.reason == "superseded":
+        # El usuario ya envió otro mensaje: esa petición continúa la conversación
+        reply.content = f"{reply.content.strip()}\n\n[Respuesta detenida]".strip()
+        await reply.update()
+        return
+
+    response = reply.content.strip() or "(sin salida)"
+
     # Guardar respuesta del assistant en el historial
-    _append_history("assistant", response, max_turns)
+    _append_history(session_id, "assistant", response)
 
     # Enviar la respuesta final
-    await cl.Message(content=response).send()
+    reply.content = response
+    await reply.update()
+
+
+@cl.on_stop
+async def on_stop():
+    """Botón de parar: Chainlit cancela la tarea; se anota como parada del usuario."""
+    default_cancellations().cancel(cl.context.session.id)
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    """Libera el historial de la sesión al cerrarse el chat."""
+    default_cancellations().cancel(cl.context.session.id, "disconnect")
+    _HISTORY.clear(cl.context.session.id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,383 @@
+"""
+test4_gpt_api.py
+
+API HTTP compatible con OpenAI sobre `ollama_backend`, sin interfaz de chat.
+
+Las variantes TEST1-TEST3 solo se pueden usar a través de Gradio, Streamlit o
+Chainlit. Esta variante expone la misma capa compartida como un servicio
+asíncrono para clientes automáticos (pruebas de carga, otros servicios), que
+así no pagan el coste de pintar ninguna UI y permiten medir el rendimiento del
+backend por sí solo.
+
+Comportamiento principal:
+ - POST /v1/chat/completions con el formato de la API de OpenAI: `model`,
+   `messages` y opcionalmente `stream`, `temperature`, `top_p`, `seed`, `stop`,
+   `max_tokens` y `user`. Con `stream: true` la respuesta se envía como
+   Server-Sent Events (`chat.completion.chunk` y al final `data: [DONE]`); con
+   `stream_options.include_usage` se añade un último evento con el uso de tokens.
+ - El cliente envía la conversación completa en cada petición, como en la API
+   de OpenAI. Se recorta a la ventana de tokens (`window_messages`, mismo
+   presupuesto que las apps) y, si no trae mensaje system, se añade
+   OLLAMA_SYSTEM_PROMPT.
+ - Por defecto usa la librería (`prefix_cache.achat`, como test3B): caché de
+   respuestas (si OLLAMA_CACHE=1), deduplicación de peticiones en curso, router,
+   plazos y reutilización del prefijo. Una petición con `temperature` > 0 y sin
+   `seed` no usa ni la caché ni la deduplicación: cada una genera su respuesta. Con OLLAMA_API_BACKEND=cli usa `ollama run`
+   (`cli_pool.astream_prompt`, como test3); la CLI no admite las opciones de
+   generación y una petición que las indique se rechaza con 400.
+ - Cada petición pasa por el planificador compartido; si la cola está llena se
+   responde 429 al momento. `user` (o la cabecera X-Session-Id) identifica la
+   sesión para repartir la cola y guardar el contexto reutilizable
+   (OLLAMA_CONTEXT_REUSE); sin él cada petición es su propia sesión.
+ - Si el cliente cierra la conexión durante un stream, la generación se cancela
+   y se libera su hueco en el planificador.
+ - GET /v1/models lista OLLAMA_MODEL y los modelos cargados en los servidores;
+   GET /stats devuelve las métricas de la caché, el router, el planificador, etc.
+
+Los errores usan el formato de OpenAI ({"error": {"message", "type", "code"}}):
+400 petición no válida (incluidos los tipos de las opciones), 404 modelo no encontrado, 429 cola llena, 502 fallo de
+Ollama, 503 ningún servidor disponible y 504 plazo vencido. En un stream ya
+empezado el error se envía como último evento antes de `data: [DONE]`.
+
+Variables de entorno:
+     OLLAMA_MODEL: modelo si la petición no indica ninguno (por defecto llama3.2)
+     OLLAMA_SYSTEM_PROMPT: (opcional) prompt system si la conversación no trae uno
+     OLLAMA_API_BACKEND: "lib" (por defecto) o "cli"
+     OLLAMA_API_HOST: interfaz en la que escucha (por defecto 127.0.0.1)
+     OLLAMA_API_PORT: puerto (por defecto 8000)
+     OLLAMA_API_TIMEOUT: segundos máximos por respuesta con la CLI (por defecto 60)
+     OLLAMA_HOSTS: (opcional) servidores Ollama entre los que repartir las peticiones
+
+Uso:
+  python test4_gpt_api.py
+  (o bien: uvicorn test4_gpt_api:app --port 8000)
+
+  curl http://127.0.0.1:8000/v1/chat/completions -H "Content-Type: application/json" \\
+       -d '{"model": "llama3.2", "messages": [{"role": "user", "content": "Hola"}], "stream": true}'
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+# Permite importar el paquete compartido `ollama_backend` desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend import prefix_cache
+from ollama_backend.cache import default_cache
+from ollama_backend.cancellation import default_cancellations
+from ollama_backend.cli_pool import arun_prompt, astream_prompt
+from ollama_backend.deadlines import DeadlineExceeded
+from ollama_backend.history import SessionHistoryStore
+from ollama_backend.residency import default_residency
+from ollama_backend.router import BackendUnavailable, default_router
+from ollama_backend.scheduler import QueueFull, Ticket, default_scheduler
+from ollama_backend.singleflight import default_singleflight
+from ollama_backend.streaming import chunk_text
+from ollama_backend.window import default_counter, window_messages
+
+DEFAULT_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+SYSTEM_PROMPT = os.getenv("OLLAMA_SYSTEM_PROMPT")
+API_BACKEND = os.getenv("OLLAMA_API_BACKEND", "lib")
+API_HOST = os.getenv("OLLAMA_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("OLLAMA_API_PORT", "8000"))
+CLI_TIMEOUT = float(os.getenv("OLLAMA_API_TIMEOUT", "60"))
+
+ROLES = ("system", "user", "assistant")
+
+# Solo se usa el estado de cada sesión (contexto de `prefix_cache`), que caduca
+# por inactividad igual que en las apps; el historial lo envía el cliente
+_SESSIONS = SessionHistoryStore()
+
+# Precarga y fija los modelos de OLLAMA_PRELOAD_MODELS y carga ya el modelo por defecto
+default_residency().start()
+default_residency().warm(DEFAULT_MODEL)
+
+app = FastAPI(title="Ollama (API compatible con OpenAI)")
+
+
+class InvalidRequest(ValueError):
+    """La petición no tiene el formato de la API de chat de OpenAI."""
+
+
+def _error(status: int, message: str, type_: str, code: Optional[str] = None) -> JSONResponse:
+    return JSONResponse({"error": {"message": message, "type": type_, "param": None, "code": code}}, status_code=status)
+
+
+def _describe_error(e: BaseException) -> Tuple[int, str, str, Optional[str]]:
+    """(estado HTTP, mensaje, tipo, código) de un error del backend."""
+    if isinstance(e, InvalidRequest):
+        return 400, str(e), "invalid_request_error", None
+    if isinstance(e, QueueFull):
+        return 429, str(e), "rate_limit_error", "queue_full"
+    if isinstance(e, BackendUnavailable):
+        return 503, str(e), "server_error", "backend_unavailable"
+    if isinstance(e, (DeadlineExceeded, TimeoutError, subprocess.TimeoutExpired)):
+        return 504, f"Ollama no respondió a tiempo: {e}", "server_error", "timeout"
+    if getattr(e, "status_code", None) == 404:
+        # ollama.ResponseError: el modelo no existe en el servidor
+        return 404, str(getattr(e, "error", e)), "invalid_request_error", "model_not_found"
+    if isinstance(e, FileNotFoundError):
+        return 502, "No se encontró el ejecutable 'ollama' en PATH.", "server_error", None
+    return 502, f"Error al invocar Ollama: {e}", "server_error", None
+
+
+def _option(body: Dict[str, Any], key: str, integer: bool = False) -> Any:
+    """Valor numérico de una opción de generación (None si no viene); InvalidRequest si no es del tipo esperado."""
+    value = body.get(key)
+    if value is None:
+        return None
+    # bool es subclase de int, pero `true` no es un número válido en la API
+    expected = (int,) if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise InvalidRequest(f"'{key}' debe ser un {'entero' if integer else 'número'}.")
+    return value
+
+
+def _parse_request(body: Any, headers) -> Dict[str, Any]:
+    """Valida el cuerpo de la petición y lo traduce a los parámetros del backend."""
+    if not isinstance(body, dict):
+        raise InvalidRequest("El cuerpo debe ser un objeto JSON.")
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise InvalidRequest("'messages' debe ser una lista no vacía.")
+    clean: List[Dict[str, str]] = []
+    for i, m in enumerate(messages):
+        if not isinstance(m, dict) or m.get("role") not in ROLES:
+            raise InvalidRequest(f"messages[{i}]: 'role' debe ser uno de {', '.join(ROLES)}.")
+        content = m.get("content")
+        if isinstance(content, list):
+            # Formato por partes: solo se usan las de texto
+            content = "".join(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+        if not isinstance(content, str):
+            raise InvalidRequest(f"messages[{i}]: 'content' debe ser texto.")
+        clean.append({"role": m["role"], "content": content})
+    if SYSTEM_PROMPT and clean[0]["role"] != "system":
+        clean.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+
+    options: Dict[str, Any] = {}
+    for key, integer in (("temperature", False), ("top_p", False), ("seed", True)):
+        value = _option(body, key, integer)
+        if value is not None:
+            options[key] = value
+    max_tokens = _option(body, "max_completion_tokens", True)
+    if max_tokens is None:
+        max_tokens = _option(body, "max_tokens", True)
+    if max_tokens is not None:
+        if max_tokens < 1:
+            raise InvalidRequest("'max_tokens' debe ser mayor que 0.")
+        options["num_predict"] = max_tokens
+    stop = body.get("stop")
+    if stop:
+        stop = [stop] if isinstance(stop, str) else stop
+        if not isinstance(stop, list) or not all(isinstance(s, str) for s in stop):
+            raise InvalidRequest("'stop' debe ser un texto o una lista de textos.")
+        options["stop"] = stop
+    if options and API_BACKEND == "cli":
+        # `ollama run` no recibe opciones de generación: mejor rechazarlas que
+        # devolver una respuesta que no las respeta
+        raise InvalidRequest("Con OLLAMA_API_BACKEND=cli no se admiten 'temperature', 'top_p', 'seed', 'stop' ni 'max_tokens'.")
+
+    return {
+        "model": body.get("model") or DEFAULT_MODEL,
+        "messages": window_messages(clean),
+        "options": options or None,
+        "stream": bool(body.get("stream")),
+        "include_usage": bool((body.get("stream_options") or {}).get("include_usage")),
+        "session_id": body.get("user") or headers.get("x-session-id"),
+    }
+
+
+def _render_message(m: Dict[str, str]) -> str:
+    # Mismo formato que las variantes CLI (test1, test3)
+    if m["role"] == "system":
+        return m["content"].strip()
+    elif m["role"] == "user":
+        return f"User: {m['content']}"
+    return f"Assistant: {m['content']}"
+
+
+def _build_prompt(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(_render_message(m) for m in messages) + "\nAssistant:"
+
+
+def _get(obj: Any, key: str) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def _text(part: Any) -> str:
+    return part if isinstance(part, str) else chunk_text(part)
+
+
+def _usage(messages: List[Dict[str, str]], text: str, final: Any = None) -> Dict[str, int]:
+    """Uso de tokens: el que informa Ollama o, si no lo hay (caché, CLI), una estimación."""
+    counter = default_counter()
+    prompt_tokens = _get(final, "prompt_eval_count") if final is not None else None
+    completion_tokens = _get(final, "eval_count") if final is not None else None
+    if prompt_tokens is None:
+        prompt_tokens = sum(counter.count_message(m) for m in messages)
+    if completion_tokens is None:
+        completion_tokens = counter.count(text)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _finish_reason(final: Any) -> str:
+    return "length" if final is not None and _get(final, "done_reason") == "length" else "stop"
+
+
+def _state(session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    return _SESSIONS.state(session_id) if session_id else None
+
+
+async def _wait_turn(ticket: Ticket) -> None:
+    async for _position in ticket.await_turn():
+        pass
+
+
+async def _complete(req: Dict[str, Any]) -> Tuple[str, Any]:
+    """Respuesta completa: (texto, respuesta final de Ollama o None)."""
+    if API_BACKEND == "cli":
+        return await arun_prompt(_build_prompt(req["messages"]), req["model"], timeout=CLI_TIMEOUT), None
+    resp = await prefix_cache.achat(
+        model=req["model"], messages=req["messages"], state=_state(req["session_id"]), options=req["options"]
+    )
+    return chunk_text(resp).strip(), resp
+
+
+async def _stream(req: Dict[str, Any]) -> AsyncIterator[Any]:
+    """Fragmentos de la respuesta: texto (CLI) o respuestas parciales de Ollama."""
+    if API_BACKEND == "cli":
+        async for fragment in astream_prompt(_build_prompt(req["messages"]), req["model"], timeout=CLI_TIMEOUT):
+            yield fragment
+        return
+    stream = await prefix_cache.achat(
+        model=req["model"], messages=req["messages"], stream=True, state=_state(req["session_id"]), options=req["options"]
+    )
+    async for part in stream:
+        yield part
+
+
+def _event(payload: Any) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+async def _sse(completion_id: str, req: Dict[str, Any], ticket: Ticket) -> AsyncIterator[str]:
+    """Stream SSE de `chat.completion.chunk`, con turno en el planificador y cancelación."""
+    base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": req["model"]}
+
+    def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None) -> str:
+        return _event(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}]))
+
+    # Cerrar la conexión cancela esta tarea (CancelledError): el token deja de leer y
+    # cierra el stream, y con él la generación en Ollama. El token va por petición y
+    # no por sesión: un cliente puede tener varias peticiones en curso a la vez
+    generation = default_cancellations().start(completion_id)
+    parts: List[str] = []
+    final = None
+    try:
+        with generation, ticket:
+            await _wait_turn(ticket)
+            yield chunk({"role": "assistant", "content": ""})
+            async for part in generation.aguard(_stream(req), text=_text):
+                text = _text(part)
+                if _get(part, "done") and not isinstance(part, str):
+                    final = part
+                if text:
+                    parts.append(text)
+                    yield chunk({"content": text})
+    except Exception as e:
+        _status, message, type_, code = _describe_error(e)
+        yield _event({"error": {"message": message, "type": type_, "param": None, "code": code}})
+        yield "data: [DONE]\n\n"
+        return
+    yield chunk({}, _finish_reason(final))
+    if req["include_usage"]:
+        yield _event(dict(base, choices=[], usage=_usage(req["messages"], "".join(parts), final)))
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error(400, "El cuerpo no es JSON válido.", "invalid_request_error")
+    try:
+        req = _parse_request(body, request.headers)
+    except InvalidRequest as e:
+        return _error(*_describe_error(e))
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    # Sin `user` cada petición es su propia sesión en la cola
+    session_id = req["session_id"] or completion_id
+    try:
+        ticket = default_scheduler().enqueue(session_id)
+    except QueueFull as e:
+        return _error(*_describe_error(e))
+
+    if req["stream"]:
+        # El turno se espera dentro del stream; si el cliente se va antes de que
+        # empiece, la tarea de fondo libera el hueco (release es idempotente)
+        return StreamingResponse(
+            _sse(completion_id, req, ticket),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(ticket.release),
+        )
+
+    try:
+        with ticket:
+            await _wait_turn(ticket)
+            text, final = await _complete(req)
+    except Exception as e:
+        return _error(*_describe_error(e))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": req["model"],
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": _finish_reason(final)}
+        ],
+        "usage": _usage(req["messages"], text, final),
+    }
+
+
+@app.get("/v1/models")
+async def list_models():
+    models = {DEFAULT_MODEL}
+    for backend in default_router().backends:
+        models.update(backend.models)
+    return {
+        "object": "list",
+        "data": [{"id": m, "object": "model", "created": 0, "owned_by": "ollama"} for m in sorted(models)],
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Métricas de la capa compartida, para las pruebas de carga."""
+    return {
+        "backend": API_BACKEND,
+        "scheduler": default_scheduler().stats(),
+        "cache": default_cache().stats(),
+        "singleflight": default_singleflight().stats(),
+        "cancellations": default_cancellations().stats(),
+        "router": default_router().stats(),
+        "residency": default_residency().stats(),
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -0,0 +1,6 @@
+"""
+Benchmarks de los PoC contra un servidor Ollama (real o simulado).
+
+Se ejecutan como módulos desde la raíz del repo, p. ej.:
+    python -m benchmarks.prefill_per_turn --turns 12
+"""
@@ -0,0 +1,80 @@
+"""
+Coste de conexión por petición: cliente nuevo frente a cliente compartido.
+
+Lanza la misma petición ligera (`/api/ps`) contra Ollama de dos formas:
+
+ - new: un `ollama.Client` nuevo en cada petición (como crear el cliente
+   dentro del script de Streamlit, que se re-ejecuta en cada interacción);
+   cada petición abre su propia conexión TCP.
+ - shared: el cliente compartido de `ollama_backend.router` (`Backend.client()`),
+   que reutiliza la conexión con keep-alive.
+
+La diferencia entre ambos es la sobrecarga de conexión que se ahorra en cada
+petición (mayor con TLS o con el servidor en otra máquina).
+
+Uso:
+    python -m benchmarks.connection_reuse --requests 200 --modes new,shared
+El resultado se imprime como tabla y, con --json, como JSON.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.router import Backend
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_mode(mode: str, requests: int, host: str):
+    import ollama
+
+    backend = Backend(host)
+    shared = backend.client()
+    # Primera petición fuera de la medida: abre la conexión del cliente compartido
+    shared.ps()
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        if mode == "new":
+            client = ollama.Client(host=backend.url)
+            client.ps()
+            client._client.close()
+        else:
+            shared.ps()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "mode": mode,
+        "requests": requests,
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--modes", default="new,shared")
+    parser.add_argument("--host", default=os.environ.get("OLLAMA_HOST"))
+    parser.add_argument("--json", action="store_true", help="imprime los resultados como JSON")
+    args = parser.parse_args(argv)
+
+    results = [run_mode(mode.strip(), args.requests, args.host) for mode in args.modes.split(",")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'modo':<8} {'peticiones':>10} {'media ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in results:
+        print(f"{row['mode']:<8} {row['requests']:>10} {row['mean_ms']:>9} {row['p50_ms']:>8} {row['p95_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
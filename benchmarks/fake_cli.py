@@ -0,0 +1,142 @@
+"""
+`ollama` simulado para las variantes que usan la CLI.
+
+Igual que la CLI real, `ollama run <model>` es un cliente del servidor de
+OLLAMA_HOST: pide la respuesta a `/api/generate` en streaming y la escribe en
+stdout según llega. Apuntado a `benchmarks.fake_ollama`, el ritmo de las
+respuestas lo decide el perfil del servidor simulado.
+
+Modos, como la CLI real:
+ - `ollama run <model> "prompt"` o con el prompt por stdin (no terminal):
+   escribe la respuesta y termina. Es el modo de un proceso por mensaje de
+   `cli_pool` (OLLAMA_CLI_POOL=0).
+ - Con un terminal (`cli_pool.CLIWorker`): sesión interactiva con el prompt
+   `>>> `, los comandos `/clear`, `/set` y `/bye` y los mensajes pegados entre
+   marcas de "bracketed paste".
+Si el servidor falla, escribe "Error: ..." en stderr y termina con código 1.
+
+`benchmarks/bin/ollama` lo lanza; basta con poner ese directorio al principio
+de PATH (lo hace `benchmarks.load_test`).
+"""
+
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from typing import Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend.router import normalize_host
+
+PROMPT = ">>> \x1b[2mSend a message (/? for help)\x1b[0m"
+PASTE_START = "\x1b[200~"
+PASTE_END = "\x1b[201~"
+
+
+class CLIFailure(Exception):
+    """El servidor devolvió un error; la CLI real lo escribe y termina."""
+
+
+def _out(text: str) -> None:
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def generate(host: str, model: str, prompt: str, keep_alive: Optional[str] = None) -> Iterator[str]:
+    """Fragmentos de `/api/generate` en streaming."""
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+    request = urllib.request.Request(
+        f"{host}/api/generate", data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request) as resp:
+            for line in resp:
+                if not line.strip():
+                    continue
+                part = json.loads(line)
+                if part.get("error"):
+                    raise CLIFailure(part["error"])
+                if part.get("response"):
+                    yield part["response"]
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read() or b"{}").get("error") or str(e)
+        except ValueError:
+            message = str(e)
+        raise CLIFailure(message) from None
+    except urllib.error.URLError as e:
+        raise CLIFailure(f"could not connect to ollama app, is it running? ({e.reason})") from None
+
+
+def _read_message(first: str) -> str:
+    """Mensaje completo: una línea o varias entre las marcas de pegado."""
+    if not first.startswith(PASTE_START):
+        return first
+    lines = [first]
+    while PASTE_END not in lines[-1]:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        lines.append(line.rstrip("\r\n"))
+    return "\n".join(lines).replace(PASTE_START, "").replace(PASTE_END, "")
+
+
+def interactive(host: str, model: str, keep_alive: Optional[str]) -> int:
+    _out(PROMPT)
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            return 0
+        line = line.rstrip("\r\n")
+        if line == "/bye":
+            return 0
+        if line == "/clear":
+            _out("Cleared session context\r\n" + PROMPT)
+            continue
+        if line.startswith("/set"):
+            _out("Set 'nowordwrap' mode.\r\n" + PROMPT)
+            continue
+        if not line.strip():
+            _out("\r\n" + PROMPT)
+            continue
+        message = _read_message(line)
+        # Eco de la entrada (una línea por cada línea del mensaje), como la CLI real
+        _out(">>> " + "\r\n... ".join(message.split("\n")) + "\r\n")
+        for fragment in generate(host, model, message, keep_alive):
+            _out(fragment)
+        _out("\r\n\r\n" + PROMPT)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = list(sys.argv[1:] if argv is None else argv)
+    if len(args) < 2 or args[0] != "run":
+        sys.stderr.write("Error: el ollama simulado solo implementa 'ollama run <model>'\n")
+        return 1
+    model, rest = args[1], args[2:]
+    keep_alive = None
+    if "--keepalive" in rest:
+        index = rest.index("--keepalive")
+        keep_alive = rest[index + 1] if index + 1 < len(rest) else None
+        del rest[index : index + 2]
+    host = normalize_host(os.environ.get("OLLAMA_HOST") or "127.0.0.1")
+    try:
+        if not rest and sys.stdin.isatty():
+            return interactive(host, model, keep_alive)
+        prompt = " ".join(rest) if rest else sys.stdin.read()
+        for fragment in generate(host, model, prompt, keep_alive):
+            _out(fragment)
+        _out("\n")
+    except CLIFailure as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.stderr.flush()
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
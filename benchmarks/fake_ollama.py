@@ -0,0 +1,353 @@
+"""
+Servidor Ollama simulado para pruebas de carga sin modelo.
+
+Implementa lo que usan las variantes y `ollama_backend`: `/api/chat` y
+`/api/generate` (con y sin streaming), `/api/ps`, `/api/tags` y
+`/api/version`. Las respuestas no tienen sentido, pero su ritmo sí:
+
+ - ttft: segundos hasta el primer token, más `prompt_tokens / prefill_tps` si
+   se indica la velocidad de prefill (el prompt cuesta según su longitud).
+ - tps: tokens por segundo de la generación.
+ - jitter: variación aleatoria (fracción, p. ej. 0.2 = ±20 %) del TTFT y de
+   cada hueco entre tokens.
+ - error_rate: fracción de peticiones que fallan con HTTP 500 antes de
+   generar nada.
+ - tokens: longitud de la respuesta (o `num_predict` de la petición).
+ - parallel: peticiones que se generan a la vez, como OLLAMA_NUM_PARALLEL; las
+   demás esperan turno (0 = sin límite).
+ - load_time: segundos de carga la primera vez que se pide un modelo (o tras
+   descargarlo con keep_alive=0).
+
+Se puede lanzar desde código (`with FakeOllama(Profile(ttft=0.2)) as server:`,
+`server.url`) o como proceso, para apuntar las apps a él con OLLAMA_HOST:
+    python -m benchmarks.fake_ollama --port 11435 --ttft 0.2 --tps 40 --jitter 0.2
+`GET /api/fake/stats` devuelve peticiones, errores y concurrencia máxima.
+
+Variables de entorno (valores por defecto de `Profile` y de las opciones):
+     FAKE_OLLAMA_TTFT, FAKE_OLLAMA_TPS, FAKE_OLLAMA_JITTER, FAKE_OLLAMA_ERROR_RATE,
+     FAKE_OLLAMA_TOKENS, FAKE_OLLAMA_PREFILL_TPS, FAKE_OLLAMA_PARALLEL, FAKE_OLLAMA_LOAD_TIME
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+# Palabras con las que se rellenan las respuestas (un token por palabra)
+WORDS = ["respuesta", "simulada", "del", "modelo", "con", "tokens", "a", "ritmo", "fijo", "y", "algo", "de", "ruido"]
+
+TTFT = float(os.environ.get("FAKE_OLLAMA_TTFT", "0.2"))
+TPS = float(os.environ.get("FAKE_OLLAMA_TPS", "50"))
+JITTER = float(os.environ.get("FAKE_OLLAMA_JITTER", "0.1"))
+ERROR_RATE = float(os.environ.get("FAKE_OLLAMA_ERROR_RATE", "0"))
+TOKENS = int(os.environ.get("FAKE_OLLAMA_TOKENS", "64"))
+PREFILL_TPS = float(os.environ.get("FAKE_OLLAMA_PREFILL_TPS", "0"))
+PARALLEL = int(os.environ.get("FAKE_OLLAMA_PARALLEL", "0"))
+LOAD_TIME = float(os.environ.get("FAKE_OLLAMA_LOAD_TIME", "0"))
+
+# Tamaño que se anuncia para cada modelo en /api/ps y /api/tags
+MODEL_SIZE = 2 * 1024**3
+
+
+class Profile:
+    """Ritmo de las respuestas simuladas (ver el docstring del módulo)."""
+
+    def __init__(
+        self,
+        ttft: float = TTFT,
+        tps: float = TPS,
+        jitter: float = JITTER,
+        error_rate: float = ERROR_RATE,
+        tokens: int = TOKENS,
+        prefill_tps: float = PREFILL_TPS,
+        parallel: int = PARALLEL,
+        load_time: float = LOAD_TIME,
+    ):
+        self.ttft = ttft
+        self.tps = tps
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tokens = tokens
+        self.prefill_tps = prefill_tps
+        self.parallel = parallel
+        self.load_time = load_time
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def _vary(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+    def first_token_delay(self, prompt_tokens: int) -> float:
+        prefill = prompt_tokens / self.prefill_tps if self.prefill_tps > 0 else 0.0
+        return self._vary(self.ttft) + prefill
+
+    def token_delay(self) -> float:
+        return self._vary(1 / self.tps) if self.tps > 0 else 0.0
+
+    def generate(self, prompt_tokens: int, num_predict: Optional[int] = None) -> Iterator[str]:
+        """Produce los tokens de una respuesta con el ritmo del perfil (bloquea)."""
+        count = self.tokens if num_predict is None or num_predict < 0 else min(num_predict, self.tokens)
+        time.sleep(self.first_token_delay(prompt_tokens))
+        for i in range(count):
+            if i:
+                time.sleep(self.token_delay())
+            yield WORDS[i % len(WORDS)] + " "
+
+
+def prompt_tokens(texts: List[str]) -> int:
+    # Misma estimación que `ollama_backend.window` (~4 caracteres por token)
+    return max(1, sum(len(t) for t in texts) // 4)
+
+
+class FakeOllama:
+    """Servidor HTTP simulado en un thread; `url` es su dirección base."""
+
+    def __init__(self, profile: Optional[Profile] = None, host: str = "127.0.0.1", port: int = 0):
+        self.profile = profile or Profile()
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+        self.tokens = 0
+        self.loaded: Dict[str, float] = {}
+        self._slots = threading.BoundedSemaphore(self.profile.parallel) if self.profile.parallel > 0 else None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        """Atiende peticiones en el thread actual hasta Ctrl+C."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOllama":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "active": self.active,
+                "max_active": self.max_active,
+                "tokens": self.tokens,
+                "loaded": sorted(self.loaded),
+            }
+
+    def _begin(self) -> bool:
+        """Cuenta la petición; False si el perfil decide que falle."""
+        with self._lock:
+            self.requests += 1
+            if self.profile.fails():
+                self.errors += 1
+                return False
+            return True
+
+    def _load(self, model: str, keep_alive: Any) -> float:
+        """Simula la carga del modelo; devuelve lo que tardó (segundos)."""
+        name = model if ":" in model else f"{model}:latest"
+        if keep_alive in (0, "0", "0s", "0m"):
+            with self._lock:
+                self.loaded.pop(name, None)
+            return 0.0
+        with self._lock:
+            loaded = name in self.loaded
+            self.loaded[name] = time.time()
+        if loaded or self.profile.load_time <= 0:
+            return 0.0
+        time.sleep(self.profile.load_time)
+        return self.profile.load_time
+
+    def run(self, prompt_len: int, num_predict: Optional[int]) -> Iterator[str]:
+        """Tokens de una generación, respetando el límite de peticiones en paralelo."""
+        if self._slots is not None:
+            self._slots.acquire()
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            for token in self.profile.generate(prompt_len, num_predict):
+                with self._lock:
+                    self.tokens += 1
+                yield token
+        finally:
+            with self._lock:
+                self.active -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+
+def _make_handler(server: FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 para que los clientes reutilicen la conexión (keep-alive)
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _json(self, payload: Any, status: int = 200) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _chunk(self, payload: Any) -> None:
+            data = json.dumps(payload).encode("utf-8") + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self) -> None:
+            if self.path in ("/api/ps", "/api/tags"):
+                with server._lock:
+                    names = sorted(server.loaded)
+                self._json({"models": [{"name": n, "model": n, "size": MODEL_SIZE} for n in names]})
+            elif self.path == "/api/version":
+                self._json({"version": "0.0.0-fake"})
+            elif self.path == "/api/fake/stats":
+                self._json(dict(server.stats(), profile=server.profile.as_dict()))
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._json({"error": "invalid JSON"}, 400)
+                return
+            if self.path not in ("/api/chat", "/api/generate"):
+                self._json({"error": "not found"}, 404)
+                return
+            chat = self.path == "/api/chat"
+            model = body.get("model") or ""
+            if not model:
+                self._json({"error": "model is required"}, 400)
+                return
+            load_duration = server._load(model, body.get("keep_alive"))
+            if chat:
+                texts = [m.get("content") or "" for m in body.get("messages") or []]
+            else:
+                texts = [body.get("system") or "", body.get("prompt") or ""]
+                if not body.get("prompt") and not body.get("context"):
+                    # Sin prompt, /api/generate solo carga (o descarga) el modelo
+                    self._json({"model": model, "response": "", "done": True, "load_duration": int(load_duration * 1e9)})
+                    return
+            if not server._begin():
+                self._json({"error": "fake error"}, 500)
+                return
+
+            prompt_len = prompt_tokens(texts) + len(body.get("context") or [])
+            num_predict = (body.get("options") or {}).get("num_predict")
+            started = time.monotonic()
+
+            def part(text: str, done: bool = False) -> Dict[str, Any]:
+                if chat:
+                    return {"model": model, "message": {"role": "assistant", "content": text}, "done": done}
+                return {"model": model, "response": text, "done": done}
+
+            def final(count: int) -> Dict[str, Any]:
+                payload = part("", done=True)
+                payload.update(
+                    done_reason="length" if num_predict is not None and count >= num_predict else "stop",
+                    prompt_eval_count=prompt_len,
+                    eval_count=count,
+                    load_duration=int(load_duration * 1e9),
+                    total_duration=int((time.monotonic() - started) * 1e9),
+                )
+                if not chat:
+                    payload["context"] = list(range(prompt_len + count))
+                return payload
+
+            if body.get("stream") is False:
+                tokens = list(server.run(prompt_len, num_predict))
+                payload = final(len(tokens))
+                if chat:
+                    payload["message"]["content"] = "".join(tokens)
+                else:
+                    payload["response"] = "".join(tokens)
+                self._json(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            count = 0
+            try:
+                for token in server.run(prompt_len, num_predict):
+                    self._chunk(part(token))
+                    count += 1
+                self._chunk(final(count))
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente cerró el stream (cancelación): deja de generar
+                self.close_connection = True
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    defaults = Profile()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="segundos hasta el primer token")
+    parser.add_argument("--tps", type=float, default=defaults.tps, help="tokens por segundo")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="variación aleatoria (fracción)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="fracción de peticiones que fallan")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="tokens por respuesta")
+    parser.add_argument("--prefill-tps", type=float, default=defaults.prefill_tps, help="tokens de prompt por segundo (0 = gratis)")
+    parser.add_argument("--parallel", type=int, default=defaults.parallel, help="generaciones a la vez (0 = sin límite)")
+    parser.add_argument("--load-time", type=float, default=defaults.load_time, help="segundos de carga de un modelo")
+    args = parser.parse_args(argv)
+
+    profile = Profile(
+        ttft=args.ttft,
+        tps=args.tps,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        tokens=args.tokens,
+        prefill_tps=args.prefill_tps,
+        parallel=args.parallel,
+        load_time=args.load_time,
+    )
+    server = FakeOllama(profile, args.host, args.port)
+    print(f"Ollama simulado en {server.url} ({json.dumps(profile.as_dict())})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
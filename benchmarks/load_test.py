@@ -0,0 +1,965 @@
+"""
+Prueba de carga de los PoC con usuarios simultáneos simulados.
+
+Cada usuario simulado mantiene una conversación de --turns mensajes (cada uno
+espera la respuesta al anterior) y --users usuarios van a la vez contra cada
+objetivo:
+
+ - http: `/api/chat` en streaming directamente con httpx, sin `ollama_backend`:
+   lo que tarda el servidor por sí solo, la base para medir lo que añaden las
+   demás capas.
+ - lib: `prefix_cache.chat` en streaming desde threads, con historial por
+   sesión y planificador como las apps con la librería (test1B, test2B).
+ - alib: `prefix_cache.achat` en un único bucle de eventos (test3B).
+ - cli: `cli_pool.stream_prompt` desde threads, con el prompt incremental de
+   las variantes CLI (test1, test2).
+ - acli: `cli_pool.astream_prompt` en un bucle de eventos (test3).
+ - api: la API de TEST4 lanzada como proceso, por HTTP con SSE.
+ - gradio: una app de TEST1 lanzada como proceso y usada con `gradio_client`
+   (por defecto test1B_gpt_gradio_v2.py, con streaming).
+ - streamlit: una app de TEST2 con `streamlit.testing.v1.AppTest`, cada usuario
+   en su proceso (AppTest usa el Runtime global de Streamlit), así que cada uno
+   tiene su planificador y solo comparten Ollama. AppTest no ve los fragmentos:
+   solo hay tiempo extremo a extremo.
+ - chainlit: una app de TEST3 lanzada con `chainlit run --headless` y usada por
+   Socket.IO como el navegador (por defecto test3B_gpt_chainlit.py).
+
+Sin --host se lanza `benchmarks.fake_ollama` con el perfil indicado (--ttft,
+--tps, --jitter, --error-rate, --tokens, --parallel) y el `ollama` simulado de
+`benchmarks/bin` va primero en PATH, así que no hace falta ningún modelo.
+
+Por objetivo se mide:
+ - TTFT: hasta el primer fragmento de la respuesta.
+ - ITL: hueco entre fragmentos. En Gradio y Chainlit son actualizaciones de la
+   UI, que agrupan tokens, no tokens sueltos.
+ - Extremo a extremo: p50/p95/p99 de cada respuesta completa.
+ - Rendimiento: respuestas por segundo y tokens por segundo (estimados como en
+   `ollama_backend.window`, ~4 caracteres por token).
+ - Errores: respuestas fallidas o rechazadas (cola llena).
+ - Arranque en frío: la primera respuesta de la app recién lanzada (--warmup
+   mensajes de un usuario antes de medir; no cuentan en lo demás).
+ - Memoria: RSS en reposo y pico durante la carga del proceso que atiende a los
+   usuarios y sus hijos (los `ollama run` del pool incluidos). Para los
+   objetivos en el propio proceso es este proceso, generador de carga incluido.
+   Usa psutil si está instalado y, si no, /proc (solo Linux).
+
+Uso:
+    python -m benchmarks.load_test --targets lib,alib,api --users 16 --turns 4
+    python -m benchmarks.load_test --targets gradio,chainlit --output after.json --baseline before.json
+El resultado se imprime como tabla y, con --json, como JSON. --output guarda
+configuración y resultados; --baseline compara con un fichero guardado antes.
+
+Dependencias por objetivo: gradio (gradio_client), streamlit, chainlit (y
+aiohttp para su cliente Socket.IO), api (fastapi, uvicorn, httpx).
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.fake_ollama import Profile
+
+FAKE_BIN = os.path.join(ROOT, "benchmarks", "bin")
+DEFAULT_APPS = {
+    "api": os.path.join(ROOT, "TEST4-GPT_API", "test4_gpt_api.py"),
+    "gradio": os.path.join(ROOT, "TEST1-GPT_GRADIO", "test1B_gpt_gradio_v2.py"),
+    "streamlit": os.path.join(ROOT, "TEST2-GPT_STREAMLIT", "test2B_gpt_streamlit.py"),
+    "chainlit": os.path.join(ROOT, "TEST3-GPT_CHAINLIT", "test3B_gpt_chainlit.py"),
+}
+TARGETS = ["http", "lib", "alib", "cli", "acli", "api", "gradio", "streamlit", "chainlit"]
+
+QUESTIONS = [
+    "Explica en dos frases qué es una caché KV.",
+    "¿Por qué el prefill cuesta más que generar un token?",
+    "Dame un ejemplo con un prompt de 2000 tokens.",
+    "¿Qué pasa si cambia el principio del prompt?",
+    "Resume lo que hemos hablado hasta ahora.",
+]
+
+# Lanza una app de Gradio importándola (sin su `demo.launch` fijo) en el puerto indicado
+_GRADIO_LAUNCH = (
+    "import runpy, sys; app = runpy.run_path(sys.argv[1]); "
+    "app['demo'].launch(server_name='127.0.0.1', server_port=int(sys.argv[2]))"
+)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _question(user: int, turn: int, args) -> str:
+    question = QUESTIONS[turn % len(QUESTIONS)]
+    # Mensajes distintos por usuario y por ejecución para no medir la caché de respuestas (salvo --repeat)
+    return question if args.repeat else f"{question} (usuario {user}, turno {turn}, {args.run_id})"
+
+
+# -- procesos auxiliares ---------------------------------------------------------
+
+
+class Service:
+    """Proceso auxiliar (Ollama simulado o una app) que se espera hasta que responde."""
+
+    def __init__(
+        self, cmd: List[str], url: str, env: Dict[str, str], cwd: Optional[str] = None, ready: str = "", timeout: float = 90
+    ):
+        self.cmd = cmd
+        self.url = url
+        self.ready = ready
+        self.env = env
+        self.cwd = cwd
+        self.timeout = timeout
+        self._log = tempfile.TemporaryFile()
+        self._proc: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "Service":
+        self._proc = subprocess.Popen(
+            self.cmd, env=self.env, cwd=self.cwd, stdout=self._log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"{' '.join(self.cmd)} terminó al arrancar:\n{self.output()}")
+            try:
+                urllib.request.urlopen(self.url + self.ready, timeout=1).close()
+                return self
+            except urllib.error.HTTPError:
+                # Responde, aunque sea con un error: ya está escuchando
+                return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f"{' '.join(self.cmd)} no respondió en {self.timeout:.0f} s:\n{self.output()}")
+
+    def __exit__(self, *exc) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+                self._proc.wait()
+        self._log.close()
+
+    @property
+    def pid(self) -> int:
+        return self._proc.pid
+
+    def output(self) -> str:
+        self._log.seek(0)
+        return self._log.read().decode("utf-8", errors="replace")[-2000:]
+
+
+def tree_rss(pid: int, exclude: Sequence[int] = ()) -> Optional[int]:
+    """Memoria residente (bytes) de `pid` y sus descendientes salvo `exclude`; None si no se puede medir."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        total = 0
+        try:
+            pending = [psutil.Process(pid)]
+        except psutil.Error:
+            return None
+        while pending:
+            proc = pending.pop()
+            if proc.pid in exclude:
+                continue
+            try:
+                total += proc.memory_info().rss
+                pending.extend(proc.children())
+            except psutil.Error:
+                pass
+        return total
+
+    if not os.path.isdir("/proc"):
+        return None
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # El nombre va entre paréntesis y puede tener espacios: el ppid es el 2.º campo tras él
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        if current in exclude:
+            continue
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+
+class MemorySampler:
+    """RSS en reposo y pico de un árbol de procesos, muestreado en un thread mientras dura la carga."""
+
+    def __init__(self, pid: int, exclude: Sequence[int] = (), interval: float = 0.2):
+        self.pid = pid
+        self.exclude = exclude
+        self.interval = interval
+        self.idle: Optional[int] = None
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> None:
+        rss = tree_rss(self.pid, self.exclude)
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "MemorySampler":
+        self.idle = tree_rss(self.pid, self.exclude)
+        self.peak = self.idle
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        mb = lambda value: None if value is None else round(value / 2**20, 1)
+        return {"rss_idle_mb": mb(self.idle), "rss_peak_mb": mb(self.peak)}
+
+
+# -- medida ----------------------------------------------------------------------
+
+
+class Sample:
+    """Medida de una respuesta."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.gaps: List[float] = []
+        self.e2e = 0.0
+        self.chars = 0
+        self.error: Optional[str] = None
+        self._last: Optional[float] = None
+
+    def fragment(self, text: str) -> None:
+        if not text:
+            return
+        now = time.perf_counter()
+        if self.ttft is None:
+            self.ttft = now - self.start
+        else:
+            self.gaps.append(now - self._last)
+        self._last = now
+        self.chars += len(text)
+
+    def done(self, error: Optional[BaseException] = None) -> "Sample":
+        self.e2e = time.perf_counter() - self.start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        return self
+
+
+def _measure(produce: Callable[[], Iterable[str]]) -> Sample:
+    sample = Sample()
+    try:
+        for text in produce():
+            sample.fragment(text)
+    except Exception as e:
+        return sample.done(e)
+    return sample.done()
+
+
+async def _ameasure(produce: Callable[[], AsyncIterator[str]]) -> Sample:
+    sample = Sample()
+    try:
+        async for text in produce():
+            sample.fragment(text)
+    except Exception as e:
+        return sample.done(e)
+    return sample.done()
+
+
+def _ms(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None}
+    return {
+        "mean": round(statistics.mean(values) * 1000, 1),
+        "p50": round(percentile(values, 50) * 1000, 1),
+        "p95": round(percentile(values, 95) * 1000, 1),
+        "p99": round(percentile(values, 99) * 1000, 1),
+    }
+
+
+def summarize(target: str, users: int, samples: List[Sample], memory: Optional[MemorySampler] = None) -> Dict[str, Any]:
+    from ollama_backend.window import estimate_tokens
+
+    # Del primer envío a la última respuesta, sin contar el arranque de apps y usuarios
+    wall = max(s.start + s.e2e for s in samples) - min(s.start for s in samples) if samples else 0.0
+    ok = [s for s in samples if s.error is None]
+    errors = [s.error for s in samples if s.error is not None]
+    tokens = sum(estimate_tokens("x" * s.chars) for s in ok)
+    return {
+        "target": target,
+        "users": users,
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 3) if samples else 0.0,
+        "first_error": errors[0] if errors else None,
+        "ttft_ms": _ms([s.ttft for s in ok if s.ttft is not None]),
+        "itl_ms": _ms([gap for s in ok for gap in s.gaps]),
+        "e2e_ms": _ms([s.e2e for s in ok]),
+        "duration_s": round(wall, 2),
+        "rps": round(len(ok) / wall, 2) if wall else 0.0,
+        "tokens_per_s": round(tokens / wall, 1) if wall else 0.0,
+        **(memory.as_dict() if memory is not None else {"rss_idle_mb": None, "rss_peak_mb": None}),
+    }
+
+
+# -- objetivos en el propio proceso ---------------------------------------------------
+
+
+async def _http_user(user: int, args) -> List[Sample]:
+    import httpx
+
+    from ollama_backend.router import normalize_host
+
+    host = normalize_host(os.environ.get("OLLAMA_HOST") or "127.0.0.1")
+    messages: List[Dict[str, str]] = []
+    samples = []
+    async with httpx.AsyncClient(base_url=host, timeout=args.timeout) as client:
+        for turn in range(args.turns):
+            messages.append({"role": "user", "content": _question(user, turn, args)})
+            body = {"model": args.model, "messages": messages, "stream": True}
+
+            async def produce():
+                async with client.stream("POST", "/api/chat", json=body) as resp:
+                    if resp.status_code != 200:
+                        raise RuntimeError(f"HTTP {resp.status_code}: {(await resp.aread()).decode()[:200]}")
+                    async for line in resp.aiter_lines():
+                        if not line.strip():
+                            continue
+                        part = json.loads(line)
+                        if part.get("error"):
+                            raise RuntimeError(part["error"])
+                        yield (part.get("message") or {}).get("content") or ""
+
+            sample = await _ameasure(produce)
+            samples.append(sample)
+            messages.append({"role": "assistant", "content": f"respuesta {turn}" if sample.error else "x" * sample.chars})
+            await asyncio.sleep(args.think)
+    return samples
+
+
+def _lib_user(user: int, args) -> List[Sample]:
+    from ollama_backend import prefix_cache
+    from ollama_backend.history import SessionHistoryStore
+    from ollama_backend.scheduler import default_scheduler
+    from ollama_backend.streaming import chunk_text
+
+    history = SessionHistoryStore()
+    session_id = f"load-{user}"
+    samples = []
+    for turn in range(args.turns):
+        history.append(session_id, "user", _question(user, turn, args))
+
+        def produce():
+            with default_scheduler().enqueue(session_id) as ticket:
+                ticket.wait()
+                stream = prefix_cache.chat(
+                    model=args.model, messages=history.messages(session_id), stream=True, state=history.state(session_id)
+                )
+                for part in stream:
+                    yield chunk_text(part)
+
+        sample = _measure(produce)
+        samples.append(sample)
+        history.append(session_id, "assistant", f"respuesta {turn}" if sample.error else "x" * sample.chars)
+        time.sleep(args.think)
+    return samples
+
+
+def _render_message(m: Dict[str, str]) -> str:
+    # Formato de las variantes CLI (test1, test3)
+    if m["role"] == "system":
+        return m["content"].strip()
+    elif m["role"] == "user":
+        return f"User: {m['content']}"
+    return f"Assistant: {m['content']}"
+
+
+def _cli_user(user: int, args) -> List[Sample]:
+    from ollama_backend.cli_pool import stream_prompt
+    from ollama_backend.history import SessionHistoryStore
+    from ollama_backend.prompt import PromptBuilder
+    from ollama_backend.scheduler import default_scheduler
+
+    history = SessionHistoryStore()
+    builder = PromptBuilder(_render_message, suffix="\nAssistant:")
+    session_id = f"load-{user}"
+    samples = []
+    for turn in range(args.turns):
+        history.append(session_id, "user", _question(user, turn, args))
+
+        def produce():
+            with default_scheduler().enqueue(session_id) as ticket:
+                ticket.wait()
+                yield from stream_prompt(builder.build(history.messages(session_id)), args.model, timeout=args.timeout)
+
+        sample = _measure(produce)
+        samples.append(sample)
+        history.append(session_id, "assistant", f"respuesta {turn}" if sample.error else "x" * sample.chars)
+        time.sleep(args.think)
+    return samples
+
+
+async def _alib_user(user: int, args) -> List[Sample]:
+    from ollama_backend import prefix_cache
+    from ollama_backend.history import SessionHistoryStore
+    from ollama_backend.scheduler import default_scheduler
+    from ollama_backend.streaming import chunk_text
+
+    history = SessionHistoryStore()
+    session_id = f"load-{user}"
+    samples = []
+    for turn in range(args.turns):
+        history.append(session_id, "user", _question(user, turn, args))
+
+        async def produce():
+            with default_scheduler().enqueue(session_id) as ticket:
+                async for _position in ticket.await_turn():
+                    pass
+                stream = await prefix_cache.achat(
+                    model=args.model, messages=history.messages(session_id), stream=True, state=history.state(session_id)
+                )
+                async for part in stream:
+                    yield chunk_text(part)
+
+        sample = await _ameasure(produce)
+        samples.append(sample)
+        history.append(session_id, "assistant", f"respuesta {turn}" if sample.error else "x" * sample.chars)
+        await asyncio.sleep(args.think)
+    return samples
+
+
+async def _acli_user(user: int, args) -> List[Sample]:
+    from ollama_backend.cli_pool import astream_prompt
+    from ollama_backend.history import SessionHistoryStore
+    from ollama_backend.prompt import PromptBuilder
+    from ollama_backend.scheduler import default_scheduler
+
+    history = SessionHistoryStore()
+    builder = PromptBuilder(_render_message, suffix="\nAssistant:")
+    session_id = f"load-{user}"
+    samples = []
+    for turn in range(args.turns):
+        history.append(session_id, "user", _question(user, turn, args))
+
+        async def produce():
+            with default_scheduler().enqueue(session_id) as ticket:
+                async for _position in ticket.await_turn():
+                    pass
+                prompt = builder.build(history.messages(session_id))
+                async for fragment in astream_prompt(prompt, args.model, timeout=args.timeout):
+                    yield fragment
+
+        sample = await _ameasure(produce)
+        samples.append(sample)
+        history.append(session_id, "assistant", f"respuesta {turn}" if sample.error else "x" * sample.chars)
+        await asyncio.sleep(args.think)
+    return samples
+
+
+def _streamlit_user(user: int, args) -> List[Sample]:
+    """Un usuario en su propio proceso: AppTest usa el Runtime global de Streamlit."""
+    from streamlit.testing.v1 import AppTest
+
+    logging.disable(logging.WARNING)
+    os.environ["OLLAMA_MODEL"] = args.model
+
+    at = AppTest.from_file(os.path.abspath(args.app or DEFAULT_APPS["streamlit"]), default_timeout=args.timeout)
+    at.run()
+    samples = []
+    for turn in range(args.turns):
+        sample = Sample()
+        try:
+            at.chat_input[0].set_value(_question(user, turn, args)).run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+            reply = at.session_state["messages"][-1]
+            if reply.get("error"):
+                raise RuntimeError(reply["error"])
+            sample.chars = len(reply["content"])
+            samples.append(sample.done())
+        except Exception as e:
+            samples.append(sample.done(e))
+        time.sleep(args.think)
+    return samples
+
+
+# -- objetivos lanzados como proceso -------------------------------------------------
+
+
+def _gradio_user(user: int, args, url: str) -> List[Sample]:
+    from gradio_client import Client
+
+    client = Client(url, verbose=False)
+    samples = []
+    for turn in range(args.turns):
+
+        def produce():
+            job = client.submit(_question(user, turn, args), args.model, api_name="/respond")
+            content = ""
+            for outputs in job:
+                # Salidas (historial, turno en curso, cuadro de texto): se mide lo nuevo del turno
+                latest = _last_content(outputs[1])
+                if latest.startswith("En cola"):
+                    continue
+                if len(latest) > len(content):
+                    yield latest[len(content) :]
+                content = latest
+            job.result()
+            # Las apps escriben los fallos en el propio chat ("[Error] ...")
+            if "[Error" in content:
+                raise RuntimeError(content[content.index("[Error") :][:200])
+
+        samples.append(_measure(produce))
+        time.sleep(args.think)
+    client.close()
+    return samples
+
+
+def _last_content(chatbot: Any) -> str:
+    if not chatbot:
+        return ""
+    last = chatbot[-1]
+    content = last.get("content") if isinstance(last, dict) else last[1]
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+async def _api_user(user: int, args, url: str) -> List[Sample]:
+    import httpx
+
+    messages: List[Dict[str, str]] = []
+    samples = []
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout) as client:
+        for turn in range(args.turns):
+            messages.append({"role": "user", "content": _question(user, turn, args)})
+            body = {"model": args.model, "messages": messages, "stream": True, "user": f"load-{user}"}
+
+            async def produce():
+                async with client.stream("POST", "/v1/chat/completions", json=body) as resp:
+                    if resp.status_code != 200:
+                        raise RuntimeError(f"HTTP {resp.status_code}: {(await resp.aread()).decode()[:200]}")
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data: ") or line == "data: [DONE]":
+                            continue
+                        event = json.loads(line[len("data: ") :])
+                        if "error" in event:
+                            raise RuntimeError(event["error"]["message"])
+                        for choice in event.get("choices") or []:
+                            yield choice.get("delta", {}).get("content") or ""
+
+            sample = await _ameasure(produce)
+            samples.append(sample)
+            messages.append({"role": "assistant", "content": f"respuesta {turn}" if sample.error else "x" * sample.chars})
+            await asyncio.sleep(args.think)
+    return samples
+
+
+async def _chainlit_user(user: int, args, url: str) -> List[Sample]:
+    import socketio
+
+    client = socketio.AsyncClient()
+    reply: Dict[str, Any] = {}
+    finished = asyncio.Event()
+    tokens: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+    @client.on("new_message")
+    async def on_new_message(step):
+        if step.get("type") == "assistant_message" and "id" not in reply:
+            reply["id"] = step["id"]
+
+    def _token(token: str) -> None:
+        reply["streamed"] += token
+        tokens.put_nowait(token)
+
+    @client.on("stream_start")
+    async def on_stream_start(step):
+        # El primer token no llega como stream_token: va en el contenido de stream_start
+        if step.get("id") == reply.get("id"):
+            _token(step.get("output") or "")
+
+    @client.on("stream_token")
+    async def on_token(data):
+        if data.get("id") == reply.get("id"):
+            _token(data.get("token") or "")
+
+    @client.on("update_message")
+    async def on_update(step):
+        if step.get("id") == reply.get("id"):
+            reply["final"] = step.get("output") or ""
+
+    @client.on("task_end")
+    async def on_task_end(_data=None):
+        finished.set()
+        tokens.put_nowait(None)
+
+    auth = {"clientType": "webapp", "sessionId": str(uuid.uuid4()), "threadId": None, "userEnv": "{}", "chatProfile": None}
+    await client.connect(url, socketio_path="/ws/socket.io", auth=auth, transports=["websocket"])
+    await client.emit("connection_successful")
+    # connection_successful termina con un task_end que no es de ninguna respuesta
+    await asyncio.wait_for(finished.wait(), args.timeout)
+    samples = []
+    try:
+        for turn in range(args.turns):
+            while not tokens.empty():
+                tokens.get_nowait()
+            reply.clear()
+            reply["streamed"] = ""
+            message = {
+                "id": str(uuid.uuid4()),
+                "threadId": "",
+                "name": "User",
+                "type": "user_message",
+                "output": _question(user, turn, args),
+                "createdAt": datetime.now(timezone.utc).isoformat(),
+            }
+
+            async def produce():
+                await client.emit("client_message", {"message": message, "fileReferences": None})
+                while True:
+                    token = await asyncio.wait_for(tokens.get(), args.timeout)
+                    if token is None:
+                        break
+                    yield token
+                # Al terminar bien el mensaje final es lo recibido; si no, lleva el error
+                final = reply.get("final")
+                if final is not None and final.strip() != reply["streamed"].strip():
+                    raise RuntimeError(final.strip()[:200])
+
+            samples.append(await _ameasure(produce))
+            await asyncio.sleep(args.think)
+    finally:
+        await client.disconnect()
+    return samples
+
+
+# -- ejecución -------------------------------------------------------------------------
+
+
+def _run_threads(users: int, run_user: Callable[[int], List[Sample]]) -> List[Sample]:
+    results: List[List[Sample]] = [[] for _ in range(users)]
+
+    def run(user: int) -> None:
+        try:
+            results[user] = run_user(user)
+        except Exception as e:
+            # Fallo al preparar el usuario (conexión, arranque...): cuenta como error
+            results[user] = [Sample().done(e)]
+
+    threads = [threading.Thread(target=run, args=(u,), daemon=True) for u in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for user_samples in results for sample in user_samples]
+
+
+async def _run_tasks(users: int, run_user: Callable[[int], Any]) -> List[Sample]:
+    results = await asyncio.gather(*(run_user(u) for u in range(users)), return_exceptions=True)
+    samples: List[Sample] = []
+    for result in results:
+        samples.extend([Sample().done(result)] if isinstance(result, BaseException) else result)
+    return samples
+
+
+def _run_processes(users: int, run_user: Callable[[int, Any], List[Sample]], args) -> List[Sample]:
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=users, mp_context=context) as pool:
+        futures = [pool.submit(run_user, u, args) for u in range(users)]
+        samples: List[Sample] = []
+        for future in futures:
+            try:
+                samples.extend(future.result())
+            except Exception as e:
+                samples.append(Sample().done(e))
+    return samples
+
+
+def _app_env(args, extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    env = dict(os.environ, OLLAMA_MODEL=args.model, PYTHONUNBUFFERED="1")
+    env.update(extra or {})
+    return env
+
+
+def _launch(target: str, args) -> Optional[Service]:
+    """Proceso de la app para los objetivos que la lanzan aparte (sin arrancar aún)."""
+    if target not in DEFAULT_APPS or target == "streamlit":
+        return None
+    app = os.path.abspath(args.app or DEFAULT_APPS[target])
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    if target == "gradio":
+        return Service([sys.executable, "-c", _GRADIO_LAUNCH, app, str(port)], url, _app_env(args), cwd=os.path.dirname(app))
+    if target == "api":
+        env = _app_env(args, {"OLLAMA_API_PORT": str(port)})
+        return Service([sys.executable, app], url, env, cwd=os.path.dirname(app), ready="/v1/models")
+    chainlit = [shutil.which("chainlit")] if shutil.which("chainlit") else [sys.executable, "-m", "chainlit"]
+    cmd = chainlit + ["run", app, "--headless", "--host", "127.0.0.1", "--port", str(port)]
+    return Service(cmd, url, _app_env(args), cwd=os.path.dirname(app))
+
+
+def _drive(target: str, args, url: Optional[str]) -> List[Sample]:
+    if target in ("lib", "cli", "gradio"):
+        run_user = {"lib": _lib_user, "cli": _cli_user, "gradio": _gradio_user}[target]
+        return _run_threads(args.users, lambda u: run_user(u, args, url) if url else run_user(u, args))
+    if target == "streamlit":
+        return _run_processes(args.users, _streamlit_user, args)
+    run_user = {"http": _http_user, "alib": _alib_user, "acli": _acli_user, "api": _api_user, "chainlit": _chainlit_user}[target]
+    return asyncio.run(_run_tasks(args.users, lambda u: run_user(u, args, url) if url else run_user(u, args)))
+
+
+def run_target(target: str, args, exclude: Sequence[int] = ()) -> Dict[str, Any]:
+    """Lanza --users usuarios contra `target` y devuelve el resumen de sus medidas.
+
+    La memoria es la del proceso de la app o, en los objetivos sin app aparte, la
+    de este proceso; `exclude` quita de la medida otros hijos (el Ollama simulado).
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Objetivo desconocido: {target} (disponibles: {', '.join(TARGETS)})")
+    service = _launch(target, args)
+    with service if service is not None else contextlib.nullcontext():
+        url = service.url if service is not None else None
+        cold = None
+        if args.warmup:
+            # Un usuario calienta la app (imports, pool de `ollama run`, conexiones, carga del modelo)
+            warmup = copy.copy(args)
+            warmup.users, warmup.turns, warmup.run_id = 1, args.warmup, f"{target}-warmup-{uuid.uuid4().hex[:8]}"
+            first = _drive(target, warmup, url)[0]
+            cold = None if first.error else round(first.e2e * 1000, 1)
+        args.run_id = f"{target}-{uuid.uuid4().hex[:8]}"
+        pid = service.pid if service is not None else os.getpid()
+        with MemorySampler(pid, exclude) as memory:
+            samples = _drive(target, args, url)
+    return dict(summarize(target, args.users, samples, memory), cold_ms=cold)
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[Dict[str, Any]]:
+    """Cambios frente a `baseline` por objetivo; marca las regresiones mayores que `tolerance` (%)."""
+    before = {row["target"]: row for row in baseline}
+    metrics = [
+        ("ttft_p50", lambda r: r["ttft_ms"]["p50"], False),
+        ("ttft_p95", lambda r: r["ttft_ms"]["p95"], False),
+        ("e2e_p50", lambda r: r["e2e_ms"]["p50"], False),
+        ("e2e_p95", lambda r: r["e2e_ms"]["p95"], False),
+        ("rps", lambda r: r["rps"], True),
+        ("error_rate", lambda r: r["error_rate"], False),
+    ]
+    rows = []
+    for row in results:
+        old = before.get(row["target"])
+        if old is None:
+            continue
+        for name, get, higher_is_better in metrics:
+            a, b = get(old), get(row)
+            if a is None or b is None:
+                continue
+            if a:
+                change = round((b - a) / a * 100, 1)
+                worse = change < -tolerance if higher_is_better else change > tolerance
+            else:
+                # Sin base (p. ej. 0 errores antes) no hay porcentaje: cuenta si empeora
+                change = None
+                worse = b < a if higher_is_better else b > a
+            rows.append(
+                {"target": row["target"], "metric": name, "before": a, "after": b, "change_pct": change, "regression": worse}
+            )
+    return rows
+
+
+def _print_results(results: List[Dict[str, Any]]) -> None:
+    print(
+        f"{'objetivo':<10} {'usuarios':>8} {'resp':>5} {'err':>4} {'ttft p50':>9} {'ttft p95':>9} "
+        f"{'itl p50':>8} {'e2e p50':>8} {'e2e p95':>8} {'e2e p99':>8} {'resp/s':>7} {'tok/s':>7} {'RSS MB':>7}"
+    )
+    for row in results:
+        ttft, itl, e2e = row["ttft_ms"], row["itl_ms"], row["e2e_ms"]
+        print(
+            f"{row['target']:<10} {row['users']:>8} {row['requests']:>5} {row['errors']:>4} "
+            f"{str(ttft['p50']):>9} {str(ttft['p95']):>9} {str(itl['p50']):>8} {str(e2e['p50']):>8} "
+            f"{str(e2e['p95']):>8} {str(e2e['p99']):>8} {row['rps']:>7} {row['tokens_per_s']:>7} {str(row['rss_peak_mb']):>7}"
+        )
+    print_errors(results)
+
+
+def print_errors(results: List[Dict[str, Any]]) -> None:
+    for row in results:
+        if row["first_error"]:
+            print(f"{row['target']}: {row['errors']} errores, p. ej. {row['first_error']}")
+
+
+def print_comparison(rows: List[Dict[str, Any]]) -> None:
+    print(f"\n{'objetivo':<14} {'métrica':<10} {'antes':>9} {'después':>9} {'cambio %':>9}")
+    for row in rows:
+        change = "-" if row["change_pct"] is None else row["change_pct"]
+        mark = "  REGRESIÓN" if row["regression"] else ""
+        print(f"{row['target']:<14} {row['metric']:<10} {row['before']:>9} {row['after']:>9} {change:>9}{mark}")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Opciones de la carga, del servidor (simulado o real) y de guardado, comunes a las pruebas de carga."""
+    parser.add_argument("--turns", type=int, default=3, help="mensajes por usuario")
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="mensajes de calentamiento antes de medir (el primero da el arranque en frío)"
+    )
+    parser.add_argument("--think", type=float, default=0.0, help="segundos de pausa entre mensajes de un usuario")
+    parser.add_argument("--repeat", action="store_true", help="todos los usuarios envían los mismos mensajes (deduplicación y, con OLLAMA_CACHE=1, caché)")
+    parser.add_argument("--model", default=os.environ.get("OLLAMA_MODEL", "llama3.2"))
+    parser.add_argument("--timeout", type=float, default=120, help="segundos máximos por respuesta")
+    parser.add_argument("--host", help="Ollama real (sin él se lanza benchmarks.fake_ollama)")
+    # Perfil del servidor simulado; por defecto el de las variables FAKE_OLLAMA_*
+    defaults = Profile()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft)
+    parser.add_argument("--tps", type=float, default=defaults.tps)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--tokens", type=int, default=defaults.tokens)
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=defaults.parallel or 4,
+        help="generaciones a la vez en el servidor simulado (por defecto 4, como un Ollama con varias ranuras)",
+    )
+    parser.add_argument("--json", action="store_true", help="imprime los resultados como JSON")
+    parser.add_argument("--output", help="guarda configuración y resultados en este fichero JSON")
+    parser.add_argument("--baseline", help="fichero JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="cambio (%%) a partir del cual se marca una regresión")
+
+
+def _profile(args) -> Optional[Dict[str, Any]]:
+    if args.host:
+        return None
+    return {
+        "ttft": args.ttft,
+        "tps": args.tps,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "tokens": args.tokens,
+        "parallel": args.parallel,
+    }
+
+
+@contextlib.contextmanager
+def backend(args) -> Iterator[List[int]]:
+    """Apunta OLLAMA_HOST a --host o a un `benchmarks.fake_ollama` lanzado para la prueba.
+
+    Con el simulado, `benchmarks/bin` va primero en PATH (CLI simulada). Devuelve
+    los pids que no son de las apps, para quitarlos de la medida de memoria.
+    """
+    if args.host:
+        os.environ["OLLAMA_HOST"] = args.host
+        yield []
+        return
+    port = _free_port()
+    cmd = [sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(port)]
+    for key, value in _profile(args).items():
+        cmd += [f"--{key.replace('_', '-')}", str(value)]
+    with Service(cmd, f"http://127.0.0.1:{port}", dict(os.environ), cwd=ROOT, ready="/api/version") as fake:
+        # Las apps lanzadas como proceso heredan el entorno: mismo servidor y misma CLI
+        os.environ["OLLAMA_HOST"] = f"127.0.0.1:{port}"
+        os.environ["PATH"] = FAKE_BIN + os.pathsep + os.environ.get("PATH", "")
+        yield [fake.pid]
+
+
+def save(args, config: Dict[str, Any], results: List[Dict[str, Any]], **extra) -> Optional[List[Dict[str, Any]]]:
+    """Guarda en --output (con `extra`) y compara con --baseline; devuelve la comparación si la hay."""
+    config = dict(
+        config,
+        turns=args.turns,
+        warmup=args.warmup,
+        think=args.think,
+        repeat=args.repeat,
+        model=args.model,
+        host=args.host,
+        profile=_profile(args),
+        created=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results, **extra}, f, indent=2, ensure_ascii=False)
+    if not args.baseline:
+        return None
+    with open(args.baseline, encoding="utf-8") as f:
+        saved = json.load(f)
+    return compare(results, saved["results"] if isinstance(saved, dict) else saved, args.tolerance)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--targets", default="lib,alib", help=f"objetivos separados por comas: {', '.join(TARGETS)}")
+    parser.add_argument("--users", type=int, default=8, help="usuarios simultáneos")
+    parser.add_argument("--app", help="app a lanzar (un solo objetivo de UI o api; por defecto la de DEFAULT_APPS)")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    for target in targets:
+        if target not in TARGETS:
+            parser.error(f"objetivo desconocido: {target}")
+
+    with backend(args) as exclude:
+        results = [run_target(target, args, exclude) for target in targets]
+    comparison = save(args, {"targets": targets, "users": args.users}, results)
+
+    if args.json:
+        print(json.dumps({"results": results, "comparison": comparison}, indent=2, ensure_ascii=False))
+        return
+    _print_results(results)
+    if comparison is not None:
+        print_comparison(comparison)
+
+
+if __name__ == "__main__":
+    main()
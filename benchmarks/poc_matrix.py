@@ -0,0 +1,154 @@
+"""
+Comparación de las seis variantes de la matriz de PoC con la misma carga.
+
+Casos (TEST_ID de PoC.xlsx):
+ - 1: OllamaCLI + Gradio (test1_gpt_gradio_v2.py)
+ - 1_B: OllamaPy + Gradio (test1B_gpt_gradio_v2.py)
+ - 2: OllamaCLI + Streamlit (test2_gpt_streamlit.py)
+ - 2_B: OllamaPy + Streamlit (test2B_gpt_streamlit.py)
+ - 3: OllamaCLI + Chainlit (test3_gpt_chainlit.py)
+ - 3_B: OllamaPy + Chainlit (test3B_gpt_chainlit.py)
+
+Todos los casos se miden con `benchmarks.load_test` contra el mismo servidor
+(por defecto el Ollama simulado, sin jitter para que las ejecuciones se puedan
+comparar) y la misma carga. El tiempo de cada caso se reparte en tres capas,
+restando medianas (p50) de TTFT y del tiempo extremo a extremo:
+ - servidor: el objetivo http de load_test, lo que tarda Ollama por sí solo con
+   esa carga.
+ - transporte: lo que añade el camino de la variante sobre el servidor. Es
+   `lib`/`alib` (llamada a la librería) o `cli`/`acli` (proceso `ollama run`),
+   con los saltos de thread y el planificador.
+ - framework: lo que añade la app sobre su transporte (cola, serialización,
+   websocket y repintado de Gradio, Streamlit o Chainlit).
+En Streamlit solo hay tiempo extremo a extremo (ver load_test). La memoria es el
+pico de RSS del proceso de la app y sus hijos. En Streamlit es la suma de los
+procesos de AppTest, uno por usuario, así que sobrestima un servidor real. En
+los casos CLI incluye los `ollama run` del pool, que con la CLI simulada son
+procesos de Python.
+
+Uso:
+    python -m benchmarks.poc_matrix --users 1,8 --turns 3
+    python -m benchmarks.poc_matrix --cases 1_B,3_B --output matriz.json --baseline matriz_anterior.json
+El resultado se imprime como tabla por caso y, con --json, como JSON.
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.load_test import add_arguments, backend, print_comparison, print_errors, run_target, save
+
+# TEST_ID, pila, objetivo de load_test, app y transporte que usa
+CASES = [
+    ("1", "OllamaCLI + Gradio", "gradio", os.path.join(ROOT, "TEST1-GPT_GRADIO", "test1_gpt_gradio_v2.py"), "cli"),
+    ("1_B", "OllamaPy + Gradio", "gradio", os.path.join(ROOT, "TEST1-GPT_GRADIO", "test1B_gpt_gradio_v2.py"), "lib"),
+    ("2", "OllamaCLI + Streamlit", "streamlit", os.path.join(ROOT, "TEST2-GPT_STREAMLIT", "test2_gpt_streamlit.py"), "cli"),
+    ("2_B", "OllamaPy + Streamlit", "streamlit", os.path.join(ROOT, "TEST2-GPT_STREAMLIT", "test2B_gpt_streamlit.py"), "lib"),
+    ("3", "OllamaCLI + Chainlit", "chainlit", os.path.join(ROOT, "TEST3-GPT_CHAINLIT", "test3_gpt_chainlit.py"), "acli"),
+    ("3_B", "OllamaPy + Chainlit", "chainlit", os.path.join(ROOT, "TEST3-GPT_CHAINLIT", "test3B_gpt_chainlit.py"), "alib"),
+]
+
+
+def _delta(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return None if a is None or b is None else round(a - b, 1)
+
+
+def case_row(case, app: Dict[str, Any], transport: Dict[str, Any], server: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila de la tabla: cifras del caso y lo que añade cada capa sobre la anterior."""
+    case_id, stack, framework, _app, transport_name = case
+    return {
+        "case": case_id,
+        "stack": stack,
+        "framework": framework,
+        "transport": transport_name,
+        "users": app["users"],
+        "cold_ms": app["cold_ms"],
+        "ttft_p50_ms": app["ttft_ms"]["p50"],
+        "e2e_p50_ms": app["e2e_ms"]["p50"],
+        "e2e_p95_ms": app["e2e_ms"]["p95"],
+        "server_e2e_p50_ms": server["e2e_ms"]["p50"],
+        "transport_ttft_ms": _delta(transport["ttft_ms"]["p50"], server["ttft_ms"]["p50"]),
+        "transport_e2e_ms": _delta(transport["e2e_ms"]["p50"], server["e2e_ms"]["p50"]),
+        "framework_ttft_ms": _delta(app["ttft_ms"]["p50"], transport["ttft_ms"]["p50"]),
+        "framework_e2e_ms": _delta(app["e2e_ms"]["p50"], transport["e2e_ms"]["p50"]),
+        "rss_peak_mb": app["rss_peak_mb"],
+        "rps": app["rps"],
+        "errors": app["errors"],
+    }
+
+
+def run_matrix(cases, users_list: List[int], args, exclude) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Mide servidor, transportes y apps de `cases` para cada número de usuarios."""
+    rows, results = [], []
+    for users in users_list:
+        args.users = users
+
+        def measure(target: str, name: str, app: Optional[str] = None) -> Dict[str, Any]:
+            args.app = app
+            result = run_target(target, args, exclude)
+            # Nombre único por ejecución para comparar con --baseline
+            result["target"] = f"{name}@{users}"
+            results.append(result)
+            return result
+
+        server = measure("http", "http")
+        transports = {name: measure(name, name) for name in dict.fromkeys(case[4] for case in cases)}
+        for case in cases:
+            app = measure(case[2], case[0], case[3])
+            rows.append(case_row(case, app, transports[case[4]], server))
+    return rows, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", default=",".join(case[0] for case in CASES), help="TEST_ID separados por comas")
+    parser.add_argument("--users", default="1,8", help="usuarios simultáneos; una tabla por cada valor")
+    add_arguments(parser)
+    # Sin jitter por defecto: la misma carga da las mismas cifras de servidor en cada caso
+    parser.set_defaults(jitter=0.0)
+    args = parser.parse_args(argv)
+
+    by_id = {case[0]: case for case in CASES}
+    cases = []
+    for case_id in (c.strip() for c in args.cases.split(",") if c.strip()):
+        if case_id not in by_id:
+            parser.error(f"caso desconocido: {case_id} (disponibles: {', '.join(by_id)})")
+        cases.append(by_id[case_id])
+    users_list = [int(u) for u in args.users.split(",")]
+
+    with backend(args) as exclude:
+        rows, results = run_matrix(cases, users_list, args, exclude)
+    comparison = save(args, {"cases": [case[0] for case in cases], "users": users_list}, results, matrix=rows)
+
+    if args.json:
+        print(json.dumps({"matrix": rows, "results": results, "comparison": comparison}, indent=2, ensure_ascii=False))
+        return
+    servers = {row["target"]: row for row in results if row["target"].startswith("http@")}
+    for users in users_list:
+        server = servers[f"http@{users}"]
+        print(
+            f"\n{users} usuarios (servidor solo: ttft p50 {server['ttft_ms']['p50']} ms, "
+            f"e2e p50 {server['e2e_ms']['p50']} ms; las columnas + son lo que añade cada capa, en ms)"
+        )
+        print(
+            f"{'caso':<5} {'pila':<22} {'frío':>7} {'ttft p50':>9} {'e2e p50':>8} {'e2e p95':>8} "
+            f"{'+transp ttft':>12} {'+transp e2e':>11} {'+fw ttft':>9} {'+fw e2e':>8} {'RSS MB':>7} {'resp/s':>7} {'err':>4}"
+        )
+        for row in (r for r in rows if r["users"] == users):
+            print(
+                f"{row['case']:<5} {row['stack']:<22} {str(row['cold_ms']):>7} {str(row['ttft_p50_ms']):>9} "
+                f"{str(row['e2e_p50_ms']):>8} {str(row['e2e_p95_ms']):>8} {str(row['transport_ttft_ms']):>12} "
+                f"{str(row['transport_e2e_ms']):>11} {str(row['framework_ttft_ms']):>9} {str(row['framework_e2e_ms']):>8} "
+                f"{str(row['rss_peak_mb']):>7} {row['rps']:>7} {row['errors']:>4}"
+            )
+    print_errors(results)
+    if comparison is not None:
+        print_comparison(comparison)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Tiempo de prefill por turno en una conversación larga.
+
+Mide, para cada turno, cuántos tokens del prompt evalúa Ollama
+(`prompt_eval_count`) y cuánto tarda (`prompt_eval_duration`). Con el prefijo
+reutilizado el coste por turno debe mantenerse plano en lugar de crecer con el
+historial.
+
+Modos:
+ - cold: API de chat con keep_alive=0; el modelo se descarga tras cada turno y
+   se evalúa el historial completo cada vez (referencia).
+ - chat: API de chat con keep_alive y ventana que recorta por bloques
+   (`HistoryWindow`), de modo que el runner reutiliza el prefijo común.
+ - context: `/api/generate` con el `context` del turno anterior
+   (`prefix_cache.ContextSession`).
+
+Uso:
+    python -m benchmarks.prefill_per_turn --model llama3.2 --turns 12 --modes cold,chat,context
+El resultado se imprime como tabla y, con --json, como JSON.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_backend import prefix_cache
+from ollama_backend.window import HistoryWindow
+
+QUESTIONS = [
+    "Explica en dos frases qué es una caché KV en un modelo de lenguaje.",
+    "¿Y por qué el prefill cuesta más que generar un token?",
+    "Dame un ejemplo numérico con un prompt de 2000 tokens.",
+    "¿Qué pasa si cambia el principio del prompt?",
+    "Resume lo que hemos hablado hasta ahora.",
+    "¿Cómo afecta el tamaño de num_ctx?",
+]
+
+
+def run_mode(mode: str, model: str, turns: int, budget: int, host: str):
+    import ollama
+
+    client = ollama.Client(host=host) if host else ollama
+    window = HistoryWindow(budget=budget, system_prompt="Eres un asistente conciso.")
+    state = {}
+    rows = []
+    for turn in range(turns):
+        window.append("user", QUESTIONS[turn % len(QUESTIONS)])
+        started = time.perf_counter()
+        if mode == "cold":
+            resp = client.chat(model=model, messages=window.messages(), keep_alive=0)
+        else:
+            resp = prefix_cache.chat(
+                model=model,
+                messages=window.messages(),
+                state=state,
+                client=client,
+                reuse_context=mode == "context",
+                use_cache=False,
+            )
+        elapsed = time.perf_counter() - started
+
+        get = (lambda k: resp.get(k)) if isinstance(resp, dict) else (lambda k: getattr(resp, k, None))
+        message = get("message")
+        content = message.get("content", "") if isinstance(message, dict) else message.content
+        window.append("assistant", content.strip())
+        rows.append(
+            {
+                "mode": mode,
+                "turn": turn + 1,
+                "window_tokens": window.tokens,
+                "prompt_eval_count": get("prompt_eval_count") or 0,
+                "prompt_eval_ms": round((get("prompt_eval_duration") or 0) / 1e6, 1),
+                "total_ms": round(elapsed * 1000, 1),
+            }
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=os.environ.get("OLLAMA_MODEL", "llama3.2"))
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--budget", type=int, default=3072, help="presupuesto de tokens de la ventana")
+    parser.add_argument("--modes", default="cold,chat,context")
+    parser.add_argument("--host", default=os.environ.get("OLLAMA_HOST"))
+    parser.add_argument("--json", action="store_true", help="imprime los resultados como JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.modes.split(","):
+        results.extend(run_mode(mode.strip(), args.model, args.turns, args.budget, args.host))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'modo':<8} {'turno':>5} {'ventana':>8} {'prompt_eval':>11} {'prefill ms':>10} {'total ms':>9}")
+    for row in results:
+        print(
+            f"{row['mode']:<8} {row['turn']:>5} {row['window_tokens']:>8} {row['prompt_eval_count']:>11} "
+            f"{row['prompt_eval_ms']:>10} {row['total_ms']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
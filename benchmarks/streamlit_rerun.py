@@ -0,0 +1,103 @@
+"""
+Tiempo de rerun de las apps de Streamlit según la longitud de la conversación.
+
+Ejecuta la app con `streamlit.testing.v1.AppTest` y una conversación ya
+cargada de N mensajes, y mide cuánto tarda un rerun completo del script (lo
+que provoca cualquier widget fuera de un fragmento) y cuánto texto se pinta:
+
+ - full: STREAMLIT_HISTORY_PAGE=0, se pintan todos los mensajes en cada rerun
+   (comportamiento anterior; el tiempo y lo enviado al navegador crecen con la
+   conversación).
+ - paged: solo la última página de mensajes (STREAMLIT_HISTORY_PAGE, por
+   defecto 20); los anteriores se cargan bajo demanda.
+
+AppTest re-ejecuta siempre el script entero, así que estas cifras son el peor
+caso. En el navegador, enviar un mensaje o cargar mensajes anteriores solo
+re-ejecuta el fragmento del chat, y escribir en la caja del modelo solo el de la
+barra lateral, que no pinta la conversación.
+
+No necesita Ollama: solo se repinta el historial, sin generar respuestas.
+
+Uso:
+    python -m benchmarks.streamlit_rerun --sizes 10,100,500,2000 --modes full,paged
+El resultado se imprime como tabla y, con --json, como JSON.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_APP = os.path.join(ROOT, "TEST2-GPT_STREAMLIT", "test2_gpt_streamlit.py")
+
+# Respuesta de longitud típica (unos 600 caracteres)
+ANSWER = "Una respuesta de ejemplo con varias frases y algo de **markdown**. " * 9
+
+
+def _conversation(size: int):
+    return [
+        {"role": "user", "content": f"Pregunta número {i // 2 + 1}"}
+        if i % 2 == 0
+        else {"role": "assistant", "content": ANSWER, "error": None}
+        for i in range(size)
+    ]
+
+
+def run_mode(mode: str, app: str, size: int, page: int, reruns: int):
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["STREAMLIT_HISTORY_PAGE"] = "0" if mode == "full" else str(page)
+    at = AppTest.from_file(os.path.abspath(app), default_timeout=120)
+    at.session_state["messages"] = _conversation(size)
+    # Primer run fuera de la medida: inicializa la sesión
+    at.run()
+    times = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - started)
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return {
+        "mode": mode,
+        "messages": size,
+        "rendered": len(at.chat_message),
+        "rendered_kb": round(sum(len(m.value) for m in at.markdown) / 1024, 1),
+        "mean_ms": round(statistics.mean(times) * 1000, 1),
+        "p50_ms": round(statistics.median(times) * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default=DEFAULT_APP, help="script de Streamlit a medir")
+    parser.add_argument("--sizes", default="10,100,500,2000", help="mensajes en la conversación")
+    parser.add_argument("--modes", default="full,paged")
+    parser.add_argument("--page", type=int, default=20, help="mensajes por página en el modo paged")
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="imprime los resultados como JSON")
+    args = parser.parse_args(argv)
+
+    # Sin los logs del runtime de Streamlit (depuración y avisos) en la salida
+    logging.disable(logging.WARNING)
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        for mode in args.modes.split(","):
+            results.append(run_mode(mode.strip(), args.app, size, args.page, args.reruns))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'modo':<6} {'mensajes':>8} {'pintados':>8} {'KB':>7} {'media ms':>9} {'p50 ms':>8}")
+    for row in results:
+        print(
+            f"{row['mode']:<6} {row['messages']:>8} {row['rendered']:>8} {row['rendered_kb']:>7} "
+            f"{row['mean_ms']:>9} {row['p50_ms']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
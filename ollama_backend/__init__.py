@@ -0,0 +1,14 @@
+"""
+ollama_backend
+
+Código compartido por las variantes TEST1 (Gradio), TEST2 (Streamlit),
+TEST3 (Chainlit) y TEST4 (API HTTP) para hablar con Ollama.
+
+Los scripts de cada carpeta añaden la raíz del repositorio a `sys.path` y
+luego importan los submódulos que necesiten, por ejemplo:
+
+    from ollama_backend.cli_pool import run_prompt
+
+Los submódulos solo importan dependencias opcionales (`ollama`, `httpx`...)
+cuando se usan, para que cada variante pueda instalar únicamente lo suyo.
+"""
@@ -0,0 +1,320 @@
+"""
+Caché de respuestas por coincidencia exacta.
+
+Las demos y los casos de prueba repiten las mismas preguntas; en vez de pedir
+al modelo la misma respuesta una y otra vez se guarda por clave
+(modelo, lista de mensajes normalizada, opciones de generación).
+
+Niveles:
+ - Memoria: LRU acotado por número de entradas y por caracteres totales.
+ - Disco (opcional): SQLite en OLLAMA_CACHE_DB, para sobrevivir a reinicios.
+   Las entradas leídas de disco se copian a memoria.
+Las entradas caducan a los OLLAMA_CACHE_TTL segundos en ambos niveles.
+
+Está desactivada por defecto: con ella, un prompt repetido devuelve siempre la
+misma respuesta aunque el modelo muestree (temperatura > 0). Activada
+(OLLAMA_CACHE=1), las peticiones que piden muestreo explícitamente
+(`temperature` > 0 sin `seed` en las opciones) no la usan (`deterministic`).
+
+Las respuestas cacheadas se pueden reproducir como stream (`stream`/`astream`)
+para que las UIs en streaming no necesiten un camino distinto. Solo se guardan
+respuestas completas: si el stream falla o el consumidor deja de leer, no se
+cachea nada.
+
+Variables de entorno:
+     OLLAMA_CACHE: 1 activa la caché (por defecto desactivada)
+     OLLAMA_CACHE_TTL: segundos de vida de una entrada (0 = sin caducidad)
+     OLLAMA_CACHE_MAX_ENTRIES: entradas máximas en memoria
+     OLLAMA_CACHE_MAX_CHARS: caracteres máximos en memoria
+     OLLAMA_CACHE_DB: ruta del fichero SQLite (sin valor no hay nivel de disco)
+     OLLAMA_CACHE_DB_MAX_ENTRIES: entradas máximas en disco
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+CACHE_ENABLED = os.environ.get("OLLAMA_CACHE", "0") != "0"
+CACHE_TTL = float(os.environ.get("OLLAMA_CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.environ.get("OLLAMA_CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_CHARS = int(os.environ.get("OLLAMA_CACHE_MAX_CHARS", "5000000"))
+CACHE_DB = os.environ.get("OLLAMA_CACHE_DB") or None
+CACHE_DB_MAX_ENTRIES = int(os.environ.get("OLLAMA_CACHE_DB_MAX_ENTRIES", "10000"))
+
+T = TypeVar("T")
+
+# Trozos en los que se reproduce una respuesta cacheada (palabra + espacios)
+_FRAGMENT_RE = re.compile(r"\s*\S+\s*|\s+")
+
+
+def _normalize(messages: Union[str, List[Dict[str, str]]]) -> Any:
+    if isinstance(messages, str):
+        return messages.replace("\r\n", "\n").strip()
+    return [
+        [m.get("role", "user"), (m.get("content") or "").replace("\r\n", "\n").strip()]
+        for m in messages
+    ]
+
+
+def cache_key(
+    model: str,
+    messages: Union[str, List[Dict[str, str]]],
+    options: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Clave de la caché: hash de (modelo, mensajes normalizados, opciones).
+
+    `messages` puede ser una lista de mensajes role/content o el prompt ya
+    renderado que usan las variantes CLI.
+    """
+    payload = json.dumps([model, _normalize(messages), options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def deterministic(options: Optional[Dict[str, Any]]) -> bool:
+    """Si dos peticiones con estas opciones pueden compartir respuesta.
+
+    Con `temperature` > 0 y sin `seed` se pide muestreo explícitamente: cada
+    petición debe generar la suya (ni caché ni generación compartida).
+    """
+    if not options or options.get("seed") is not None:
+        return True
+    return not options.get("temperature")
+
+
+def replay_fragments(text: str) -> Iterator[str]:
+    """Trocea una respuesta cacheada para reproducirla como stream."""
+    for match in _FRAGMENT_RE.finditer(text):
+        yield match.group(0)
+
+
+class ResponseCache:
+    """Caché LRU en memoria con nivel opcional en SQLite y caducidad por TTL."""
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_chars: int = CACHE_MAX_CHARS,
+        ttl: float = CACHE_TTL,
+        path: Optional[str] = CACHE_DB,
+        max_disk_entries: int = CACHE_DB_MAX_ENTRIES,
+        enabled: bool = CACHE_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.total_chars = 0
+        # clave -> (respuesta, instante de creación); de menos a más recientemente usada
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path and enabled:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl > 0 and now - created > self.ttl
+
+    def _remember(self, key: str, value: str, created: float) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_chars -= len(old[0])
+        self._entries[key] = (value, created)
+        self.total_chars += len(value)
+        while self._entries and (len(self._entries) > self.max_entries or self.total_chars > self.max_chars):
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.total_chars -= len(evicted)
+            self.evictions += 1
+
+    def _forget(self, key: str) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_chars -= len(old[0])
+
+    def get(self, key: str) -> Optional[str]:
+        """Respuesta guardada para `key`, o None (cuenta como acierto o fallo)."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], now):
+                self._forget(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self._expired(row[1], now):
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                elif row is not None:
+                    self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    entry = (row[0], row[1])
+                    self._remember(key, *entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Guarda una respuesta completa (las vacías no se guardan)."""
+        if not self.enabled or not value or len(value) > self.max_chars:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self.stores += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, used) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                if self.ttl > 0:
+                    self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_chars = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "chars": self.total_chars,
+        }
+
+    def call(self, key: str, produce: Callable[[], str], bypass: bool = False) -> str:
+        """Devuelve la respuesta cacheada o la genera con `produce()` y la guarda."""
+        if bypass or not self.enabled:
+            return produce()
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        value = produce()
+        self.put(key, value)
+        return value
+
+    async def acall(self, key: str, produce: Callable[[], Awaitable[str]], bypass: bool = False) -> str:
+        if bypass or not self.enabled:
+            return await produce()
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        value = await produce()
+        self.put(key, value)
+        return value
+
+    def stream(
+        self,
+        key: str,
+        produce: Callable[[], Iterable[T]],
+        text: Callable[[T], str] = str,
+        wrap: Callable[[str], T] = lambda fragment: fragment,
+        bypass: bool = False,
+    ) -> Iterator[T]:
+        """Stream cacheado: reproduce la respuesta guardada o graba la de `produce()`.
+
+        `text(item)` extrae el texto de cada elemento del stream y
+        `wrap(fragment)` construye los elementos al reproducir desde la caché.
+        """
+        if bypass or not self.enabled:
+            yield from produce()
+            return
+        cached = self.get(key)
+        if cached is not None:
+            for fragment in replay_fragments(cached):
+                yield wrap(fragment)
+            return
+        parts: List[str] = []
+        for item in produce():
+            parts.append(text(item))
+            yield item
+        # Solo se llega aquí si el stream terminó sin errores y se leyó entero
+        self.put(key, "".join(parts))
+
+    async def astream(
+        self,
+        key: str,
+        produce: Callable[[], AsyncIterable[T]],
+        text: Callable[[T], str] = str,
+        wrap: Callable[[str], T] = lambda fragment: fragment,
+        bypass: bool = False,
+    ) -> AsyncIterator[T]:
+        """Versión asíncrona de `stream`."""
+        if bypass or not self.enabled:
+            async for item in produce():
+                yield item
+            return
+        cached = self.get(key)
+        if cached is not None:
+            for fragment in replay_fragments(cached):
+                yield wrap(fragment)
+            return
+        parts: List[str] = []
+        async for item in produce():
+            parts.append(text(item))
+            yield item
+        self.put(key, "".join(parts))
+
+
+_DEFAULT_CACHE: Optional[ResponseCache] = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+
+def default_cache() -> ResponseCache:
+    """Caché compartida por todas las variantes del proceso."""
+    global _DEFAULT_CACHE
+    with _DEFAULT_CACHE_LOCK:
+        if _DEFAULT_CACHE is None:
+            _DEFAULT_CACHE = ResponseCache()
+        return _DEFAULT_CACHE
@@ -0,0 +1,303 @@
+"""
+Cancelación de generaciones en curso.
+
+Cuando el usuario pulsa "Detener", envía otro mensaje antes de que termine la
+respuesta o cierra la pestaña, seguir generando solo quita capacidad a los
+usuarios que esperan en la cola. Cada variante pide un `CancelToken` por
+generación al registro compartido:
+
+ - `start(session_id)` cancela la generación anterior de la misma sesión (un
+   mensaje nuevo sustituye al que aún se estaba respondiendo).
+ - `cancel(session_id)` la cancela desde el botón de parar o al desconectarse.
+ - `token.guard(stream)` / `token.aguard(stream)` dejan de leer el stream en
+   cuanto se cancela y lo cierran.
+
+La cancelación no espera al siguiente fragmento: mientras el guard lee, el
+token queda activo en el contexto y las capas de abajo registran con
+`on_cancel` cómo cortar su parte. `cancel()` las llama de inmediato, también
+durante el prefill o la espera del primer token: se mata el proceso
+`ollama run` (ver `cli_pool`), se cancela la lectura HTTP asíncrona y se cierra
+el socket de la respuesta HTTP síncrona (desde que llegan sus cabeceras; antes
+se deja de esperar y la conexión se corta al llegar). Si otra petición
+idéntica sigue leyendo la misma generación (`singleflight`), esta continúa y
+solo se suelta el suscriptor cancelado.
+
+El registro cuenta las generaciones canceladas y estima los tokens ahorrados:
+la media de tokens de las respuestas completas menos lo ya generado.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import threading
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Generator, Iterable, Iterator, List, Optional, TypeVar
+
+from .streaming import chunk_text
+from .window import estimate_tokens
+
+T = TypeVar("T")
+
+
+class Cancelled(RuntimeError):
+    """La generación se cortó porque se canceló su token."""
+
+
+def _noop() -> None:
+    pass
+
+
+class CancelToken:
+    """Señal de cancelación de una generación."""
+
+    def __init__(self, session_id: str, registry: Optional["CancellationRegistry"] = None):
+        self.session_id = session_id
+        self.registry = registry
+        self.reason: Optional[str] = None
+        self.tokens = 0
+        self._event = threading.Event()
+        self._guards: List[Generator] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "stop") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            _call(callback)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Llama a `callback` al cancelar (ya, si lo está); devuelve cómo quitarlo."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        _call(callback)
+        return _noop
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    @contextlib.contextmanager
+    def active(self) -> Iterator["CancelToken"]:
+        """Hace de este token el de la generación que se lee en el contexto actual."""
+        reset = _ACTIVE.set(self)
+        try:
+            yield self
+        finally:
+            _ACTIVE.reset(reset)
+
+    def guard(self, stream: Iterable[T], text: Callable[[T], str] = chunk_text) -> Iterator[T]:
+        """Reproduce `stream` hasta que se cancele y entonces lo cierra."""
+        guarded = self._guard(stream, text)
+        self._guards.append(guarded)
+        return guarded
+
+    def _guard(self, stream: Iterable[T], text: Callable[[T], str]) -> Generator[T, None, None]:
+        iterator = iter(stream)
+        try:
+            while not self.cancelled:
+                with self.active():
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    except Exception:
+                        # El corte que provoca la cancelación no es un error
+                        if self.cancelled:
+                            break
+                        raise
+                self.tokens += estimate_tokens(text(item))
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    async def aguard(self, stream: AsyncIterable[T], text: Callable[[T], str] = chunk_text) -> AsyncIterator[T]:
+        """Versión asíncrona de `guard`: al cancelar se abandona la lectura pendiente."""
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+
+        def _stop() -> None:
+            try:
+                loop.call_soon_threadsafe(lambda: stopped.done() or stopped.set_result(None))
+            except RuntimeError:
+                # El event loop ya se cerró
+                pass
+
+        remove = self.on_cancel(_stop)
+        iterator = stream.__aiter__()
+        pending: Optional[asyncio.Future] = None
+        try:
+            while not self.cancelled:
+                with self.active():
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait((pending, stopped), return_when=asyncio.FIRST_COMPLETED)
+                if not pending.done():
+                    break
+                done, pending = pending, None
+                try:
+                    item = done.result()
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    if self.cancelled:
+                        break
+                    raise
+                self.tokens += estimate_tokens(text(item))
+                yield item
+        finally:
+            remove()
+            stopped.cancel()
+            if pending is not None:
+                # Cancelar la lectura en curso cierra la respuesta HTTP o mata el proceso
+                pending.cancel()
+                await asyncio.wait((pending,))
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def finish(self) -> None:
+        """Marca la generación como terminada (completa o cancelada)."""
+        with self._lock:
+            self._callbacks.clear()
+        if self.registry is not None:
+            self.registry.finish(self)
+
+    def __enter__(self) -> "CancelToken":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            # GeneratorExit (Gradio cierra el handler al desconectarse el cliente),
+            # CancelledError (botón de parar de Chainlit) o el reinicio del script
+            # de Streamlit: la generación se abandona
+            self.cancel("interrupted")
+            # La excepción mantiene vivo el frame del llamador (y con él el stream)
+            # hasta que alguien la captura: se cierra ya
+            for guarded in self._guards:
+                try:
+                    guarded.close()
+                except ValueError:
+                    # Lo está leyendo otro thread (`streaming.coalesce`): se detiene
+                    # él solo al ver la cancelación
+                    pass
+        self._guards.clear()
+        self.finish()
+
+
+_ACTIVE: "contextvars.ContextVar[Optional[CancelToken]]" = contextvars.ContextVar("ollama_cancel_token", default=None)
+
+
+def _call(callback: Callable[[], None]) -> None:
+    try:
+        callback()
+    except Exception:
+        # Lo que no se pudo cortar termina solo al llegar el siguiente fragmento
+        pass
+
+
+def on_cancel(callback: Callable[[], None]) -> Callable[[], None]:
+    """Registra `callback` en la generación que se lee en este contexto, si hay alguna.
+
+    Lo usan los backends para cortar su parte (matar el proceso, cerrar la
+    conexión...). Devuelve la función que lo quita al terminar.
+    """
+    token = _ACTIVE.get()
+    if token is None:
+        return _noop
+    return token.on_cancel(callback)
+
+
+def is_cancelled() -> bool:
+    """True si se canceló la generación que se lee en este contexto.
+
+    Permite distinguir el error que provoca el propio corte (conexión cerrada,
+    proceso muerto) de un fallo del servidor.
+    """
+    token = _ACTIVE.get()
+    return token is not None and token.cancelled
+
+
+class CancellationRegistry:
+    """Generación en curso de cada sesión y métricas de cancelación."""
+
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+        self.superseded = 0
+        self.tokens_generated = 0
+        self.tokens_saved = 0
+        self._current: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_id: str) -> CancelToken:
+        """Token para una generación nueva; cancela la anterior de la sesión."""
+        token = CancelToken(session_id, self)
+        with self._lock:
+            previous = self._current.get(session_id)
+            self._current[session_id] = token
+        if previous is not None:
+            previous.cancel("superseded")
+        return token
+
+    def cancel(self, session_id: str, reason: str = "stop") -> bool:
+        """Cancela la generación en curso de la sesión; devuelve si había alguna."""
+        with self._lock:
+            token = self._current.get(session_id)
+        if token is None or token.cancelled:
+            return False
+        token.cancel(reason)
+        return True
+
+    def finish(self, token: CancelToken) -> None:
+        with self._lock:
+            if self._current.get(token.session_id) is token:
+                del self._current[token.session_id]
+            if token.registry is not self:
+                return
+            token.registry = None
+            if token.cancelled:
+                self.cancelled += 1
+                if token.reason == "superseded":
+                    self.superseded += 1
+                if self.completed:
+                    self.tokens_saved += max(0, self.tokens_generated // self.completed - token.tokens)
+            else:
+                self.completed += 1
+                self.tokens_generated += token.tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._current),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "superseded": self.superseded,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+_DEFAULT_REGISTRY: Optional[CancellationRegistry] = None
+_DEFAULT_REGISTRY_LOCK = threading.Lock()
+
+
+def default_cancellations() -> CancellationRegistry:
+    """Registro de cancelación compartido por todas las variantes del proceso."""
+    global _DEFAULT_REGISTRY
+    with _DEFAULT_REGISTRY_LOCK:
+        if _DEFAULT_REGISTRY is None:
+            _DEFAULT_REGISTRY = CancellationRegistry()
+        return _DEFAULT_REGISTRY
@@ -0,0 +1,216 @@
+"""
+Flujo de un turno de chat: cola, cancelación y conversación de cada sesión.
+
+Todas las apps de chat responden igual a un mensaje: cancelan la respuesta que
+la sesión aún estaba generando (ver `ollama_backend.cancellation`), piden turno
+en el planificador compartido (`ollama_backend.scheduler`), muestran la
+posición en la cola mientras esperan y leen el stream del modelo hasta que
+termina, falla o se cancela. Lo que cambia entre variantes es cómo se obtiene
+la respuesta (CLI o librería) y cómo se pinta.
+
+ - `Turn`: una respuesta del modelo. Agrupa el turno en el planificador, el
+   token de cancelación, el texto recibido y el error, y decide el texto que
+   queda en el chat (`outcome()`).
+ - `ChatSessions`: la conversación completa de cada sesión en el servidor,
+   para las apps de Gradio: lo visible (`TranscriptStore`), el contexto del
+   modelo (`SessionHistoryStore`) y `respond()`, que recorre el turno entero
+   y avisa de cada cambio para repintar.
+
+Cada variante aporta `produce(messages, state)`, que devuelve el stream de la
+respuesta: textos (o fragmentos de `ollama.chat`) y, si falla, un dict
+{"error": "..."} con el mensaje a mostrar.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .cancellation import CancellationRegistry, default_cancellations
+from .compaction import Compactor
+from .history import SessionHistoryStore, TranscriptStore
+from .scheduler import QueueFull, Scheduler, default_scheduler
+from .streaming import chunk_text, coalesce
+
+STOPPED = "[Respuesta detenida]"
+
+Produce = Callable[[List[Dict[str, str]], Dict[str, Any]], Iterable[Any]]
+Entries = List[Tuple[str, str]]
+
+
+class Turn:
+    """Una respuesta del modelo para `session_id`.
+
+    Al crearla se cancela la generación anterior de la sesión y se pide turno en
+    el planificador (lanza `QueueFull` si la cola está llena). Se usa como
+    context manager: al salir se libera el hueco y, si la salida es una
+    interrupción (cliente desconectado, rerun de Streamlit), se cancela.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        scheduler: Optional[Scheduler] = None,
+        cancellations: Optional[CancellationRegistry] = None,
+    ):
+        self.session_id = session_id
+        self.generation = (cancellations or default_cancellations()).start(session_id)
+        try:
+            self.ticket = (scheduler or default_scheduler()).enqueue(session_id)
+        except QueueFull:
+            self.generation.finish()
+            raise
+        self.text = ""
+        self.error: Optional[str] = None
+
+    def __enter__(self) -> "Turn":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        try:
+            self.generation.__exit__(*exc)
+        finally:
+            self.ticket.release()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.generation.cancelled
+
+    @property
+    def superseded(self) -> bool:
+        """Otro mensaje de la misma sesión sustituyó a este: esa petición pinta el chat."""
+        return self.generation.reason == "superseded"
+
+    def waiting(self) -> Iterator[int]:
+        """Posición en la cola mientras se espera hueco; se deja de esperar al cancelar."""
+        for position in self.ticket.waiting():
+            if self.cancelled:
+                return
+            yield position
+
+    def fragments(self, stream: Iterable[Any]) -> Iterator[str]:
+        """Texto de `stream` hasta que termine, se cancele o llegue un {"error": ...}.
+
+        Al cancelar se deja de leer y se cierra el stream (y con él el `ollama
+        run` o la respuesta HTTP). El texto se acumula en `text` y el error en
+        `error`; las excepciones del stream se propagan.
+        """
+        if self.cancelled:
+            return
+        for part in self.generation.guard(stream):
+            if isinstance(part, dict) and part.get("error"):
+                self.error = part["error"]
+                return
+            text = chunk_text(part)
+            self.text += text
+            yield text
+
+    def outcome(self, stopped: str = STOPPED) -> str:
+        """Texto que queda en el chat: lo recibido y, debajo, si se detuvo o el error."""
+        answer = self.text.strip()
+        if self.cancelled:
+            return f"{answer}\n\n{stopped}".strip()
+        if self.error:
+            # Se conserva lo que llegó antes del fallo
+            return f"{answer}\n\n{self.error}".strip()
+        return answer
+
+
+class ChatSessions:
+    """Conversaciones de una app de chat guardadas en el servidor, por id de sesión.
+
+    `transcripts` guarda lo que se ve en el chat, completo; `context` lo que se
+    envía al modelo (ventana por presupuesto de tokens, con los turnos antiguos
+    resumidos por `compactor` si se indica). Las dos se liberan con `end()`.
+    Mientras llega la respuesta, el chat se repinta como mucho cada
+    `flush_interval` segundos o cada `flush_chars` caracteres (ver `streaming.coalesce`).
+    """
+
+    def __init__(
+        self,
+        compactor: Optional[Compactor] = None,
+        flush_interval: float = 0.05,
+        flush_chars: int = 64,
+        scheduler: Optional[Scheduler] = None,
+        cancellations: Optional[CancellationRegistry] = None,
+    ):
+        self.context = SessionHistoryStore(compactor=compactor)
+        self.transcripts = TranscriptStore()
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.scheduler = scheduler
+        self.cancellations = cancellations
+
+    def page(self, session_id: str, turn: int, shown: int) -> Entries:
+        """Mensajes anteriores al turno `turn`: los últimos `shown` (0 = todos)."""
+        start = max(0, turn - shown) if shown else 0
+        return self.transcripts.messages(session_id, start, turn)
+
+    def current(self, session_id: str, turn: int) -> Entries:
+        """Solo el turno que empieza en `turn` (mensaje del usuario y respuesta)."""
+        return self.transcripts.messages(session_id, turn)
+
+    def older(self, session_id: str, shown: int) -> Entries:
+        """Los últimos `shown` mensajes anteriores al turno en curso."""
+        return self.page(session_id, self.transcripts.turn_start(session_id), shown)
+
+    def respond(
+        self, session_id: str, message: str, produce: Produce, shown: int = 0, stream: bool = True
+    ) -> Iterator[Tuple[Optional[Entries], Entries]]:
+        """Responde a `message` y produce (anteriores, turno) cada vez que cambia el chat.
+
+        `anteriores` es la página de los últimos `shown` mensajes anteriores solo
+        en la primera actualización (y None en las demás, para no reenviarla);
+        `turno` es el turno en curso. Con `stream=False` solo se produce la
+        actualización final. Si un mensaje posterior de la misma sesión
+        sustituye a este, termina sin más actualizaciones: la petición nueva es
+        la que pinta el chat.
+        """
+        # Un chat vacío empieza conversación nueva
+        turn = self.transcripts.append(session_id, "user", message)
+        try:
+            reply = Turn(session_id, self.scheduler, self.cancellations)
+        except QueueFull as e:
+            self.transcripts.append(session_id, "assistant", f"[Error] {e}")
+            yield self.page(session_id, turn, shown), self.current(session_id, turn)
+            return
+
+        with reply:
+            if turn == 0:
+                self.context.clear(session_id)
+            self.context.append(session_id, "user", message)
+            # Contexto de la sesión: resumen de los turnos antiguos + turnos recientes
+            # que caben en el presupuesto de tokens
+            parts = produce(self.context.messages(session_id), self.context.state(session_id))
+
+            # Respuesta vacía que se va actualizando; se muestra de inmediato junto con
+            # los mensajes anteriores y a partir de aquí solo se envía el turno
+            index = self.transcripts.append(session_id, "assistant", "")
+            if stream:
+                yield self.page(session_id, turn, shown), self.current(session_id, turn)
+
+            for position in reply.waiting():
+                if stream:
+                    self.transcripts.update(session_id, index, f"En cola (posición {position})...")
+                    yield None, self.current(session_id, turn)
+
+            # Los fragmentos se agrupan para repintar una vez por ventana y no por token
+            for _ in coalesce(reply.fragments(parts), interval=self.flush_interval, max_chars=self.flush_chars):
+                if stream:
+                    self.transcripts.update(session_id, index, reply.text)
+                    yield None, self.current(session_id, turn)
+
+        self.transcripts.update(session_id, index, reply.outcome())
+        if reply.superseded:
+            return
+        # Al contexto del modelo solo va el texto recibido
+        if reply.text.strip():
+            self.context.append(session_id, "assistant", reply.text.strip())
+        yield (None if stream else self.page(session_id, turn, shown)), self.current(session_id, turn)
+
+    def stop(self, session_id: str) -> None:
+        """Corta la respuesta que se está generando en la sesión."""
+        (self.cancellations or default_cancellations()).cancel(session_id)
+
+    def end(self, session_id: str) -> None:
+        """Libera la sesión (conversación visible y contexto del modelo), p. ej. al cerrar la pestaña."""
+        (self.cancellations or default_cancellations()).cancel(session_id, "disconnect")
+        self.transcripts.clear(session_id)
+        self.context.clear(session_id)
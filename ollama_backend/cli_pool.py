@@ -0,0 +1,675 @@
+"""
+Pool de procesos `ollama run <model>` de larga duración.
+
+En lugar de lanzar un `ollama run <model> "prompt"` nuevo por cada mensaje,
+cada worker mantiene abierta una sesión interactiva de la CLI conectada a un
+pseudo-terminal y le envía los prompts por stdin. Así el coste de arrancar el
+binario y enlazarlo con el modelo se paga una sola vez por worker.
+
+Comportamiento:
+ - Un pool por modelo y servidor, con tamaño máximo (OLLAMA_CLI_POOL_SIZE).
+   Con varios servidores (OLLAMA_HOSTS) cada mensaje va al que elige
+   `ollama_backend.router`; si un worker no llega a conectar, se reintenta
+   en otro servidor.
+ - Cada worker se recicla tras OLLAMA_CLI_MAX_REQUESTS peticiones, o de
+   inmediato si el proceso muere, expira o la respuesta se interrumpe.
+ - Los workers ociosos durante más de OLLAMA_CLI_HEALTH_INTERVAL segundos se
+   comprueban (Enter vacío -> debe reaparecer el prompt `>>> `) antes de usarse.
+ - Una respuesta termina cuando ollama vuelve a pintar el prompt completo
+   (`>>> ` y su placeholder), no con cualquier línea que empiece por `>>> `.
+ - Antes de cada petición se envía `/clear`, porque la sesión interactiva
+   acumula su propio historial y los llamadores ya envían el contexto completo.
+
+Con OLLAMA_KEEP_ALIVE se pasa `--keepalive` a la CLI para que el servidor
+mantenga el modelo (y su caché KV) cargado entre mensajes; los modelos fijados
+por `ollama_backend.residency` no se descargan.
+
+En plataformas sin `pty` (Windows) o con OLLAMA_CLI_POOL=0 se usa el modo
+clásico de un proceso por mensaje. En ese modo el prompt también se envía por
+stdin y no como argumento, sin límite de longitud.
+
+Los llamadores asíncronos (Chainlit, handlers `async` de Gradio) usan
+`astream_prompt` / `arun_prompt`, que salen de los mismos workers del pool: la
+respuesta se lee en un thread (`streaming.iterate_in_thread`) y el número de
+threads se limita a la capacidad total de los pools, de modo que los mensajes
+que esperan worker esperan en el bucle de eventos y no ocupan un thread. Sin
+pool se lanza un proceso por mensaje con `asyncio.create_subprocess_exec`,
+leído desde el bucle de eventos.
+
+Al cancelar la generación (`ollama_backend.cancellation`) el proceso se mata
+en el acto, aunque Ollama aún no haya empezado a responder, y se lanza
+`Cancelled`; el worker se recicla.
+
+Errores: se lanzan las mismas excepciones que `subprocess.run` para que los
+llamadores existentes sigan funcionando (`FileNotFoundError` si no existe el
+binario, `subprocess.TimeoutExpired` si expira) y `CLIError` si Ollama falla.
+Si la CLI no empieza a responder o se queda a medias se lanza
+`DeadlineExceeded` (ver `ollama_backend.deadlines`) y el proceso se mata.
+"""
+
+import asyncio
+import atexit
+import codecs
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+import weakref
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from .cache import cache_key, default_cache
+from .cancellation import Cancelled, on_cancel
+from .residency import default_residency
+from .deadlines import DEFAULT_DEADLINES, Deadlines
+from .router import Backend, default_router
+from .singleflight import default_singleflight
+from .streaming import iterate_in_thread
+
+try:
+    import fcntl
+    import pty
+    import struct
+    import termios
+
+    _HAS_PTY = True
+except ImportError:  # Windows
+    _HAS_PTY = False
+
+
+POOL_ENABLED = os.environ.get("OLLAMA_CLI_POOL", "1") != "0"
+POOL_SIZE = int(os.environ.get("OLLAMA_CLI_POOL_SIZE", "2"))
+MAX_REQUESTS = int(os.environ.get("OLLAMA_CLI_MAX_REQUESTS", "100"))
+HEALTH_CHECK_INTERVAL = float(os.environ.get("OLLAMA_CLI_HEALTH_INTERVAL", "30"))
+STARTUP_TIMEOUT = float(os.environ.get("OLLAMA_CLI_STARTUP_TIMEOUT", "60"))
+
+# Secuencias de escape ANSI y caracteres braille del spinner de `ollama run`
+_ANSI_RE = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b[@-Z\\-_]|[⠀-⣿]|\r")
+# Secuencia de escape cortada al final de un bloque leído
+_PARTIAL_ANSI_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*)?$")
+# Prompt interactivo que ollama vuelve a pintar al terminar cada respuesta: con
+# la línea vacía lleva siempre el placeholder. Un `>>> ` suelto no basta, porque
+# puede ser parte de la respuesta (p. ej. un ejemplo de la consola de Python).
+_PROMPT_TEXT = ">>> Send a message (/? for help)"
+_PROMPT_RE = re.compile(r"(?:^|\n)>>> Send a message \(/\? for help\)[ \t]*$")
+
+_PASTE_START = "\x1b[200~"
+_PASTE_END = "\x1b[201~"
+
+
+class CLIError(RuntimeError):
+    """La CLI de Ollama terminó con error o el worker dejó de responder."""
+
+
+class CLIStartupError(CLIError):
+    """`ollama run` terminó antes de empezar a responder (p. ej. sin servidor)."""
+
+    @property
+    def connect_error(self) -> bool:
+        # El router solo reintenta en otro servidor los fallos de conexión
+        return "connect" in str(self).lower()
+
+
+def _could_be_prompt(line: str) -> bool:
+    """True si `line` puede ser el comienzo del prompt aún incompleto."""
+    return _PROMPT_TEXT.startswith(line)
+
+
+def _run_command(model: str) -> List[str]:
+    cmd = ["ollama", "run", model]
+    keep_alive = default_residency().keep_alive(model)
+    if keep_alive:
+        cmd += ["--keepalive", keep_alive]
+    return cmd
+
+
+class CLIWorker:
+    """Una sesión interactiva `ollama run <model>` sobre un pseudo-terminal."""
+
+    def __init__(self, model: str, cmd: Optional[List[str]] = None, env: Optional[Dict[str, str]] = None):
+        self.model = model
+        self.cmd = cmd or _run_command(model)
+        self.env = env or {}
+        self.requests_served = 0
+        self.last_used = time.monotonic()
+        self._proc: Optional[subprocess.Popen] = None
+        self._fd: Optional[int] = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._carry = ""
+
+    # -- ciclo de vida -----------------------------------------------------
+
+    def start(self, timeout: float = STARTUP_TIMEOUT) -> None:
+        master, slave = pty.openpty()
+        # Terminal ancho y sin eco: ollama pinta su propio prompt y no debe
+        # partir las respuestas en varias líneas.
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", 50, 10000, 0, 0))
+        attrs = termios.tcgetattr(slave)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+
+        env = dict(os.environ, NO_COLOR="1", **self.env)
+        try:
+            self._proc = subprocess.Popen(
+                self.cmd,
+                stdin=slave,
+                stdout=slave,
+                stderr=slave,
+                env=env,
+                close_fds=True,
+                start_new_session=True,
+            )
+        except Exception:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        self._fd = master
+
+        deadline = time.monotonic() + timeout
+        output = ""
+        try:
+            while not _PROMPT_RE.search(output):
+                output += self._read(deadline)
+        except CLIError:
+            raise CLIStartupError(
+                f"No se pudo arrancar 'ollama run {self.model}': {output.strip() or 'sin salida'}"
+            ) from None
+        self._command("/set nowordwrap", deadline)
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            try:
+                self._proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+        self._fd = None
+
+    def kill(self) -> None:
+        """Mata el proceso sin cerrar el terminal, que puede estar leyéndolo otro thread."""
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None and self._fd is not None
+
+    def ping(self, timeout: float = 5.0) -> bool:
+        """Comprobación de salud: un Enter vacío debe devolver el prompt."""
+        try:
+            self._command("", time.monotonic() + timeout)
+            return True
+        except Exception:
+            return False
+
+    # -- E/S -----------------------------------------------------------------
+
+    def _write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
+
+    def _read(self, deadline: float) -> str:
+        """Lee lo disponible del terminal, limpio de secuencias ANSI."""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.cmd, 0)
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError:
+                data = b""
+            if not data:
+                raise CLIError(f"El proceso 'ollama run {self.model}' terminó inesperadamente.")
+            text = self._carry + self._decoder.decode(data)
+            partial = _PARTIAL_ANSI_RE.search(text)
+            if partial:
+                text, self._carry = text[: partial.start()], text[partial.start() :]
+            else:
+                self._carry = ""
+            text = _ANSI_RE.sub("", text)
+            if text:
+                return text
+
+    def _drain(self) -> None:
+        """Descarta lo que quede por leer del terminal (restos de una respuesta anterior)."""
+        while self._fd is not None and select.select([self._fd], [], [], 0)[0]:
+            try:
+                if not os.read(self._fd, 4096):
+                    break
+            except OSError:
+                break
+        self._decoder.reset()
+        self._carry = ""
+
+    def _wait_prompt(self, deadline: float) -> str:
+        output = ""
+        while not _PROMPT_RE.search(output):
+            output += self._read(deadline)
+        return output
+
+    def _command(self, command: str, deadline: float) -> None:
+        self._write(command + "\r")
+        self._wait_prompt(deadline)
+
+    def stream(self, prompt: str, timeout: float, deadlines: Deadlines = DEFAULT_DEADLINES) -> Iterator[str]:
+        """Envía `prompt` y produce fragmentos de la respuesta según llegan.
+
+        El texto se pega como "bracketed paste" para que los saltos de línea
+        formen parte del mismo mensaje. Se descarta el eco que ollama pinta de
+        la entrada (una línea por cada línea del prompt) y la respuesta termina
+        cuando vuelve a aparecer el prompt completo (ver `_PROMPT_RE`).
+        """
+        killed: List[bool] = []
+
+        def _kill() -> None:
+            killed.append(True)
+            self.kill()
+
+        remove = on_cancel(_kill)
+        try:
+            yield from self._stream(prompt, timeout, deadlines)
+        except CLIError:
+            if killed:
+                raise Cancelled("Generación cancelada.") from None
+            raise
+        finally:
+            remove()
+
+    def _stream(self, prompt: str, timeout: float, deadlines: Deadlines) -> Iterator[str]:
+        clock = deadlines.clock(total=timeout)
+        self.last_used = time.monotonic()
+        # Sin restos en el terminal, el prompt que se espera es el que sigue a `/clear`
+        self._drain()
+        self._command("/clear", clock.next_deadline()[0])
+        self._write(_PASTE_START + prompt + _PASTE_END + "\r")
+
+        echo_lines = prompt.count("\n") + 1
+        pending = ""
+        started = False
+        while True:
+            deadline, kind = clock.next_deadline()
+            try:
+                pending += self._read(deadline)
+            except subprocess.TimeoutExpired:
+                if kind == "total":
+                    raise
+                raise clock.exceeded(kind) from None
+            while echo_lines and "\n" in pending:
+                pending = pending.split("\n", 1)[1]
+                echo_lines -= 1
+            if echo_lines:
+                continue
+
+            match = _PROMPT_RE.search(pending)
+            if match:
+                out, pending = pending[: match.start()], ""
+                done = True
+            else:
+                # Retener la línea actual si podría ser el prompt que cierra la respuesta
+                cut = pending.rfind("\n")
+                line = pending[cut + 1 :]
+                if _could_be_prompt(line):
+                    cut = max(cut, 0)
+                    out, pending = pending[:cut], pending[cut:]
+                else:
+                    out, pending = pending, ""
+                done = False
+
+            if not started:
+                out = out.lstrip()
+                started = bool(out)
+            if out:
+                clock.tick()
+                yield out
+            if done:
+                self.requests_served += 1
+                self.last_used = time.monotonic()
+                return
+
+
+class CLIWorkerPool:
+    """Pool acotado de `CLIWorker` para un modelo (y servidor, vía `env`)."""
+
+    def __init__(
+        self,
+        model: str,
+        size: int = POOL_SIZE,
+        max_requests: int = MAX_REQUESTS,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+        env: Optional[Dict[str, str]] = None,
+    ):
+        self.model = model
+        self.env = env or {}
+        self.size = max(1, size)
+        self.max_requests = max_requests
+        self.health_check_interval = health_check_interval
+        self._idle: List[CLIWorker] = []
+        self._total = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _healthy(self, worker: CLIWorker) -> bool:
+        if not worker.is_alive():
+            return False
+        if time.monotonic() - worker.last_used > self.health_check_interval:
+            return worker.ping()
+        return True
+
+    def _acquire(self, timeout: float) -> CLIWorker:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise CLIError("El pool de workers de Ollama está cerrado.")
+                if self._idle:
+                    worker = self._idle.pop()
+                elif self._total < self.size:
+                    self._total += 1
+                    worker = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise subprocess.TimeoutExpired(["ollama", "run", self.model], timeout)
+                    self._cond.wait(remaining)
+                    continue
+
+            if worker is not None:
+                if self._healthy(worker):
+                    return worker
+                self._discard(worker)
+                continue
+
+            worker = CLIWorker(self.model, env=self.env)
+            try:
+                worker.start(timeout=min(STARTUP_TIMEOUT, max(deadline - time.monotonic(), 0.1)))
+            except BaseException:
+                self._discard(worker)
+                raise
+            return worker
+
+    def _discard(self, worker: CLIWorker) -> None:
+        worker.close()
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def _release(self, worker: CLIWorker, ok: bool) -> None:
+        if ok and worker.is_alive() and worker.requests_served < self.max_requests:
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(worker)
+                    self._cond.notify()
+                    return
+        self._discard(worker)
+
+    def stream(self, prompt: str, timeout: float = 60) -> Iterator[str]:
+        worker = self._acquire(timeout)
+        ok = False
+        try:
+            for fragment in worker.stream(prompt, timeout):
+                yield fragment
+            ok = True
+        finally:
+            # Si la respuesta no se leyó completa el worker queda a medias: se recicla
+            self._release(worker, ok)
+
+    def run(self, prompt: str, timeout: float = 60) -> str:
+        return "".join(self.stream(prompt, timeout)).strip()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            self._discard(worker)
+
+
+_POOLS: Dict[Tuple[str, Optional[str]], CLIWorkerPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(model: str, backend: Optional[Backend] = None) -> CLIWorkerPool:
+    """Pool de `model` contra `backend` (por defecto, el servidor de OLLAMA_HOST)."""
+    host = backend.host if backend is not None else None
+    with _POOLS_LOCK:
+        pool = _POOLS.get((model, host))
+        if pool is None:
+            env = backend.cli_env() if backend is not None else None
+            pool = _POOLS[(model, host)] = CLIWorkerPool(model, env=env)
+        return pool
+
+
+def pool_available() -> bool:
+    return POOL_ENABLED and _HAS_PTY
+
+
+def _stream_once(prompt: str, model: str, timeout: float, env: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """Modo clásico: un proceso `ollama run <model>` por mensaje.
+
+    El prompt se escribe por stdin (la CLI lo lee entero si no es un terminal)
+    y no como argumento, que con conversaciones largas supera el límite de
+    longitud de la línea de comandos del sistema. La salida se lee de forma
+    incremental en lugar de esperar a que el proceso termine, para poder
+    mostrar la respuesta mientras se genera.
+    """
+    cmd = _run_command(model)
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=dict(os.environ, **(env or {})),
+    )
+    clock = DEFAULT_DEADLINES.clock(total=timeout)
+    expired: List[str] = []
+
+    def _expire(kind):
+        expired.append(kind)
+        proc.kill()
+
+    remove = on_cancel(lambda: _expire("cancelled"))
+
+    def _arm():
+        remaining, kind = clock.remaining()
+        timer = threading.Timer(remaining, _expire, args=(kind,))
+        timer.start()
+        return timer
+
+    timer = _arm()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    started = False
+    try:
+        try:
+            proc.stdin.write(prompt.encode("utf-8"))
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            # El proceso terminó sin leer el prompt; el error sale por stderr
+            pass
+        while True:
+            data = proc.stdout.read1(4096)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if not started:
+                text = text.lstrip()
+                started = bool(text)
+            if text:
+                # Cada fragmento aplaza el plazo (hueco entre fragmentos)
+                timer.cancel()
+                clock.tick()
+                timer = _arm()
+                yield text
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.wait()
+    finally:
+        remove()
+        timer.cancel()
+        if proc.poll() is None:
+            # El consumidor dejó de leer: no dejar el proceso generando
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+    if expired and expired[0] == "cancelled":
+        raise Cancelled("Generación cancelada.")
+    if expired and expired[0] != "total":
+        raise clock.exceeded(expired[0])
+    if expired:
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if proc.returncode != 0:
+        raise (CLIError if started else CLIStartupError)(stderr.strip())
+
+
+async def _astream_once(
+    prompt: str, model: str, timeout: float, env: Optional[Dict[str, str]] = None
+) -> AsyncIterator[str]:
+    """Versión asíncrona de `_stream_once` con `asyncio.create_subprocess_exec`.
+
+    El prompt también se envía por stdin.
+
+    Los plazos de primer fragmento y entre fragmentos los aplica el router; al
+    vencer, cancelar la tarea o dejar de leer, el proceso se mata.
+    """
+    cmd = _run_command(model)
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=dict(os.environ, **(env or {})),
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    started = False
+    try:
+        # El prompt va por stdin, como en `_stream_once`
+        proc.stdin.write(prompt.encode("utf-8"))
+        try:
+            await asyncio.wait_for(proc.stdin.drain(), max(deadline - loop.time(), 0))
+            proc.stdin.close()
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        while True:
+            try:
+                data = await asyncio.wait_for(proc.stdout.read(4096), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                raise subprocess.TimeoutExpired(cmd, timeout) from None
+            if not data:
+                break
+            text = decoder.decode(data)
+            if not started:
+                text = text.lstrip()
+                started = bool(text)
+            if text:
+                yield text
+        stderr = (await proc.stderr.read()).decode("utf-8", errors="replace")
+        await proc.wait()
+    finally:
+        if proc.returncode is None:
+            # El consumidor dejó de leer: no dejar el proceso generando
+            proc.kill()
+            await proc.wait()
+    if proc.returncode != 0:
+        raise (CLIError if started else CLIStartupError)(stderr.strip())
+
+
+def _stream_on(backend: Backend, prompt: str, model: str, timeout: float) -> Iterator[str]:
+    if not pool_available():
+        return _stream_once(prompt, model, timeout, env=backend.cli_env())
+    return get_pool(model, backend).stream(prompt, timeout=timeout)
+
+
+def _stream_uncached(prompt: str, model: str, timeout: float) -> Iterator[str]:
+    return default_router().stream(model, lambda backend: _stream_on(backend, prompt, model, timeout))
+
+
+def _astream_uncached(prompt: str, model: str, timeout: float) -> AsyncIterator[str]:
+    return default_router().astream(
+        model, lambda backend: _astream_once(prompt, model, timeout, env=backend.cli_env())
+    )
+
+
+def stream_prompt(prompt: str, model: str, timeout: float = 60, use_cache: bool = True) -> Iterator[str]:
+    """Produce la respuesta de `ollama run` para `prompt` por fragmentos.
+
+    Las respuestas completas se guardan en la caché compartida
+    (`ollama_backend.cache`); `use_cache=False` la ignora. Las peticiones
+    idénticas en curso comparten una sola generación
+    (`ollama_backend.singleflight`).
+    """
+    key = cache_key(model, prompt)
+    return default_cache().stream(
+        key,
+        lambda: default_singleflight().stream(key, lambda: _stream_uncached(prompt, model, timeout)),
+        bypass=not use_cache,
+    )
+
+
+def run_prompt(prompt: str, model: str, timeout: float = 60, use_cache: bool = True) -> str:
+    """Devuelve la respuesta completa de `ollama run` para `prompt`."""
+    return "".join(stream_prompt(prompt, model, timeout=timeout, use_cache=use_cache)).strip()
+
+
+# Threads que leen del pool por bucle de eventos (ver `_astream_pooled`)
+_THREAD_SLOTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _thread_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _THREAD_SLOTS.get(loop)
+    if slots is None:
+        # Un thread por worker posible: los demás mensajes esperan sin ocupar thread
+        slots = _THREAD_SLOTS[loop] = asyncio.Semaphore(POOL_SIZE * len(default_router().backends))
+    return slots
+
+
+async def _astream_pooled(prompt: str, model: str, timeout: float, use_cache: bool) -> AsyncIterator[str]:
+    async with _thread_slots():
+        async for fragment in iterate_in_thread(stream_prompt(prompt, model, timeout=timeout, use_cache=use_cache)):
+            yield fragment
+
+
+def astream_prompt(prompt: str, model: str, timeout: float = 60, use_cache: bool = True) -> AsyncIterator[str]:
+    """Versión asíncrona de `stream_prompt` (misma caché y deduplicación).
+
+    Con pool usa sus workers persistentes; sin él, un proceso por mensaje.
+    """
+    if pool_available():
+        return _astream_pooled(prompt, model, timeout, use_cache)
+    key = cache_key(model, prompt)
+    return default_cache().astream(
+        key,
+        lambda: default_singleflight().astream(key, lambda: _astream_uncached(prompt, model, timeout)),
+        bypass=not use_cache,
+    )
+
+
+async def arun_prompt(prompt: str, model: str, timeout: float = 60, use_cache: bool = True) -> str:
+    """Versión asíncrona de `run_prompt`."""
+    parts = [fragment async for fragment in astream_prompt(prompt, model, timeout=timeout, use_cache=use_cache)]
+    return "".join(parts).strip()
+
+
+@atexit.register
+def shutdown() -> None:
+    """Cierra todos los workers (se llama automáticamente al salir)."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,187 @@
+"""
+Compactación en segundo plano de los turnos antiguos.
+
+Cuando el historial de una sesión se acerca al presupuesto de tokens, en vez
+de descartar los turnos más antiguos se resumen con un modelo (puede ser uno
+más pequeño) y se sustituyen por un mensaje de resumen acumulado que se envía
+detrás del system prompt (`HistoryWindow.apply_summary`).
+
+El resumen se calcula en un thread aparte después de entregar la respuesta,
+así que su latencia nunca la paga el usuario que espera una contestación; si
+la sesión cambia mientras tanto, el resumen se descarta. Cada resumen pide turno
+en el planificador compartido como una sesión más (`SUMMARY_SESSION`), así que
+bajo carga no ocupa huecos que no se le hayan concedido; si la cola está llena
+se deja para el siguiente turno.
+
+Cada variante resume con su propio transporte: `default_compactor("lib")` usa
+la librería Python y `default_compactor("cli")` el pool de `ollama run`.
+
+Variables de entorno:
+     OLLAMA_COMPACTION: 0 desactiva la compactación (por defecto activada)
+     OLLAMA_SUMMARY_MODEL: modelo usado para resumir (por defecto OLLAMA_MODEL o llama3.2)
+     OLLAMA_COMPACT_THRESHOLD: fracción del presupuesto de tokens que dispara la compactación (0.75)
+     OLLAMA_COMPACT_KEEP: fracción del presupuesto que se conserva literal tras compactar (0.4)
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .residency import default_residency
+from .router import default_router
+from .scheduler import QueueFull, Scheduler, default_scheduler
+from .window import HistoryWindow
+
+COMPACTION_ENABLED = os.environ.get("OLLAMA_COMPACTION", "1") != "0"
+SUMMARY_MODEL = os.environ.get("OLLAMA_SUMMARY_MODEL") or os.environ.get("OLLAMA_MODEL", "llama3.2")
+COMPACT_THRESHOLD = float(os.environ.get("OLLAMA_COMPACT_THRESHOLD", "0.75"))
+COMPACT_KEEP = float(os.environ.get("OLLAMA_COMPACT_KEEP", "0.4"))
+
+SUMMARY_INSTRUCTIONS = (
+    "Resume de forma concisa la conversación que se te pasa. Conserva los datos, "
+    "nombres, decisiones y preguntas pendientes que puedan hacer falta para "
+    "continuarla. Responde solo con el resumen."
+)
+
+# Sesión con la que los resúmenes piden turno en el planificador
+SUMMARY_SESSION = "__compaction__"
+
+Summarizer = Callable[[Optional[str], List[Dict[str, str]]], str]
+
+
+def _summary_request(previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous:
+        return f"Resumen previo:\n{previous}\n\nTurnos nuevos:\n{transcript}"
+    return transcript
+
+
+def summarize_with_cli(previous: Optional[str], messages: List[Dict[str, str]], model: str = SUMMARY_MODEL) -> str:
+    """Resume `messages` (y el resumen previo) con `ollama run`, a través del pool de `cli_pool`."""
+    from .cli_pool import run_prompt
+
+    return run_prompt(f"{SUMMARY_INSTRUCTIONS}\n\n{_summary_request(previous, messages)}", model, timeout=120)
+
+
+def summarize_with_ollama(previous: Optional[str], messages: List[Dict[str, str]], model: str = SUMMARY_MODEL) -> str:
+    """Resume `messages` (y el resumen previo) con la librería Python de Ollama.
+
+    Si la librería no está instalada, recurre a la CLI (`summarize_with_cli`).
+    """
+    try:
+        import ollama  # noqa: F401
+    except ImportError:
+        return summarize_with_cli(previous, messages, model)
+
+    request = _summary_request(previous, messages)
+
+    resp = default_router().call(
+        model,
+        lambda backend: backend.client().chat(
+            model=model,
+            keep_alive=default_residency().keep_alive(model),
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": request},
+            ],
+        ),
+    )
+    if isinstance(resp, dict):
+        return resp.get("message", {}).get("content", "").strip()
+    return resp.message.content.strip()
+
+
+class Compactor:
+    """Programa resúmenes de los turnos antiguos de `HistoryWindow` en segundo plano.
+
+    Hay como mucho una compactación en curso por ventana (`window.compacting`;
+    mientras dura, `Conversation` no recorta por turnos). Las peticiones de
+    todas las sesiones comparten un único thread de trabajo, que pide turno en
+    `scheduler` (por defecto el compartido) antes de cada resumen.
+    """
+
+    def __init__(
+        self,
+        summarize: Optional[Summarizer] = None,
+        threshold: float = COMPACT_THRESHOLD,
+        keep: float = COMPACT_KEEP,
+        enabled: bool = COMPACTION_ENABLED,
+        scheduler: Optional[Scheduler] = None,
+    ):
+        self.summarize = summarize or summarize_with_ollama
+        self.scheduler = scheduler
+        self.threshold = threshold
+        self.keep = keep
+        self.enabled = enabled
+        self.compactions = 0
+        self.failures = 0
+        # Resúmenes aplazados porque la cola del planificador estaba llena
+        self.skipped = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-compaction")
+        self._lock = threading.Lock()
+
+    def maybe_compact(
+        self,
+        window: HistoryWindow,
+        on_applied: Optional[Callable[[HistoryWindow, List[Dict[str, str]]], None]] = None,
+    ) -> Optional[Future]:
+        """Si la ventana está cerca del límite, programa el resumen de sus turnos más antiguos.
+
+        Devuelve el `Future` del trabajo o None si no hace falta compactar.
+        `on_applied(window, removed)` se llama tras sustituir los mensajes.
+        """
+        if not self.enabled or not window.needs_compaction(self.threshold):
+            return None
+        with self._lock:
+            if window.compacting:
+                return None
+            window.compacting = True
+
+        compacted = window.oldest(int(window.budget * self.keep))
+        if not compacted:
+            window.compacting = False
+            return None
+        return self._executor.submit(self._run, window, compacted, window.summary, on_applied)
+
+    def _run(self, window, compacted, previous, on_applied) -> None:
+        applied = False
+        try:
+            with (self.scheduler or default_scheduler()).enqueue(SUMMARY_SESSION) as ticket:
+                ticket.wait()
+                summary = self.summarize(previous, compacted)
+            if not summary:
+                return
+            removed = window.apply_summary(compacted, summary)
+            if removed is not None:
+                applied = True
+                self.compactions += 1
+                if on_applied is not None:
+                    on_applied(window, removed)
+        except QueueFull:
+            # Servidor ocupado: no es un error, se vuelve a intentar tras la próxima respuesta
+            self.skipped += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"Error al compactar el historial: {e}")
+        finally:
+            with window.lock:
+                window.compacting = False
+                if applied:
+                    # Los turnos que llegaron mientras se resumía se resumen a
+                    # continuación, antes de que un mensaje nuevo tenga que recortarlos
+                    self.maybe_compact(window, on_applied)
+
+
+_SUMMARIZERS: Dict[str, Summarizer] = {"lib": summarize_with_ollama, "cli": summarize_with_cli}
+_DEFAULT_COMPACTORS: Dict[str, Compactor] = {}
+_DEFAULT_COMPACTORS_LOCK = threading.Lock()
+
+
+def default_compactor(transport: str = "lib") -> Compactor:
+    """Compactador compartido por todas las sesiones del proceso que usan `transport` ("lib" o "cli")."""
+    with _DEFAULT_COMPACTORS_LOCK:
+        compactor = _DEFAULT_COMPACTORS.get(transport)
+        if compactor is None:
+            compactor = _DEFAULT_COMPACTORS[transport] = Compactor(_SUMMARIZERS[transport])
+        return compactor
@@ -0,0 +1,218 @@
+"""
+Plazos de las llamadas en streaming y detección de bloqueos.
+
+Un backend atascado (cargando un modelo que no cabe, con el runner colgado...)
+puede dejar un stream abierto sin producir nada y ocupar para siempre un
+worker de la UI. Cada stream contra un backend tiene tres plazos:
+
+ - TTFT: tiempo máximo hasta el primer fragmento.
+ - Hueco entre fragmentos: tiempo máximo sin recibir nada una vez empezada la
+   respuesta (detecta el backend que se queda a medias).
+ - Total: duración máxima de la respuesta completa.
+
+Al vencer uno se lanza `DeadlineExceeded` y se cierra el stream; el router
+(`ollama_backend.router`) marca además el servidor como no sano si venció el
+TTFT o el hueco entre fragmentos. Los llamadores conservan el texto recibido
+hasta ese momento y muestran el error a continuación.
+
+Variables de entorno (segundos; 0 desactiva el plazo):
+     OLLAMA_TTFT_TIMEOUT: hasta el primer fragmento (por defecto 120)
+     OLLAMA_STALL_TIMEOUT: máximo entre dos fragmentos (por defecto 30)
+     OLLAMA_TOTAL_TIMEOUT: duración total de la respuesta (por defecto 600)
+"""
+
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Tuple, TypeVar
+
+from .cancellation import Cancelled, on_cancel
+
+TTFT_TIMEOUT = float(os.environ.get("OLLAMA_TTFT_TIMEOUT", "120"))
+STALL_TIMEOUT = float(os.environ.get("OLLAMA_STALL_TIMEOUT", "30"))
+TOTAL_TIMEOUT = float(os.environ.get("OLLAMA_TOTAL_TIMEOUT", "600"))
+
+T = TypeVar("T")
+
+_DONE = object()
+
+_MESSAGES = {
+    "ttft": "Ollama no empezó a responder en {:g} s.",
+    "stall": "Ollama dejó de responder durante {:g} s.",
+    "total": "La respuesta de Ollama superó el tiempo máximo de {:g} s.",
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Venció uno de los plazos del stream (`kind`: "ttft", "stall" o "total")."""
+
+    def __init__(self, kind: str, seconds: float):
+        super().__init__(_MESSAGES[kind].format(seconds))
+        self.kind = kind
+        self.seconds = seconds
+
+
+class Deadlines:
+    """Plazos de un stream; `None` o 0 desactiva cada uno."""
+
+    def __init__(
+        self,
+        ttft: Optional[float] = TTFT_TIMEOUT,
+        stall: Optional[float] = STALL_TIMEOUT,
+        total: Optional[float] = TOTAL_TIMEOUT,
+    ):
+        self.ttft = ttft or None
+        self.stall = stall or None
+        self.total = total or None
+
+    @property
+    def enabled(self) -> bool:
+        return any((self.ttft, self.stall, self.total))
+
+    def transport_timeout(self) -> Optional[float]:
+        """Timeout de lectura para el cliente HTTP: ninguna lectura espera más que esto."""
+        limits = [t for t in (self.ttft, self.stall) if t]
+        return max(limits) if limits else self.total
+
+    def clock(self, total: Optional[float] = None) -> "Clock":
+        """Reloj de un stream; `total` acota además el plazo total."""
+        if total and (self.total is None or total < self.total):
+            return Clock(Deadlines(self.ttft, self.stall, total))
+        return Clock(self)
+
+
+class Clock:
+    """Sigue un stream en curso y dice cuánto queda hasta el plazo más próximo."""
+
+    def __init__(self, deadlines: Deadlines):
+        self.deadlines = deadlines
+        self.started = time.monotonic()
+        self.last: Optional[float] = None
+
+    def tick(self) -> None:
+        """Anota la llegada de un fragmento."""
+        self.last = time.monotonic()
+
+    def next_deadline(self) -> Tuple[Optional[float], Optional[str]]:
+        """(instante monotónico, tipo) del plazo más próximo, o (None, None)."""
+        d = self.deadlines
+        limits = []
+        if d.total:
+            limits.append((self.started + d.total, "total"))
+        if self.last is None and d.ttft:
+            limits.append((self.started + d.ttft, "ttft"))
+        if self.last is not None and d.stall:
+            limits.append((self.last + d.stall, "stall"))
+        if not limits:
+            return None, None
+        return min(limits)
+
+    def remaining(self) -> Tuple[Optional[float], Optional[str]]:
+        at, kind = self.next_deadline()
+        if at is None:
+            return None, None
+        return max(0.0, at - time.monotonic()), kind
+
+    def exceeded(self, kind: str) -> DeadlineExceeded:
+        return DeadlineExceeded(kind, getattr(self.deadlines, kind))
+
+
+def enforce(stream: Iterable[T], deadlines: Deadlines) -> Iterator[T]:
+    """Reproduce `stream` lanzando `DeadlineExceeded` si vence algún plazo.
+
+    El stream se lee en un thread propio para poder vencer plazos aunque la
+    lectura esté bloqueada; ese thread cierra el stream en cuanto recibe algo
+    o su transporte expira (ver `Deadlines.transport_timeout`). Si se cancela
+    la generación (`ollama_backend.cancellation`) se deja de esperar en el acto
+    y se lanza `Cancelled`.
+    """
+    if not deadlines.enabled:
+        yield from stream
+        return
+
+    items: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+
+    def _pump():
+        iterator = iter(())
+        try:
+            iterator = iter(stream)
+            for item in iterator:
+                if stop.is_set():
+                    break
+                items.put((item, None))
+        except BaseException as e:
+            items.put((_DONE, e))
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        items.put((_DONE, None))
+
+    # El thread hereda la generación activa: lo que registre el backend se cancela con ella
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(_pump,), name="ollama-deadline", daemon=True).start()
+    remove = on_cancel(lambda: items.put((_DONE, Cancelled("Generación cancelada."))))
+    clock = deadlines.clock()
+    try:
+        while True:
+            timeout, kind = clock.remaining()
+            try:
+                item, error = items.get(timeout=timeout)
+            except queue.Empty:
+                raise clock.exceeded(kind) from None
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            clock.tick()
+            yield item
+    finally:
+        remove()
+        stop.set()
+
+
+class _StreamTimeout(Exception):
+    """Envuelve un TimeoutError del propio stream para no confundirlo con un plazo."""
+
+
+async def _anext(iterator: AsyncIterator[T]) -> T:
+    try:
+        return await iterator.__anext__()
+    except asyncio.TimeoutError as e:
+        raise _StreamTimeout() from e
+
+
+async def aenforce(stream: AsyncIterable[T], deadlines: Deadlines) -> AsyncIterator[T]:
+    """Versión asíncrona de `enforce`: la lectura pendiente se cancela al vencer el plazo."""
+    if not deadlines.enabled:
+        async for item in stream:
+            yield item
+        return
+
+    iterator = stream.__aiter__()
+    clock = deadlines.clock()
+    try:
+        while True:
+            timeout, kind = clock.remaining()
+            try:
+                item = await asyncio.wait_for(_anext(iterator), timeout)
+            except StopAsyncIteration:
+                return
+            except _StreamTimeout as e:
+                raise e.__cause__ from None
+            except asyncio.TimeoutError:
+                raise clock.exceeded(kind) from None
+            clock.tick()
+            yield item
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+DEFAULT_DEADLINES = Deadlines()
@@ -0,0 +1,282 @@
+"""
+Historial de conversación por sesión.
+
+`SessionHistoryStore` guarda una conversación independiente por cada id de
+sesión (p. ej. `cl.context.session.id` en Chainlit), en lugar de una lista
+global compartida por todos los usuarios.
+
+Límites:
+ - Por sesión: número máximo de turnos (user+assistant) y presupuesto de
+   tokens del prompt (ver `ollama_backend.window`); se descartan los turnos
+   más antiguos y el system prompt se mantiene fijo.
+ - Sesiones inactivas más de `idle_ttl` segundos se eliminan.
+ - Memoria global: si la suma de caracteres de todas las sesiones supera
+   `max_total_chars`, se eliminan las sesiones usadas hace más tiempo.
+
+Con un `Compactor` (ver `ollama_backend.compaction`), después de cada
+respuesta los turnos antiguos se resumen en segundo plano en lugar de
+perderse al recortar.
+
+`TranscriptStore` guarda en cambio la conversación visible completa de cada
+sesión (lo que pinta el chat), para que la UI no tenga que reenviarla en cada
+mensaje; tiene la misma expiración y su propio límite de memoria.
+
+Variables de entorno (valores por defecto del store):
+     OLLAMA_HISTORY_TURNS: turnos por sesión
+     OLLAMA_PROMPT_TOKEN_BUDGET: tokens del prompt por sesión (system + historial)
+     OLLAMA_SESSION_IDLE_TTL: segundos de inactividad antes de eliminar una sesión
+     OLLAMA_HISTORY_MAX_CHARS: caracteres totales entre todas las sesiones
+     OLLAMA_TRANSCRIPT_MAX_CHARS: caracteres totales de las conversaciones visibles
+"""
+
+import abc
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .compaction import Compactor
+from .window import PROMPT_TOKEN_BUDGET, HistoryWindow
+
+DEFAULT_MAX_TURNS = int(os.environ.get("OLLAMA_HISTORY_TURNS", "10"))
+DEFAULT_IDLE_TTL = float(os.environ.get("OLLAMA_SESSION_IDLE_TTL", "3600"))
+DEFAULT_MAX_TOTAL_CHARS = int(os.environ.get("OLLAMA_HISTORY_MAX_CHARS", "50000000"))
+DEFAULT_TRANSCRIPT_MAX_CHARS = int(os.environ.get("OLLAMA_TRANSCRIPT_MAX_CHARS", "200000000"))
+
+
+class Conversation(HistoryWindow):
+    """Ventana de historial de una sesión, acotada además por número de turnos."""
+
+    def __init__(self, max_turns: int, token_budget: int, system_prompt: Optional[str] = None):
+        super().__init__(budget=token_budget, system_prompt=system_prompt)
+        self.max_turns = max_turns
+        self.last_access = time.monotonic()
+        # Caracteres ya contabilizados en el total del store
+        self.counted_chars = 0
+        # Estado del backend asociado a la sesión (p. ej. `context` de Ollama)
+        self.state: Dict[str, Any] = {}
+
+    @property
+    def chars(self) -> int:
+        with self.lock:
+            return sum(len(m["content"]) for m in self.messages())
+
+    def add(self, role: str, content: str) -> None:
+        """Añade un mensaje y recorta por presupuesto de tokens y por turnos."""
+        with self.lock:
+            self.append(role, content)
+            if self.compacting:
+                # Recortar ahora cambiaría el principio de la ventana y el resumen en
+                # curso se descartaría: esos turnos se perderían en vez de resumirse
+                return
+            # Siempre se conserva al menos el último mensaje
+            dropped = 0
+            while len(self) > max(1, self.max_turns * 2):
+                self.pop_oldest()
+                dropped += 1
+            # Como en `HistoryWindow._trim`: sin respuesta huérfana del assistant al principio
+            while dropped and len(self) > 1 and self._entries[0][0]["role"] == "assistant":
+                self.pop_oldest()
+
+    def needs_compaction(self, threshold: float) -> bool:
+        # También por turnos, con el mismo umbral: el resumen empieza antes de que
+        # haga falta recortar
+        return super().needs_compaction(threshold) or (len(self) > 2 and len(self) >= threshold * self.max_turns * 2)
+
+    def oldest(self, keep_tokens: int, keep_messages: int = 2) -> List[Dict[str, str]]:
+        compacted = super().oldest(keep_tokens, keep_messages)
+        if len(self) - len(compacted) > self.max_turns:
+            # Con límite de turnos se conserva literal como mucho la mitad, en turnos completos
+            compacted = super().oldest(0, keep_messages=2 * max(1, self.max_turns // 2))
+        return compacted
+
+
+class Transcript:
+    """Conversación visible de una sesión: mensajes (role, content) completos, sin recortar."""
+
+    __slots__ = ("entries", "last_access", "counted_chars")
+
+    def __init__(self):
+        self.entries: List[Tuple[str, str]] = []
+        self.last_access = time.monotonic()
+        self.counted_chars = 0
+
+
+class _SessionStore(abc.ABC):
+    """Sesiones ordenadas por uso, con expiración por inactividad y límite global de caracteres."""
+
+    def __init__(self, idle_ttl: float, max_total_chars: int):
+        self.idle_ttl = idle_ttl
+        self.max_total_chars = max_total_chars
+        self.total_chars = 0
+        # Ordenado de menos a más recientemente usado
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @abc.abstractmethod
+    def _new(self) -> Any:
+        """Sesión vacía (con `last_access` y `counted_chars`)."""
+
+    def _get(self, session_id: str) -> Any:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = self._new()
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_access = time.monotonic()
+        return session
+
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.total_chars -= session.counted_chars
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        now = time.monotonic()
+        # Sesiones inactivas (las más antiguas están al principio)
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_access <= self.idle_ttl:
+                break
+            if session_id != keep:
+                self._drop(session_id)
+        # Límite global de memoria: eliminar las menos usadas recientemente
+        for session_id in list(self._sessions):
+            if self.total_chars <= self.max_total_chars:
+                break
+            if session_id != keep:
+                self._drop(session_id)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+
+
+class SessionHistoryStore(_SessionStore):
+    """Historiales independientes por sesión con expiración y límite global de memoria."""
+
+    def __init__(
+        self,
+        max_turns: int = DEFAULT_MAX_TURNS,
+        token_budget: int = PROMPT_TOKEN_BUDGET,
+        system_prompt: Optional[str] = None,
+        idle_ttl: float = DEFAULT_IDLE_TTL,
+        max_total_chars: int = DEFAULT_MAX_TOTAL_CHARS,
+        compactor: Optional[Compactor] = None,
+    ):
+        super().__init__(idle_ttl, max_total_chars)
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.system_prompt = system_prompt
+        self.compactor = compactor
+
+    def _new(self) -> Conversation:
+        return Conversation(self.max_turns, self.token_budget, self.system_prompt)
+
+    def _recount(self, session_id: str, conv: Conversation) -> None:
+        with self._lock:
+            if self._sessions.get(session_id) is not conv:
+                return
+            chars = conv.chars
+            self.total_chars += chars - conv.counted_chars
+            conv.counted_chars = chars
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        with self._lock:
+            conv = self._get(session_id)
+            conv.add(role, content)
+            self._recount(session_id, conv)
+            self._evict(keep=session_id)
+
+        # Tras cada respuesta, resumir en segundo plano los turnos antiguos si hace falta
+        if self.compactor is not None and role == "assistant":
+            self.compactor.maybe_compact(conv, on_applied=lambda c, _removed: self._recount(session_id, c))
+
+    def messages(self, session_id: str) -> List[Dict[str, str]]:
+        """Mensajes a enviar al modelo: system prompt (si hay) + ventana de historial."""
+        with self._lock:
+            if session_id not in self._sessions:
+                return [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+            return self._get(session_id).messages()
+
+    def history(self, session_id: str) -> List[Dict[str, str]]:
+        """Mensajes de la ventana de historial, sin el system prompt."""
+        with self._lock:
+            if session_id not in self._sessions:
+                return []
+            return self._get(session_id).history()
+
+    def state(self, session_id: str) -> Dict[str, Any]:
+        """Dict de estado de la sesión; se libera junto con su historial."""
+        with self._lock:
+            return self._get(session_id).state
+
+
+class TranscriptStore(_SessionStore):
+    """Conversación visible completa de cada sesión, guardada en el servidor.
+
+    Es la copia de referencia de lo que muestra el chat: la UI envía solo el
+    mensaje nuevo y pinta lo que devuelve `messages()`. Los mensajes se guardan
+    como tuplas (role, content) y el último se puede ir actualizando mientras
+    llega la respuesta en streaming.
+    """
+
+    def __init__(self, idle_ttl: float = DEFAULT_IDLE_TTL, max_total_chars: int = DEFAULT_TRANSCRIPT_MAX_CHARS):
+        super().__init__(idle_ttl, max_total_chars)
+
+    def _new(self) -> Transcript:
+        return Transcript()
+
+    def _set(self, transcript: Transcript, index: int, role: str, content: str) -> None:
+        if index < len(transcript.entries):
+            delta = len(content) - len(transcript.entries[index][1])
+            transcript.entries[index] = (role, content)
+        else:
+            delta = len(content)
+            transcript.entries.append((role, content))
+        transcript.counted_chars += delta
+        self.total_chars += delta
+
+    def append(self, session_id: str, role: str, content: str) -> int:
+        """Añade un mensaje y devuelve su posición (para `update`)."""
+        with self._lock:
+            transcript = self._get(session_id)
+            index = len(transcript.entries)
+            self._set(transcript, index, role, content)
+            self._evict(keep=session_id)
+            return index
+
+    def update(self, session_id: str, index: int, content: str) -> None:
+        """Reemplaza el texto del mensaje `index` (p. ej. la respuesta en curso)."""
+        with self._lock:
+            transcript = self._sessions.get(session_id)
+            # La sesión pudo expirar o limpiarse mientras tanto
+            if transcript is None or index >= len(transcript.entries):
+                return
+            self._sessions.move_to_end(session_id)
+            transcript.last_access = time.monotonic()
+            self._set(transcript, index, transcript.entries[index][0], content)
+            self._evict(keep=session_id)
+
+    def messages(self, session_id: str, start: int = 0, stop: Optional[int] = None) -> List[Tuple[str, str]]:
+        """Copia de los mensajes (role, content) de la sesión, del más antiguo al más reciente.
+
+        `start` / `stop` acotan el tramo como en un slice, para que la UI pida
+        solo el turno en curso o una página del historial sin copiar el resto.
+        """
+        with self._lock:
+            transcript = self._sessions.get(session_id)
+            return transcript.entries[start:stop] if transcript is not None else []
+
+    def turn_start(self, session_id: str) -> int:
+        """Posición del último mensaje del usuario (donde empieza el turno en curso)."""
+        with self._lock:
+            transcript = self._sessions.get(session_id)
+            entries = transcript.entries if transcript is not None else []
+            for index in range(len(entries) - 1, -1, -1):
+                if entries[index][0] == "user":
+                    return index
+            return len(entries)
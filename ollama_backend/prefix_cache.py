@@ -0,0 +1,313 @@
+"""
+Reutilización del prefijo ya evaluado por el modelo entre turnos.
+
+Ollama puede ahorrarse el prefill de todo lo que ya evaluó en el turno
+anterior, siempre que el modelo siga cargado:
+
+ - Con la API de chat, el runner reutiliza la caché KV del prefijo común con
+   la petición anterior. Para aprovecharlo el modelo debe seguir en memoria
+   (`keep_alive`) y el principio de la lista de mensajes no debe cambiar de un
+   turno a otro; por eso `HistoryWindow` recorta por bloques (ver
+   OLLAMA_TRIM_TARGET) en lugar de quitar un turno en cada mensaje.
+ - Con OLLAMA_CONTEXT_REUSE=1 se usa además `/api/generate` con el `context`
+   devuelto en la respuesta anterior: cada turno solo envía el mensaje nuevo
+   del usuario. Si el historial cambia por otra vía (recorte, resumen, otra
+   pestaña...) se vuelve a enviar la conversación completa.
+
+`chat()` y `achat()` sustituyen a `ollama.chat` / `AsyncClient.chat` y
+devuelven respuestas con la misma forma ({'message': {'content': ...}}). Sin
+un cliente explícito, cada petición va al servidor que elige
+`ollama_backend.router` (OLLAMA_HOSTS).
+
+Variables de entorno:
+     OLLAMA_KEEP_ALIVE: tiempo que el modelo sigue cargado tras una petición (p. ej. "30m", "-1m");
+         con OLLAMA_PRELOAD_MODELS u OLLAMA_RAM_BUDGET_GB lo decide `ollama_backend.residency`
+     OLLAMA_CONTEXT_REUSE: 1 para reutilizar el `context` de /api/generate por sesión
+"""
+
+import os
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from .cache import cache_key, default_cache, deterministic
+from .residency import default_residency
+from .router import default_router
+from .singleflight import default_singleflight
+from .streaming import chunk_text
+
+CONTEXT_REUSE = os.environ.get("OLLAMA_CONTEXT_REUSE", "0") == "1"
+
+# Clave con la que se guarda el ContextSession en el estado de cada sesión
+STATE_KEY = "prefix_cache"
+
+
+def _get(obj: Any, key: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+def _turns(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    # Las apps guardan las respuestas recortadas, así que se comparan sin espacios extremos
+    return [{"role": m["role"], "content": m["content"].strip()} for m in messages if m["role"] != "system"]
+
+
+def _render(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+
+
+class ContextSession:
+    """Contexto de /api/generate de una conversación.
+
+    Guarda los tokens de `context` de la última respuesta y los mensajes que
+    representan, para saber si el turno siguiente puede enviarse solo con el
+    mensaje nuevo del usuario.
+    """
+
+    def __init__(self):
+        self.context: Optional[List[int]] = None
+        self.model: Optional[str] = None
+        self.system: Optional[str] = None
+        self.messages: List[Dict[str, str]] = []
+
+    def plan(self, model: str, messages: List[Dict[str, str]]) -> Tuple[str, Optional[str], Optional[List[int]]]:
+        """Devuelve (prompt, system, context) para la petición a /api/generate."""
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system") or None
+        convo = _turns(messages)
+        if (
+            self.context
+            and model == self.model
+            and system == self.system
+            and convo
+            and convo[-1]["role"] == "user"
+            and convo[:-1] == self.messages
+        ):
+            return convo[-1]["content"], system, self.context
+
+        # Primer turno o historial cambiado: se envía la conversación completa
+        self.context = None
+        if len(convo) == 1:
+            return convo[0]["content"], system, None
+        return _render(convo) + "\nassistant:", system, None
+
+    def commit(self, model: str, messages: List[Dict[str, str]], reply: str, context: Optional[List[int]]) -> None:
+        self.model = model
+        self.system = "\n\n".join(m["content"] for m in messages if m["role"] == "system") or None
+        self.messages = _turns(messages + [{"role": "assistant", "content": reply}])
+        self.context = list(context) if context else None
+
+
+def _as_chat_chunk(part: Any) -> Dict[str, Any]:
+    """Adapta una respuesta de generate a la forma de una respuesta de chat."""
+    chunk = {"message": {"role": "assistant", "content": _get(part, "response", "") or ""}, "done": _get(part, "done", False)}
+    for key in ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration", "load_duration", "total_duration"):
+        value = _get(part, key)
+        if value is not None:
+            chunk[key] = value
+    return chunk
+
+
+def _session(state: Optional[Dict[str, Any]], reuse_context: Optional[bool]) -> Optional[ContextSession]:
+    if reuse_context is None:
+        reuse_context = CONTEXT_REUSE
+    if state is None or not reuse_context:
+        return None
+    session = state.get(STATE_KEY)
+    if session is None:
+        session = state[STATE_KEY] = ContextSession()
+    return session
+
+
+def _generate_stream(client, session: ContextSession, model, messages, options) -> Iterator[Dict[str, Any]]:
+    prompt, system, context = session.plan(model, messages)
+    reply = ""
+    for part in client.generate(
+        model=model, prompt=prompt, system=system, context=context, stream=True, keep_alive=default_residency().keep_alive(model), options=options
+    ):
+        chunk = _as_chat_chunk(part)
+        reply += chunk["message"]["content"]
+        if chunk["done"]:
+            session.commit(model, messages, reply, _get(part, "context"))
+        yield chunk
+
+
+def _chat_uncached(client, model, messages, stream, state, options, reuse_context):
+    session = _session(state, reuse_context)
+    if session is None:
+        return client.chat(model=model, messages=messages, stream=stream, keep_alive=default_residency().keep_alive(model), options=options)
+
+    chunks = _generate_stream(client, session, model, messages, options)
+    if stream:
+        return chunks
+    content = ""
+    final: Dict[str, Any] = {}
+    for chunk in chunks:
+        content += chunk["message"]["content"]
+        final = chunk
+    final["message"] = {"role": "assistant", "content": content}
+    return final
+
+
+def _chat_stream(client, model, messages, state, options, reuse_context) -> Iterator[Dict[str, Any]]:
+    if client is not None:
+        return _chat_uncached(client, model, messages, True, state, options, reuse_context)
+    return default_router().stream(
+        model, lambda backend: _chat_uncached(backend.client(), model, messages, True, state, options, reuse_context)
+    )
+
+
+def _chat_once(client, model, messages, state, options, reuse_context):
+    if client is not None:
+        return _chat_uncached(client, model, messages, False, state, options, reuse_context)
+    return default_router().call(
+        model, lambda backend: _chat_uncached(backend.client(), model, messages, False, state, options, reuse_context)
+    )
+
+
+def _cached_chunk(fragment: str) -> Dict[str, Any]:
+    return {"message": {"role": "assistant", "content": fragment}, "done": False}
+
+
+def _cached_response(content: str) -> Dict[str, Any]:
+    return {"message": {"role": "assistant", "content": content}, "done": True}
+
+
+def chat(
+    model: str,
+    messages: List[Dict[str, str]],
+    stream: bool = False,
+    state: Optional[Dict[str, Any]] = None,
+    client: Any = None,
+    options: Optional[Dict[str, Any]] = None,
+    reuse_context: Optional[bool] = None,
+    use_cache: bool = True,
+):
+    """Como `ollama.chat`, con `keep_alive` y reutilización opcional del contexto.
+
+    `state` es un dict por sesión (p. ej. `SessionHistoryStore.state()` o un
+    dict guardado en `st.session_state`); sin él, o sin OLLAMA_CONTEXT_REUSE=1
+    (`reuse_context` lo sustituye), se usa la API de chat normal.
+
+    Las respuestas completas se guardan en la caché compartida
+    (`ollama_backend.cache`) y se reproducen desde ella, también en streaming;
+    `use_cache=False` la ignora. Las peticiones idénticas en curso comparten
+    una sola generación (`ollama_backend.singleflight`). Si `options` pide
+    muestreo (`cache.deterministic`), no se usa ninguna de las dos.
+
+    `client` fija el cliente de Ollama; sin él decide el router.
+    """
+    cache = default_cache()
+    flights = default_singleflight()
+    key = cache_key(model, messages, options)
+    if not deterministic(options):
+        if stream:
+            return _chat_stream(client, model, messages, state, options, reuse_context)
+        return _chat_once(client, model, messages, state, options, reuse_context)
+    if stream:
+        return cache.stream(
+            key,
+            lambda: flights.stream(
+                key + ":stream", lambda: _chat_stream(client, model, messages, state, options, reuse_context)
+            ),
+            text=chunk_text,
+            wrap=_cached_chunk,
+            bypass=not use_cache,
+        )
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return _cached_response(cached)
+    response = flights.call(key, lambda: _chat_once(client, model, messages, state, options, reuse_context))
+    if use_cache:
+        cache.put(key, chunk_text(response))
+    return response
+
+
+async def _agenerate_stream(client, session: ContextSession, model, messages, options) -> AsyncIterator[Dict[str, Any]]:
+    prompt, system, context = session.plan(model, messages)
+    reply = ""
+    async for part in await client.generate(
+        model=model, prompt=prompt, system=system, context=context, stream=True, keep_alive=default_residency().keep_alive(model), options=options
+    ):
+        chunk = _as_chat_chunk(part)
+        reply += chunk["message"]["content"]
+        if chunk["done"]:
+            session.commit(model, messages, reply, _get(part, "context"))
+        yield chunk
+
+
+async def _achat_uncached(client, model, messages, stream, state, options, reuse_context):
+    session = _session(state, reuse_context)
+    if session is None:
+        return await client.chat(model=model, messages=messages, stream=stream, keep_alive=default_residency().keep_alive(model), options=options)
+
+    chunks = _agenerate_stream(client, session, model, messages, options)
+    if stream:
+        return chunks
+    content = ""
+    final: Dict[str, Any] = {}
+    async for chunk in chunks:
+        content += chunk["message"]["content"]
+        final = chunk
+    final["message"] = {"role": "assistant", "content": content}
+    return final
+
+
+async def _achat_stream(client, model, messages, state, options, reuse_context) -> AsyncIterator[Dict[str, Any]]:
+    if client is not None:
+        async for chunk in await _achat_uncached(client, model, messages, True, state, options, reuse_context):
+            yield chunk
+        return
+
+    async def _produce(backend):
+        async for chunk in await _achat_uncached(
+            backend.async_client(), model, messages, True, state, options, reuse_context
+        ):
+            yield chunk
+
+    async for chunk in default_router().astream(model, _produce):
+        yield chunk
+
+
+async def _achat_once(client, model, messages, state, options, reuse_context):
+    if client is not None:
+        return await _achat_uncached(client, model, messages, False, state, options, reuse_context)
+    return await default_router().acall(
+        model,
+        lambda backend: _achat_uncached(backend.async_client(), model, messages, False, state, options, reuse_context),
+    )
+
+
+async def achat(
+    model: str,
+    messages: List[Dict[str, str]],
+    stream: bool = False,
+    state: Optional[Dict[str, Any]] = None,
+    client: Any = None,
+    options: Optional[Dict[str, Any]] = None,
+    reuse_context: Optional[bool] = None,
+    use_cache: bool = True,
+):
+    """Versión asíncrona de `chat()`; `client` es un `ollama.AsyncClient`."""
+    cache = default_cache()
+    flights = default_singleflight()
+    key = cache_key(model, messages, options)
+    if not deterministic(options):
+        if stream:
+            return _achat_stream(client, model, messages, state, options, reuse_context)
+        return await _achat_once(client, model, messages, state, options, reuse_context)
+    if stream:
+        return cache.astream(
+            key,
+            lambda: flights.astream(
+                key + ":stream", lambda: _achat_stream(client, model, messages, state, options, reuse_context)
+            ),
+            text=chunk_text,
+            wrap=_cached_chunk,
+            bypass=not use_cache,
+        )
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return _cached_response(cached)
+    response = await flights.acall(key, lambda: _achat_once(client, model, messages, state, options, reuse_context))
+    if use_cache:
+        cache.put(key, chunk_text(response))
+    return response
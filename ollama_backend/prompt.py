@@ -0,0 +1,56 @@
+"""
+Prompt de texto plano construido de forma incremental.
+
+Las variantes que usan la CLI (`ollama run`) no envían una lista de mensajes
+sino un único texto con una línea "Rol: contenido" por mensaje. Rehacer ese
+texto entero en cada turno cuesta O(conversación) por mensaje.
+
+`PromptBuilder` guarda el texto ya renderizado de la ventana de contexto (ver
+`ollama_backend.window`) y en cada turno solo renderiza los mensajes nuevos.
+Reconoce los mensajes por identidad: mientras la ventana solo crezca por el
+final se reutiliza el prefijo; si se recortan turnos antiguos o se fija un
+resumen, el principio cambia y el texto se rehace una vez.
+
+Se guarda uno por sesión, p. ej. en el estado de la sesión:
+
+    builder = store.state(session_id).setdefault("prompt", PromptBuilder(render))
+    prompt = builder.build(store.messages(session_id))
+"""
+
+import operator
+import threading
+from typing import Callable, Dict, List
+
+
+class PromptBuilder:
+    """Texto del prompt de una sesión, con el prefijo ya renderizado en caché.
+
+    `render_message` convierte un mensaje {'role', 'content'} en su línea; las
+    líneas se unen con `separator` y al final se añade `suffix` (p. ej. la
+    señal "Assistant:" para que responda el modelo).
+    """
+
+    def __init__(self, render_message: Callable[[Dict[str, str]], str], separator: str = "\n", suffix: str = ""):
+        self.render_message = render_message
+        self.separator = separator
+        self.suffix = suffix
+        self.rebuilds = 0
+        self._messages: List[Dict[str, str]] = []
+        self._text = ""
+        self._lock = threading.Lock()
+
+    def build(self, messages: List[Dict[str, str]]) -> str:
+        """Prompt para `messages`; solo se renderizan los que no estaban en la llamada anterior."""
+        with self._lock:
+            cached = len(self._messages)
+            # Comparación por identidad (en C, sin mirar el contenido)
+            if len(messages) < cached or not all(map(operator.is_, messages, self._messages)):
+                self._messages, self._text = [], ""
+                self.rebuilds += 1
+                cached = 0
+            new = messages[cached:]
+            if new:
+                rendered = self.separator.join(self.render_message(m) for m in new)
+                self._text = f"{self._text}{self.separator}{rendered}" if self._text else rendered
+                self._messages.extend(new)
+            return self._text + self.suffix
@@ -0,0 +1,272 @@
+"""
+Modelos residentes: precarga, `keep_alive` y presupuesto de memoria.
+
+Las interfaces dejan elegir el modelo libremente y la primera petición tras
+un cambio paga la carga en frío (varios segundos), o expulsa un modelo que
+otros usuarios estaban usando. El gestor hace esas cargas previsibles:
+
+ - Al arrancar la app (`start()`) carga en cada servidor los modelos de
+   OLLAMA_PRELOAD_MODELS, que quedan fijados (`keep_alive` infinito) y nunca
+   se descargan.
+ - `warm(model)` carga un modelo en segundo plano, por ejemplo en cuanto el
+   usuario lo escribe en la caja de modelo, antes de enviar el mensaje.
+ - Consulta `/api/ps` cada OLLAMA_RESIDENCY_INTERVAL segundos para saber qué
+   hay cargado en cada servidor y cuánto ocupa.
+ - Con OLLAMA_RAM_BUDGET_GB, los modelos cargados se fijan también y es el
+   gestor quien los descarga: antes de cargar uno nuevo descarga los usados
+   hace más tiempo (LRU) hasta que quepa, sin tocar los que tienen peticiones
+   en curso. El tamaño de un modelo aún no cargado se estima con `/api/tags`.
+ - Sin presupuesto, cada petición usa OLLAMA_KEEP_ALIVE como hasta ahora.
+
+El router (`ollama_backend.router`) avisa al gestor de cada petición para
+llevar el orden de uso; `stats()` expone los tiempos de carga por modelo.
+
+Variables de entorno:
+     OLLAMA_KEEP_ALIVE: tiempo que el modelo sigue cargado tras una petición (p. ej. "30m", "-1m")
+     OLLAMA_PRELOAD_MODELS: modelos a cargar y fijar al arrancar, separados por comas
+     OLLAMA_RAM_BUDGET_GB: memoria máxima para modelos por servidor (0 = sin límite)
+     OLLAMA_RESIDENCY_INTERVAL: segundos entre consultas a `/api/ps` (por defecto 30)
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .deadlines import DEFAULT_DEADLINES
+from .router import Backend, Router, default_router
+
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE") or None
+PRELOAD_MODELS = [m.strip() for m in os.environ.get("OLLAMA_PRELOAD_MODELS", "").split(",") if m.strip()]
+RAM_BUDGET_GB = float(os.environ.get("OLLAMA_RAM_BUDGET_GB", "0"))
+RESIDENCY_INTERVAL = float(os.environ.get("OLLAMA_RESIDENCY_INTERVAL", "30"))
+
+# Duración negativa: Ollama mantiene el modelo cargado indefinidamente
+PINNED_KEEP_ALIVE = "-1m"
+
+
+def _canonical(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+
+def _post(url: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8") or "{}")
+
+
+class ResidencyManager:
+    """Qué modelos siguen cargados en cada servidor y cuándo descargarlos."""
+
+    def __init__(
+        self,
+        router: Router,
+        preload: Iterable[str] = (),
+        budget_gb: float = RAM_BUDGET_GB,
+        interval: float = RESIDENCY_INTERVAL,
+        load_timeout: Optional[float] = None,
+    ):
+        self.router = router
+        self.pinned = {_canonical(m) for m in preload}
+        self.preload = list(preload)
+        self.budget = int(budget_gb * 1024**3)
+        self.interval = interval
+        self.load_timeout = load_timeout or DEFAULT_DEADLINES.ttft or 300
+        self.cold_starts = 0
+        self.unloads = 0
+        # (url del servidor, modelo) -> último uso / peticiones en curso
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._active: Dict[Tuple[str, str], int] = {}
+        # Tamaño de cada modelo: en memoria si ya se vio cargado, si no en disco
+        self._sizes: Dict[str, int] = {}
+        self._load_times: Dict[str, List[float]] = {}
+        self._loading: Dict[Tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+        self._room_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def keep_alive(self, model: str) -> Optional[str]:
+        """`keep_alive` para una petición a `model`."""
+        if self.budget or _canonical(model) in self.pinned:
+            return PINNED_KEEP_ALIVE
+        return KEEP_ALIVE
+
+    def start(self) -> None:
+        """Precarga los modelos configurados y empieza a seguir `/api/ps` (idempotente)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="ollama-residency", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        self.refresh()
+        for model in self.preload:
+            for backend in self.router.backends:
+                self._load(backend, model)
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def refresh(self) -> None:
+        """Actualiza desde `/api/ps` los modelos cargados en cada servidor."""
+        for backend in list(self.router.backends):
+            if backend.check():
+                with self._lock:
+                    self._sizes.update({name: size for name, size in backend.loaded.items() if size})
+
+    def touch(self, backend: Backend, model: str) -> None:
+        """El router eligió `backend` para una petición a `model`."""
+        key = (backend.url, _canonical(model))
+        with self._lock:
+            self._last_used[key] = time.monotonic()
+            self._active[key] = self._active.get(key, 0) + 1
+            cold = key[1] not in backend.loaded and model not in backend.models
+            if cold:
+                self.cold_starts += 1
+        if cold and self.budget:
+            # Se hace sitio mientras Ollama carga el modelo, sin retrasar la petición
+            threading.Thread(target=self._make_room, args=(backend, model), daemon=True).start()
+
+    def release(self, backend: Backend, model: str) -> None:
+        key = (backend.url, _canonical(model))
+        with self._lock:
+            if self._active.get(key, 0) > 1:
+                self._active[key] -= 1
+            else:
+                self._active.pop(key, None)
+
+    def warm(self, model: str) -> None:
+        """Carga `model` en segundo plano en el servidor que lo atenderá."""
+        model = (model or "").strip()
+        if not model:
+            return
+        backends = [b for b in self.router.backends if b.healthy] or self.router.backends
+        if any(_canonical(model) in b.loaded or model in b.models for b in backends):
+            return
+        backend = min(backends, key=lambda b: b.outstanding)
+        threading.Thread(target=self._load, args=(backend, model), daemon=True).start()
+
+    def _load(self, backend: Backend, model: str) -> Optional[float]:
+        """Carga `model` en `backend` y devuelve lo que tardó (segundos)."""
+        key = (backend.url, _canonical(model))
+        with self._lock:
+            loading = self._loading.get(key)
+            if loading is None:
+                self._loading[key] = threading.Event()
+        if loading is not None:
+            # Ya lo está cargando otro thread
+            loading.wait(self.load_timeout)
+            return None
+        try:
+            self._make_room(backend, model)
+            start = time.monotonic()
+            # Sin prompt, /api/generate solo carga el modelo
+            data = _post(
+                f"{backend.url}/api/generate",
+                {"model": model, "keep_alive": self.keep_alive(model) or "5m"},
+                timeout=self.load_timeout,
+            )
+            elapsed = (data.get("load_duration") or 0) / 1e9 or time.monotonic() - start
+        except Exception as e:
+            print(f"No se pudo precargar {model} en {backend.url}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+        with self._lock:
+            self._load_times.setdefault(key[1], []).append(elapsed)
+            self._last_used.setdefault(key, time.monotonic())
+        backend.check()
+        return elapsed
+
+    def _unload(self, backend: Backend, model: str) -> bool:
+        try:
+            _post(f"{backend.url}/api/generate", {"model": model, "keep_alive": 0}, timeout=30)
+        except Exception as e:
+            print(f"No se pudo descargar {model} de {backend.url}: {e}")
+            return False
+        with self._lock:
+            self.unloads += 1
+            backend.loaded.pop(model, None)
+            backend.models.discard(model)
+        return True
+
+    def _size(self, backend: Backend, model: str) -> int:
+        name = _canonical(model)
+        with self._lock:
+            if name in self._sizes:
+                return self._sizes[name]
+        try:
+            with urllib.request.urlopen(f"{backend.url}/api/tags", timeout=5) as resp:
+                data = json.loads(resp.read().decode("utf-8") or "{}")
+        except Exception:
+            return 0
+        with self._lock:
+            for m in data.get("models") or []:
+                tag = m.get("name") or m.get("model")
+                if tag and m.get("size"):
+                    self._sizes.setdefault(tag, int(m["size"]))
+            return self._sizes.get(name, 0)
+
+    def _make_room(self, backend: Backend, model: str) -> None:
+        """Descarga modelos LRU de `backend` hasta que `model` quepa en el presupuesto."""
+        if not self.budget:
+            return
+        name = _canonical(model)
+        needed = self._size(backend, model)
+        with self._room_lock:
+            with self._lock:
+                loaded = {m: size for m, size in backend.loaded.items() if m != name}
+                victims = sorted(
+                    (
+                        m
+                        for m in loaded
+                        if m not in self.pinned and not self._active.get((backend.url, m))
+                    ),
+                    key=lambda m: self._last_used.get((backend.url, m), 0.0),
+                )
+            used = sum(loaded.values()) + needed
+            while used > self.budget and victims:
+                victim = victims.pop(0)
+                if self._unload(backend, victim):
+                    used -= loaded[victim]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            load_times = {
+                model: {"loads": len(times), "last": round(times[-1], 3), "mean": round(sum(times) / len(times), 3)}
+                for model, times in self._load_times.items()
+            }
+            return {
+                "budget_gb": self.budget / 1024**3 if self.budget else None,
+                "pinned": sorted(self.pinned),
+                "cold_starts": self.cold_starts,
+                "unloads": self.unloads,
+                "load_times": load_times,
+                "loaded": {
+                    b.url: {m: round(size / 1024**3, 2) for m, size in b.loaded.items()} for b in self.router.backends
+                },
+            }
+
+
+_DEFAULT_RESIDENCY: Optional[ResidencyManager] = None
+_DEFAULT_RESIDENCY_LOCK = threading.Lock()
+
+
+def default_residency() -> ResidencyManager:
+    """Gestor compartido, enganchado al router por defecto; `start()` lo pone en marcha."""
+    global _DEFAULT_RESIDENCY
+    with _DEFAULT_RESIDENCY_LOCK:
+        if _DEFAULT_RESIDENCY is None:
+            router = default_router()
+            _DEFAULT_RESIDENCY = ResidencyManager(router, preload=PRELOAD_MODELS)
+            router.residency = _DEFAULT_RESIDENCY
+        return _DEFAULT_RESIDENCY
@@ -0,0 +1,665 @@
+"""
+Reparto de peticiones entre varios servidores Ollama.
+
+Con OLLAMA_HOSTS (lista separada por comas) las variantes dejan de depender
+de un único Ollama local:
+
+ - Cada petición va al servidor con menos peticiones en curso, dando
+   preferencia a los que ya tienen el modelo cargado (afinidad por modelo,
+   para no pagar la carga del modelo en otro servidor).
+ - Un thread comprueba periódicamente cada servidor (`/api/ps`, que además
+   dice qué modelos tiene cargados). Un servidor que falla se expulsa del
+   reparto hasta que vuelve a responder.
+ - Si la conexión falla antes de recibir nada de la respuesta, la petición se
+   reintenta en otro servidor (es seguro: aún no se ha generado nada).
+ - Cada stream contra un servidor tiene plazos de primer fragmento, hueco
+   entre fragmentos y duración total (`ollama_backend.deadlines`). Un
+   servidor que no empieza a responder o se queda a medias se marca como no
+   sano hasta la siguiente comprobación de salud.
+ - Con OLLAMA_HEDGE=1, si el primer fragmento tarda más que el percentil
+   OLLAMA_HEDGE_PERCENTILE del TTFT reciente (un servidor cargando el modelo o
+   con un prefill largo), se envía la misma petición a otro servidor. Se usa
+   la que empiece a responder antes y la otra se cancela al momento: cada
+   petición de la carrera lee con su propio `CancelToken`, así que cancelarlo
+   cierra su conexión (o su tarea asíncrona) sin esperar al siguiente fragmento.
+
+Cada servidor tiene un único cliente HTTP por proceso (`Backend.client()`,
+y uno asíncrono por bucle de eventos) que todas las sesiones comparten: las
+conexiones se reutilizan con keep-alive en lugar de abrirse en cada
+petición. El pool de conexiones y los timeouts se configuran con las
+variables OLLAMA_HTTP_*.
+
+Sin OLLAMA_HOSTS hay un único backend con la configuración por defecto de
+Ollama (OLLAMA_HOST o localhost), igual que antes.
+
+Variables de entorno:
+     OLLAMA_HOSTS: servidores, p. ej. "127.0.0.1:11434,127.0.0.1:11435"
+     OLLAMA_HEALTH_INTERVAL: segundos entre comprobaciones de salud (por defecto 10)
+     OLLAMA_ROUTER_RETRIES: reintentos en otro servidor si falla la conexión (por defecto 2)
+     OLLAMA_HEDGE: 1 para activar las peticiones de cobertura (hedging)
+     OLLAMA_HEDGE_PERCENTILE: percentil del TTFT reciente usado como retardo (por defecto 95)
+     OLLAMA_HEDGE_DELAY: retardo en segundos mientras no hay muestras suficientes (por defecto 2)
+     OLLAMA_HEDGE_MIN_DELAY: retardo mínimo en segundos (por defecto 0.25)
+     OLLAMA_HTTP_MAX_CONNECTIONS: conexiones máximas por servidor (por defecto 100)
+     OLLAMA_HTTP_MAX_KEEPALIVE: conexiones ociosas que se conservan por servidor (por defecto 20)
+     OLLAMA_HTTP_KEEPALIVE_EXPIRY: segundos que se conserva una conexión ociosa (por defecto 300)
+     OLLAMA_HTTP_CONNECT_TIMEOUT: timeout de conexión en segundos (por defecto 5)
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.request
+import weakref
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+from .cancellation import CancelToken, is_cancelled, on_cancel
+from .deadlines import DEFAULT_DEADLINES, DeadlineExceeded, Deadlines, aenforce, enforce
+
+HOSTS = [h.strip() for h in os.environ.get("OLLAMA_HOSTS", "").split(",") if h.strip()]
+HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10"))
+ROUTER_RETRIES = int(os.environ.get("OLLAMA_ROUTER_RETRIES", "2"))
+HEDGE_ENABLED = os.environ.get("OLLAMA_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("OLLAMA_HEDGE_PERCENTILE", "95"))
+HEDGE_DELAY = float(os.environ.get("OLLAMA_HEDGE_DELAY", "2"))
+HEDGE_MIN_DELAY = float(os.environ.get("OLLAMA_HEDGE_MIN_DELAY", "0.25"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("OLLAMA_HTTP_MAX_KEEPALIVE", "20"))
+# httpx cierra por defecto las conexiones ociosas a los 5 s, menos de lo que se
+# tarda en escribir el siguiente mensaje
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_HTTP_KEEPALIVE_EXPIRY", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_HTTP_CONNECT_TIMEOUT", "5"))
+
+# Muestras de TTFT que se conservan y mínimo para fiarse del percentil
+HEDGE_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+
+DEFAULT_PORT = 11434
+
+T = TypeVar("T")
+
+
+class BackendUnavailable(RuntimeError):
+    """No hay ningún servidor Ollama disponible para la petición."""
+
+
+def normalize_host(host: str) -> str:
+    """URL base de un servidor: esquema y puerto por defecto de Ollama."""
+    if "://" not in host:
+        host = "http://" + host
+    scheme, _, rest = host.partition("://")
+    netloc, _, path = rest.partition("/")
+    if netloc.startswith("0.0.0.0"):
+        netloc = "127.0.0.1" + netloc[len("0.0.0.0") :]
+    if ":" not in netloc.rsplit("]", 1)[-1]:
+        netloc = f"{netloc}:{DEFAULT_PORT}"
+    return f"{scheme}://{netloc}" + (f"/{path}".rstrip("/") if path else "")
+
+
+def is_connect_error(error: BaseException) -> bool:
+    """True si el error indica que no se pudo conectar con el servidor."""
+    if isinstance(error, ConnectionError) or getattr(error, "connect_error", False):
+        return True
+    if isinstance(getattr(error, "reason", None), ConnectionError):
+        # urllib.error.URLError envuelve el error del socket
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def _abort_on_cancel(response) -> None:
+    """Hook de httpx: al cancelar la generación se corta el socket de la respuesta.
+
+    Cerrar la respuesta desde otro thread no despierta la lectura bloqueada;
+    `shutdown` sí, y Ollama ve la desconexión y deja de generar.
+    """
+    stream = response.extensions.get("network_stream")
+    sock = stream.get_extra_info("socket") if stream is not None else None
+    if sock is None:
+        return
+
+    def _abort() -> None:
+        # Terminada la respuesta, la conexión vuelve al pool y ya no es de esta generación
+        if not response.is_closed:
+            sock.shutdown(socket.SHUT_RDWR)
+
+    on_cancel(_abort)
+
+
+class Backend:
+    """Un servidor Ollama: clientes, peticiones en curso y estado de salud.
+
+    `host` None es el servidor por defecto (OLLAMA_HOST o localhost).
+    """
+
+    def __init__(self, host: Optional[str] = None):
+        self.host = host
+        self.url = normalize_host(host or os.environ.get("OLLAMA_HOST") or "127.0.0.1")
+        self.outstanding = 0
+        # Orden de la última vez que `Router.pick` lo eligió (bajo el lock del router)
+        self.last_pick = 0
+        self.healthy = True
+        self.served = 0
+        self.failures = 0
+        self.models: Set[str] = set()
+        # Modelos cargados según `/api/ps` y su tamaño en memoria (bytes)
+        self.loaded: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+        self._client = None
+        # Un cliente asíncrono por bucle de eventos: sus conexiones no se pueden
+        # compartir entre bucles (Chainlit y Gradio usan el suyo)
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        import httpx
+
+        kwargs: Dict[str, Any] = {
+            # Ninguna lectura HTTP espera más que el plazo más largo entre fragmentos:
+            # libera el thread que lee un stream cuyo plazo ya venció
+            "timeout": httpx.Timeout(DEFAULT_DEADLINES.transport_timeout(), connect=HTTP_CONNECT_TIMEOUT),
+            "limits": httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        }
+        if self.host:
+            kwargs["host"] = self.host
+        return kwargs
+
+    def client(self):
+        """Cliente síncrono de la librería `ollama` para este servidor."""
+        if self._client is None:
+            import ollama
+
+            self._client = ollama.Client(**self._client_kwargs(), event_hooks={"response": [_abort_on_cancel]})
+        return self._client
+
+    def async_client(self):
+        """Cliente `ollama.AsyncClient` para este servidor en el bucle de eventos actual.
+
+        Todas las conversaciones del bucle comparten su pool de conexiones HTTP.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import ollama
+
+            client = self._async_clients[loop] = ollama.AsyncClient(**self._client_kwargs())
+        return client
+
+    def cli_env(self) -> Dict[str, str]:
+        """Variables de entorno para que `ollama run` use este servidor."""
+        return {"OLLAMA_HOST": self.url} if self.host else {}
+
+    def check(self, timeout: float = 2.0) -> bool:
+        """Consulta `/api/ps`; actualiza la salud y los modelos cargados."""
+        try:
+            with urllib.request.urlopen(f"{self.url}/api/ps", timeout=timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8") or "{}")
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e)
+            return False
+        self.loaded = {
+            m.get("name") or m.get("model"): int(m.get("size") or 0) for m in data.get("models") or []
+        }
+        self.loaded.pop(None, None)
+        self.models = set(self.loaded)
+        self.healthy = True
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "host": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "failures": self.failures,
+            "models": sorted(self.models),
+        }
+
+
+def _has_model(backend: Backend, model: str) -> bool:
+    return model in backend.models or (":" not in model and f"{model}:latest" in backend.models)
+
+
+class _Racer:
+    """Una de las peticiones que compiten en un envío con cobertura (hedging)."""
+
+    def __init__(self, hedge: bool, tried: Optional[List[Backend]] = None):
+        self.hedge = hedge
+        self.tried: List[Backend] = tried or []
+        # Activo mientras su thread lee: al perder, cancelarlo corta también la
+        # lectura en curso (ver `cancellation.on_cancel`), sin esperar al siguiente fragmento
+        self.token = CancelToken("hedge")
+        self.task: Optional[asyncio.Task] = None
+
+
+_DONE = object()
+_ERROR = object()
+
+
+class Router:
+    """Elige servidor por menos peticiones en curso con afinidad por modelo.
+
+    Con `hedge` activo, si el primer fragmento no llega en el retardo de
+    cobertura (percentil `hedge_percentile` del TTFT reciente) se lanza la misma
+    petición en otro servidor; gana la que responde antes y la otra se cancela.
+    """
+
+    def __init__(
+        self,
+        hosts: Optional[List[str]] = None,
+        health_interval: float = HEALTH_INTERVAL,
+        retries: int = ROUTER_RETRIES,
+        hedge: bool = HEDGE_ENABLED,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        hedge_delay: float = HEDGE_DELAY,
+        hedge_min_delay: float = HEDGE_MIN_DELAY,
+        deadlines: Deadlines = DEFAULT_DEADLINES,
+    ):
+        # Lista fija: el health check y la residencia la recorren desde otros threads
+        self.backends = [Backend(h) for h in hosts] if hosts else [Backend()]
+        self._picks = 0
+        self.health_interval = health_interval
+        self.retries = retries
+        self.retried = 0
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay_default = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.deadlines = deadlines
+        self.deadlines_exceeded = 0
+        # Gestor de modelos residentes (`ollama_backend.residency`), que se engancha solo
+        self.residency: Optional[Any] = None
+        self.hedged = 0
+        self.hedge_wins = 0
+        # TTFT reciente por tipo de petición ("stream": primer fragmento, "call": respuesta completa)
+        self._ttft: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        if len(self.backends) > 1 and health_interval > 0:
+            self._health_thread = threading.Thread(target=self._health_loop, name="ollama-router-health", daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        while not self._stop.is_set():
+            for backend in self.backends:
+                backend.check()
+            self._stop.wait(self.health_interval)
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def pick(self, model: str, exclude: Iterable[Backend] = ()) -> Backend:
+        """Servidor para `model`: sano, con el modelo cargado y menos ocupado.
+
+        Si todos están expulsados se prueba igualmente el menos ocupado, por si
+        ya se ha recuperado. Reserva el hueco (`outstanding`) del elegido.
+        """
+        excluded = set(map(id, exclude))
+        with self._lock:
+            candidates = [b for b in self.backends if id(b) not in excluded]
+            if not candidates:
+                raise BackendUnavailable("No hay ningún servidor Ollama disponible.")
+            healthy = [b for b in candidates if b.healthy] or candidates
+            loaded = [b for b in healthy if _has_model(b, model)] or healthy
+            # Ante empates, el elegido hace más tiempo, para repartirlos
+            backend = min(loaded, key=lambda b: (b.outstanding, b.last_pick))
+            self._picks += 1
+            backend.last_pick = self._picks
+            backend.outstanding += 1
+        if self.residency is not None:
+            self.residency.touch(backend, model)
+        return backend
+
+    def _done(self, backend: Backend, model: str, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                backend.served += 1
+                backend.models.add(model)
+            elif is_connect_error(error) or (isinstance(error, DeadlineExceeded) and error.kind != "total"):
+                # Expulsado hasta que la comprobación de salud vuelva a verlo vivo
+                backend.failures += 1
+                backend.healthy = False
+                backend.last_error = str(error)
+            if isinstance(error, DeadlineExceeded):
+                self.deadlines_exceeded += 1
+        if self.residency is not None:
+            self.residency.release(backend, model)
+
+    def _retry(self, error: BaseException, attempts: int, tried: List[Backend]) -> bool:
+        if is_connect_error(error) and attempts <= self.retries and len(tried) < len(self.backends):
+            self.retried += 1
+            return True
+        return False
+
+    # -- cobertura (hedging) ------------------------------------------------------
+
+    def _observe(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._ttft.setdefault(kind, deque(maxlen=HEDGE_SAMPLES)).append(seconds)
+
+    def hedge_delay(self, kind: str = "stream") -> float:
+        """Segundos de espera del primer fragmento antes de lanzar la petición de cobertura."""
+        with self._lock:
+            samples = sorted(self._ttft.get(kind, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return self.hedge_delay_default
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return max(self.hedge_min_delay, samples[index])
+
+    def _can_hedge(self, tried: List[Backend]) -> bool:
+        excluded = set(map(id, tried))
+        return any(b.healthy and id(b) not in excluded for b in self.backends)
+
+    def _hedging(self) -> bool:
+        return self.hedge and len(self.backends) > 1
+
+    def _race_events(self, racer: _Racer, item: Any, error: Optional[BaseException], state: Dict[str, Any]):
+        """Decide qué hacer con un evento de la carrera; devuelve (acción, valor).
+
+        Acciones: "skip" (ignorar), "win" (primer fragmento: `racer` gana),
+        "yield" (entregar `valor`), "return" y "raise".
+        """
+        if state["winner"] is None:
+            if item is _DONE or item is _ERROR:
+                # Terminó sin producir nada: si queda otra petición en marcha se espera a esa
+                state["live"] -= 1
+                if error is not None:
+                    state["error"] = error
+                if state["live"]:
+                    return "skip", None
+                return ("raise", state["error"]) if state["error"] is not None else ("return", None)
+            state["winner"] = racer
+            if racer.hedge:
+                self.hedge_wins += 1
+            return "win", item
+        if racer is not state["winner"]:
+            return "skip", None
+        if item is _DONE:
+            return "return", None
+        if item is _ERROR:
+            return "raise", error
+        return "yield", item
+
+    def _hedged_stream(self, model: str, produce: Callable[[Backend], Iterable[T]], kind: str) -> Iterator[T]:
+        events: "queue.Queue" = queue.Queue()
+        racers: List[_Racer] = []
+
+        def run(racer: _Racer) -> None:
+            try:
+                for item in racer.token.guard(self._stream(model, produce, kind, racer.tried)):
+                    events.put((racer, item, None))
+            except BaseException as e:
+                events.put((racer, _ERROR, e))
+            else:
+                events.put((racer, _DONE, None))
+            finally:
+                racer.token.finish()
+
+        def launch(racer: _Racer) -> None:
+            racers.append(racer)
+            # Si se cancela la generación que lee este stream, caen también las peticiones de la carrera
+            unregister.append(on_cancel(racer.token.cancel))
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(run, racer), name="ollama-router-hedge", daemon=True
+            ).start()
+
+        unregister: List[Callable[[], None]] = []
+        primary = _Racer(hedge=False)
+        launch(primary)
+        hedge_at = time.monotonic() + self.hedge_delay(kind)
+        state: Dict[str, Any] = {"winner": None, "live": 1, "error": None}
+        try:
+            while True:
+                timeout = None
+                if state["winner"] is None and len(racers) == 1:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    racer, item, error = events.get(timeout=timeout)
+                except queue.Empty:
+                    # El primer fragmento se retrasa: misma petición en otro servidor
+                    if self._can_hedge(primary.tried):
+                        self.hedged += 1
+                        state["live"] += 1
+                        launch(_Racer(hedge=True, tried=list(primary.tried)))
+                    else:
+                        hedge_at = float("inf")
+                    continue
+                action, value = self._race_events(racer, item, error, state)
+                if action == "win":
+                    for other in racers:
+                        if other is not racer:
+                            other.token.cancel("hedge")
+                    yield value
+                elif action == "yield":
+                    yield value
+                elif action == "return":
+                    return
+                elif action == "raise":
+                    raise value
+        finally:
+            for remove in unregister:
+                remove()
+            for racer in racers:
+                racer.token.cancel("hedge")
+
+    async def _hedged_astream(
+        self, model: str, produce: Callable[[Backend], AsyncIterable[T]], kind: str
+    ) -> AsyncIterator[T]:
+        events: "asyncio.Queue" = asyncio.Queue()
+        racers: List[_Racer] = []
+
+        async def run(racer: _Racer) -> None:
+            try:
+                async for item in self._astream(model, produce, kind, racer.tried):
+                    events.put_nowait((racer, item, None))
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                events.put_nowait((racer, _ERROR, e))
+            else:
+                events.put_nowait((racer, _DONE, None))
+
+        def launch(racer: _Racer) -> None:
+            racers.append(racer)
+            racer.task = asyncio.get_running_loop().create_task(run(racer))
+
+        primary = _Racer(hedge=False)
+        launch(primary)
+        hedge_at = time.monotonic() + self.hedge_delay(kind)
+        state: Dict[str, Any] = {"winner": None, "live": 1, "error": None}
+        try:
+            while True:
+                timeout = None
+                if state["winner"] is None and len(racers) == 1:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    racer, item, error = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    if self._can_hedge(primary.tried):
+                        self.hedged += 1
+                        state["live"] += 1
+                        launch(_Racer(hedge=True, tried=list(primary.tried)))
+                    else:
+                        hedge_at = float("inf")
+                    continue
+                action, value = self._race_events(racer, item, error, state)
+                if action == "win":
+                    for other in racers:
+                        if other is not racer and other.task is not None:
+                            other.task.cancel()
+                    yield value
+                elif action == "yield":
+                    yield value
+                elif action == "return":
+                    return
+                elif action == "raise":
+                    raise value
+        finally:
+            for racer in racers:
+                if racer.task is not None:
+                    racer.task.cancel()
+
+    # -- envío con reintento --------------------------------------------------------
+
+    def _stream(
+        self, model: str, produce: Callable[[Backend], Iterable[T]], kind: str, tried: Optional[List[Backend]] = None
+    ) -> Iterator[T]:
+        tried = [] if tried is None else tried
+        attempts = 0
+        while True:
+            backend = self.pick(model, exclude=tried)
+            tried.append(backend)
+            attempts += 1
+            started = False
+            start = time.monotonic()
+            try:
+                for item in enforce(produce(backend), self.deadlines):
+                    if not started:
+                        started = True
+                        self._observe(kind, time.monotonic() - start)
+                    yield item
+            except GeneratorExit:
+                self._done(backend, model)
+                raise
+            except BaseException as e:
+                if is_cancelled():
+                    # El corte lo provocó la cancelación: el servidor no ha fallado
+                    self._done(backend, model)
+                    raise
+                self._done(backend, model, e)
+                if not started and self._retry(e, attempts, tried):
+                    continue
+                raise
+            self._done(backend, model)
+            return
+
+    async def _astream(
+        self,
+        model: str,
+        produce: Callable[[Backend], AsyncIterable[T]],
+        kind: str,
+        tried: Optional[List[Backend]] = None,
+    ) -> AsyncIterator[T]:
+        tried = [] if tried is None else tried
+        attempts = 0
+        while True:
+            backend = self.pick(model, exclude=tried)
+            tried.append(backend)
+            attempts += 1
+            started = False
+            start = time.monotonic()
+            try:
+                async for item in aenforce(produce(backend), self.deadlines):
+                    if not started:
+                        started = True
+                        self._observe(kind, time.monotonic() - start)
+                    yield item
+            except GeneratorExit:
+                self._done(backend, model)
+                raise
+            except BaseException as e:
+                if is_cancelled():
+                    # El corte lo provocó la cancelación: el servidor no ha fallado
+                    self._done(backend, model)
+                    raise
+                self._done(backend, model, e)
+                if not started and self._retry(e, attempts, tried):
+                    continue
+                raise
+            self._done(backend, model)
+            return
+
+    def stream(self, model: str, produce: Callable[[Backend], Iterable[T]]) -> Iterator[T]:
+        """Stream de `produce(backend)` en el servidor elegido, con reintento si no conecta."""
+        if self._hedging():
+            return self._hedged_stream(model, produce, "stream")
+        return self._stream(model, produce, "stream")
+
+    def call(self, model: str, produce: Callable[[Backend], T]) -> T:
+        """Como `stream` para llamadas que devuelven un único resultado."""
+
+        def _single(backend: Backend) -> Iterator[T]:
+            yield produce(backend)
+
+        results = self._hedged_stream(model, _single, "call") if self._hedging() else self._stream(model, _single, "call")
+        try:
+            for result in results:
+                return result
+        finally:
+            results.close()
+        raise RuntimeError("La petición terminó sin resultado.")
+
+    def astream(self, model: str, produce: Callable[[Backend], AsyncIterable[T]]) -> AsyncIterator[T]:
+        if self._hedging():
+            return self._hedged_astream(model, produce, "stream")
+        return self._astream(model, produce, "stream")
+
+    async def acall(self, model: str, produce: Callable[[Backend], Awaitable[T]]) -> T:
+
+        async def _single(backend: Backend) -> AsyncIterator[T]:
+            yield await produce(backend)
+
+        if self._hedging():
+            results = self._hedged_astream(model, _single, "call")
+        else:
+            results = self._astream(model, _single, "call")
+        try:
+            async for result in results:
+                return result
+        finally:
+            await results.aclose()
+        raise RuntimeError("La petición terminó sin resultado.")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay": self.hedge_delay() if self.hedge else None,
+            "deadlines_exceeded": self.deadlines_exceeded,
+            "backends": [b.stats() for b in self.backends],
+        }
+
+
+_DEFAULT_ROUTER: Optional[Router] = None
+_DEFAULT_ROUTER_LOCK = threading.Lock()
+
+
+def default_router() -> Router:
+    """Router compartido por todas las variantes, configurado con OLLAMA_HOSTS."""
+    global _DEFAULT_ROUTER
+    with _DEFAULT_ROUTER_LOCK:
+        if _DEFAULT_ROUTER is None:
+            _DEFAULT_ROUTER = Router(HOSTS)
+        return _DEFAULT_ROUTER
@@ -0,0 +1,240 @@
+"""
+Control de admisión y reparto justo delante del backend de Ollama.
+
+Todas las variantes comparten un único Ollama local; sin límite, con muchos
+usuarios a la vez todas las respuestas se ralentizan juntas y los timeouts se
+encadenan. `Scheduler` limita las generaciones simultáneas y pone el resto en
+una cola acotada:
+
+ - Como mucho OLLAMA_MAX_IN_FLIGHT peticiones se sirven a la vez.
+ - Las demás esperan en una cola de como mucho OLLAMA_MAX_QUEUE peticiones;
+   si está llena se rechazan al momento con `QueueFull`.
+ - La cola se reparte por turnos entre sesiones (round-robin), de modo que un
+   usuario que envía muchos mensajes no deja sin servicio a los demás.
+ - Mientras esperan, los llamadores conocen su posición en la cola para
+   mostrarla en la UI.
+
+Uso:
+    ticket = default_scheduler().enqueue(session_id)   # puede lanzar QueueFull
+    with ticket:
+        for position in ticket.waiting():
+            ...  # mostrar "En cola (posición N)"
+        ...      # llamar al modelo
+
+Variables de entorno:
+     OLLAMA_MAX_IN_FLIGHT: peticiones servidas a la vez (por defecto 4)
+     OLLAMA_MAX_QUEUE: peticiones en espera como máximo (por defecto 32)
+     OLLAMA_QUEUE_POLL: segundos entre actualizaciones de la posición (por defecto 0.5)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", "4"))
+MAX_QUEUE = int(os.environ.get("OLLAMA_MAX_QUEUE", "32"))
+QUEUE_POLL = float(os.environ.get("OLLAMA_QUEUE_POLL", "0.5"))
+
+
+class QueueFull(RuntimeError):
+    """La cola de espera está llena; la petición se rechaza sin esperar."""
+
+
+class Ticket:
+    """Turno de una petición: en cola hasta que se le concede un hueco.
+
+    `release()` (o salir del bloque `with`) libera el hueco o, si aún estaba
+    en cola, la retira de ella. Es idempotente.
+    """
+
+    def __init__(self, scheduler: "Scheduler", session_id: str):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self._event = threading.Event()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def position(self) -> int:
+        """Posición en la cola (1 = la siguiente en entrar); 0 si ya tiene hueco."""
+        return self.scheduler.position(self)
+
+    @property
+    def waited(self) -> float:
+        """Segundos que pasó en cola."""
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    def _grant(self) -> None:
+        self.granted = True
+        self.granted_at = time.monotonic()
+        self._event.set()
+        for loop, future in self._waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # El event loop ya se cerró
+                pass
+        self._waiters.clear()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Bloquea hasta tener hueco (o hasta `timeout`); devuelve si lo tiene."""
+        return self._event.wait(timeout)
+
+    def waiting(self, interval: float = QUEUE_POLL) -> Iterator[int]:
+        """Produce la posición en la cola cada `interval` segundos hasta tener hueco.
+
+        Si hay hueco libre no produce nada.
+        """
+        while not self.granted:
+            position = self.position
+            if position:
+                yield position
+            self._event.wait(interval)
+
+    async def await_turn(self, interval: float = QUEUE_POLL) -> AsyncIterator[int]:
+        """Versión asíncrona de `waiting`, sin bloquear el event loop."""
+        loop = asyncio.get_running_loop()
+        while not self.granted:
+            future = loop.create_future()
+            with self.scheduler._lock:
+                if self.granted:
+                    break
+                self._waiters.append((loop, future))
+            position = self.position
+            if position:
+                yield position
+            try:
+                await asyncio.wait_for(future, interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self) -> None:
+        self.scheduler.release(self)
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    """Limita las generaciones simultáneas y reparte la cola por sesiones."""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, max_queue: int = MAX_QUEUE):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        # Colas por sesión, en el orden en que les toca turno
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def enqueue(self, session_id: str) -> Ticket:
+        """Pide turno para `session_id`; lanza `QueueFull` si la cola está llena."""
+        ticket = Ticket(self, session_id)
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self.queued:
+                self._admit(ticket)
+                return ticket
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(
+                    "Servidor ocupado: la cola de peticiones está llena. Inténtalo de nuevo en unos segundos."
+                )
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self.queued += 1
+        return ticket
+
+    def _admit(self, ticket: Ticket) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        ticket._grant()
+        self.total_wait += ticket.waited
+
+    def _dispatch(self) -> None:
+        # Round-robin: la sesión atendida pasa al final de la rotación
+        while self.in_flight < self.max_in_flight and self._queues:
+            session_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            self._admit(ticket)
+
+    def release(self, ticket: Ticket) -> None:
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self.in_flight -= 1
+            else:
+                queue = self._queues.get(ticket.session_id)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    self.queued -= 1
+                    if not queue:
+                        del self._queues[ticket.session_id]
+            self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """Posición de `ticket` en el orden en que se irán concediendo los huecos."""
+        with self._lock:
+            if ticket.granted or ticket.released:
+                return 0
+            queue = self._queues.get(ticket.session_id)
+            if queue is None or ticket not in queue:
+                return 0
+            index = queue.index(ticket)
+            position = 0
+            before = True
+            for session_id, other in self._queues.items():
+                if session_id == ticket.session_id:
+                    position += index + 1
+                    before = False
+                else:
+                    # Entra un ticket por sesión y ronda: las sesiones anteriores en la
+                    # rotación también entran antes en la ronda de `ticket`; las posteriores no
+                    position += min(len(other), index + 1 if before else index)
+            return position
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            }
+
+
+_DEFAULT_SCHEDULER: Optional[Scheduler] = None
+_DEFAULT_SCHEDULER_LOCK = threading.Lock()
+
+
+def default_scheduler() -> Scheduler:
+    """Planificador compartido por todas las variantes del proceso."""
+    global _DEFAULT_SCHEDULER
+    with _DEFAULT_SCHEDULER_LOCK:
+        if _DEFAULT_SCHEDULER is None:
+            _DEFAULT_SCHEDULER = Scheduler()
+        return _DEFAULT_SCHEDULER
@@ -0,0 +1,270 @@
+"""
+Deduplicación de peticiones idénticas en curso ("single flight").
+
+Si varios usuarios envían a la vez la misma petición (mismo modelo, mensajes
+y opciones, p. ej. un taller ejecutando el mismo caso de prueba), solo se
+lanza una generación contra Ollama y todos los suscriptores reciben el mismo
+stream. Quien llega tarde recibe primero lo ya generado y después sigue en
+directo.
+
+Cancelación: si un suscriptor deja de leer (cierra el stream, se cancela su
+tarea o su `CancelToken`...), la generación continúa para los demás; solo se
+corta cuando ya no queda ningún suscriptor. La generación compartida tiene su
+propio token (`ollama_backend.cancellation`), que se cancela entonces para
+matar el proceso o cerrar la conexión sin esperar al siguiente fragmento. Un
+error de la generación se propaga a todos.
+
+Se combina con la caché de respuestas (`ollama_backend.cache`): la caché
+sirve lo que ya terminó y el single flight lo que aún se está generando.
+
+Variables de entorno:
+     OLLAMA_SINGLEFLIGHT: 0 desactiva la deduplicación
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from .cancellation import CancelToken, Cancelled, on_cancel
+
+SINGLEFLIGHT_ENABLED = os.environ.get("OLLAMA_SINGLEFLIGHT", "1") != "0"
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """Una generación compartida: elementos producidos y suscriptores activos."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.cond = threading.Condition()
+        # Cancela la generación cuando se va el último suscriptor
+        self.token = CancelToken("singleflight")
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.token = CancelToken("singleflight")
+
+
+class SingleFlight:
+    """Comparte entre suscriptores las generaciones idénticas que están en curso."""
+
+    def __init__(self, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.enabled = enabled
+        self.flights = 0
+        self.joined = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._aflights: Dict[str, _AsyncFlight] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights) + len(self._aflights)
+
+    def stats(self) -> Dict[str, int]:
+        return {"flights": self.flights, "joined": self.joined, "in_flight": self.in_flight}
+
+    # -- API síncrona (threads) -------------------------------------------------
+
+    def _produce(self, key: str, flight: _Flight, produce: Callable[[], Iterable[T]]) -> None:
+        # Thread propio: la generación activa es la compartida, no la del primer suscriptor
+        with flight.token.active():
+            iterator = iter(())
+            try:
+                iterator = iter(produce())
+                for item in iterator:
+                    with flight.cond:
+                        flight.items.append(item)
+                        flight.cond.notify_all()
+                        if flight.subscribers == 0:
+                            # Nadie escucha ya: cortar la generación
+                            break
+            except BaseException as e:
+                flight.error = e
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                with flight.cond:
+                    flight.done = True
+                    flight.cond.notify_all()
+
+    def stream(self, key: str, produce: Callable[[], Iterable[T]], bypass: bool = False) -> Iterator[T]:
+        """Stream de `produce()` compartido con las peticiones en curso con la misma `key`.
+
+        La generación se ejecuta en un thread propio, de modo que no depende de
+        que el primer suscriptor siga leyendo.
+        """
+        if bypass or not self.enabled:
+            yield from produce()
+            return
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.flights += 1
+            else:
+                self.joined += 1
+            with flight.cond:
+                flight.subscribers += 1
+        if leader:
+            threading.Thread(target=self._produce, args=(key, flight, produce), daemon=True).start()
+
+        # Cancelar la generación del suscriptor solo lo suelta de la compartida
+        detached = threading.Event()
+
+        def _detach() -> None:
+            detached.set()
+            with flight.cond:
+                flight.cond.notify_all()
+
+        remove = on_cancel(_detach)
+        position = 0
+        try:
+            while True:
+                with flight.cond:
+                    while position >= len(flight.items) and not flight.done and not detached.is_set():
+                        flight.cond.wait()
+                    if detached.is_set():
+                        raise Cancelled("Generación cancelada.")
+                    pending = flight.items[position:]
+                    finished = flight.done
+                for item in pending:
+                    yield item
+                position += len(pending)
+                if finished and position >= len(flight.items):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            remove()
+            with self._lock:
+                with flight.cond:
+                    flight.subscribers -= 1
+                    abandoned = flight.subscribers == 0 and not flight.done
+                # Las peticiones que lleguen después empiezan una generación nueva
+                if abandoned and self._flights.get(key) is flight:
+                    del self._flights[key]
+            if abandoned:
+                flight.token.cancel("abandoned")
+
+    def call(self, key: str, produce: Callable[[], T], bypass: bool = False) -> T:
+        """Como `stream` para llamadas que devuelven un único resultado."""
+
+        def _single():
+            yield produce()
+
+        results = self.stream(key, _single, bypass=bypass)
+        try:
+            for result in results:
+                return result
+        finally:
+            results.close()
+        raise RuntimeError("La generación compartida terminó sin resultado.")
+
+    # -- API asíncrona (un único event loop) ------------------------------------
+
+    async def _aproduce(self, key: str, flight: _AsyncFlight, produce: Callable[[], AsyncIterable[T]]) -> None:
+        try:
+            # La tarea copia el contexto del primer suscriptor: la generación es de todos
+            with flight.token.active():
+                async for item in produce():
+                    flight.items.append(item)
+                    flight.changed.set()
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._aflights.get(key) is flight:
+                    del self._aflights[key]
+            flight.done = True
+            flight.changed.set()
+
+    async def astream(
+        self, key: str, produce: Callable[[], AsyncIterable[T]], bypass: bool = False
+    ) -> AsyncIterator[T]:
+        """Versión asíncrona de `stream`; la generación corre en una tarea propia."""
+        if bypass or not self.enabled:
+            async for item in produce():
+                yield item
+            return
+
+        with self._lock:
+            flight = self._aflights.get(key)
+            if flight is None:
+                flight = self._aflights[key] = _AsyncFlight()
+                flight.task = asyncio.get_running_loop().create_task(self._aproduce(key, flight, produce))
+                self.flights += 1
+            else:
+                self.joined += 1
+            flight.subscribers += 1
+
+        position = 0
+        try:
+            while True:
+                if position < len(flight.items):
+                    item = flight.items[position]
+                    position += 1
+                    yield item
+                    continue
+                if flight.done:
+                    break
+                flight.changed.clear()
+                await flight.changed.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.done
+                if abandoned and self._aflights.get(key) is flight:
+                    del self._aflights[key]
+            if abandoned and flight.task is not None:
+                # Era el último suscriptor: cancelar la generación
+                flight.token.cancel("abandoned")
+                flight.task.cancel()
+
+    async def acall(self, key: str, produce: Callable[[], Any], bypass: bool = False) -> Any:
+        """Como `call` para corutinas."""
+
+        async def _single():
+            yield await produce()
+
+        results = self.astream(key, _single, bypass=bypass)
+        try:
+            async for result in results:
+                return result
+        finally:
+            await results.aclose()
+        raise RuntimeError("La generación compartida terminó sin resultado.")
+
+
+_DEFAULT_SINGLEFLIGHT: Optional[SingleFlight] = None
+_DEFAULT_SINGLEFLIGHT_LOCK = threading.Lock()
+
+
+def default_singleflight() -> SingleFlight:
+    """Deduplicador compartido por todas las variantes del proceso."""
+    global _DEFAULT_SINGLEFLIGHT
+    with _DEFAULT_SINGLEFLIGHT_LOCK:
+        if _DEFAULT_SINGLEFLIGHT is None:
+            _DEFAULT_SINGLEFLIGHT = SingleFlight()
+        return _DEFAULT_SINGLEFLIGHT
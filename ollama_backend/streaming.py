@@ -0,0 +1,144 @@
+"""
+Utilidades para consumir respuestas de Ollama por fragmentos.
+"""
+
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+async def iterate_in_thread(iterable: Iterable[T]) -> AsyncIterator[T]:
+    """Consume un iterador bloqueante en un thread y lo expone como async.
+
+    Pensado para apps asíncronas (Chainlit) que necesitan leer un generador
+    síncrono (p. ej. `cli_pool.stream_prompt`) sin bloquear el event loop.
+    Si el consumidor deja de iterar, el thread cierra el generador en cuanto
+    recibe el siguiente fragmento.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def _put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # El event loop ya se cerró: nadie va a leer
+            stop.set()
+
+    def _produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                _put(item)
+        except BaseException as e:
+            _put(_DONE, e)
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        _put(_DONE)
+
+    # Con la generación activa del llamador, para que su cancelación llegue al backend
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_produce,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def chunk_text(part: Any) -> str:
+    """Extrae el texto de un fragmento de `ollama.chat(..., stream=True)`.
+
+    Los fragmentos suelen tener la forma {'message': {'content': '...'}} o ser
+    objetos con `.message.content`, según la versión del cliente. No se
+    recorta el texto para que los fragmentos se unan correctamente.
+    """
+    try:
+        if isinstance(part, dict):
+            msg = part.get("message") or {}
+            return msg.get("content") if msg.get("content") is not None else part.get("content") or ""
+        try:
+            return part.message.content or ""
+        except Exception:
+            return str(part)
+    except Exception:
+        return str(part)
+
+
+def coalesce(fragments: Iterable[str], interval: float = 0.05, max_chars: int = 64) -> Iterator[str]:
+    """Agrupa fragmentos de texto para repintar la UI menos veces.
+
+    Acumula fragmentos y emite el bloque acumulado cuando supera `max_chars`
+    caracteres o, como muy tarde, `interval` segundos después de la última
+    emisión, aunque no llegue ningún fragmento nuevo: el stream se lee en un
+    thread, así que un hueco largo entre tokens no retiene el texto ya recibido.
+    Lo que quede pendiente al terminar el stream siempre se emite.
+    """
+    pending: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+
+    def _read():
+        iterator = iter(fragments)
+        try:
+            for fragment in iterator:
+                if stop.is_set():
+                    break
+                pending.put((fragment, None))
+        except BaseException as e:
+            pending.put((_DONE, e))
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        pending.put((_DONE, None))
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_read,), daemon=True)
+    thread.start()
+    buffer: List[str] = []
+    size = 0
+    last_flush = time.monotonic()
+    try:
+        while True:
+            timeout = max(0.0, last_flush + interval - time.monotonic()) if buffer else None
+            try:
+                fragment, error = pending.get(timeout=timeout)
+            except queue.Empty:
+                # Venció la ventana con texto pendiente: se emite sin esperar al siguiente fragmento
+                yield "".join(buffer)
+                buffer, size, last_flush = [], 0, time.monotonic()
+                continue
+            if fragment is _DONE:
+                if buffer:
+                    yield "".join(buffer)
+                if error is not None:
+                    raise error
+                return
+            if not fragment:
+                continue
+            buffer.append(fragment)
+            size += len(fragment)
+            now = time.monotonic()
+            if size >= max_chars or now - last_flush >= interval:
+                yield "".join(buffer)
+                buffer, size, last_flush = [], 0, now
+    finally:
+        stop.set()
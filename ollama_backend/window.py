@@ -0,0 +1,277 @@
+"""
+Ventana de historial por presupuesto de tokens.
+
+En lugar de recortar el historial por número de mensajes, se cuentan tokens
+y se descartan los turnos más antiguos hasta que el prompt (system prompt +
+historial) cabe en OLLAMA_PROMPT_TOKEN_BUDGET. El system prompt nunca se
+descarta.
+
+Contador de tokens:
+ - OLLAMA_TOKENIZER=tiktoken:<encoding> (p. ej. tiktoken:cl100k_base) o
+   OLLAMA_TOKENIZER=hf:<modelo> (tokenizer de `transformers`) si están instalados.
+ - Sin tokenizer configurado (o si no se puede cargar) se usa una estimación
+   barata de ~4 caracteres por token.
+Los recuentos se cachean por mensaje, de modo que cada turno solo tokeniza el
+mensaje nuevo.
+
+Al superar el presupuesto, `HistoryWindow` no quita solo el turno que sobra
+sino que recorta hasta OLLAMA_TRIM_TARGET (fracción del presupuesto). Así el
+principio del prompt se mantiene igual durante varios turnos y Ollama puede
+reutilizar la caché KV del prefijo ya evaluado (ver `ollama_backend.prefix_cache`).
+
+Dos formas de uso:
+ - `HistoryWindow`: ventana incremental con estado (una por sesión), que
+   admite además un resumen de los turnos antiguos.
+ - `window_messages()`: recorta una lista completa de mensajes recorriéndola
+   desde el final, para las apps que ya guardan el historial en la UI.
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("OLLAMA_PROMPT_TOKEN_BUDGET", "3072"))
+TRIM_TARGET = float(os.environ.get("OLLAMA_TRIM_TARGET", "0.75"))
+
+# Tokens extra por mensaje (rol y separadores de la plantilla de chat)
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)."""
+    return max(1, (len(text) + 3) // 4)
+
+
+def _load_tokenizer(spec: str) -> Optional[Callable[[str], int]]:
+    kind, _, name = spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(name or "cl100k_base")
+            return lambda text: len(encoding.encode(text))
+        if kind == "hf":
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(name)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as e:
+        print(f"No se pudo cargar el tokenizer '{spec}', se usa la estimación por caracteres: {e}")
+        return None
+    print(f"Tokenizer desconocido '{spec}', se usa la estimación por caracteres.")
+    return None
+
+
+class TokenCounter:
+    """Cuenta tokens con un tokenizer opcional y cachea los recuentos.
+
+    La caché se indexa por (longitud, hash) del texto para no retener en
+    memoria el contenido de los mensajes.
+    """
+
+    def __init__(self, tokenize: Optional[Callable[[str], int]] = None, cache_size: int = 8192):
+        self.tokenize = tokenize or estimate_tokens
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        key = (len(text), hash(text))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        tokens = self.tokenize(text)
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        return self.count(message.get("content", "")) + MESSAGE_OVERHEAD
+
+
+_DEFAULT_COUNTER: Optional[TokenCounter] = None
+
+
+def default_counter() -> TokenCounter:
+    """Contador compartido, configurado con OLLAMA_TOKENIZER."""
+    global _DEFAULT_COUNTER
+    if _DEFAULT_COUNTER is None:
+        spec = os.environ.get("OLLAMA_TOKENIZER")
+        _DEFAULT_COUNTER = TokenCounter(_load_tokenizer(spec) if spec else None)
+    return _DEFAULT_COUNTER
+
+
+class HistoryWindow:
+    """Historial incremental que cabe en un presupuesto de tokens.
+
+    Cada mensaje guarda su recuento al añadirse y se mantiene el total, así
+    que `append` cuesta O(mensaje nuevo). Se descartan turnos completos desde
+    el principio: si tras quitar mensajes la ventana empezara con una
+    respuesta del assistant, se quita también.
+
+    Además del system prompt puede fijarse un resumen de los turnos antiguos
+    (ver `ollama_backend.compaction`), que se envía justo detrás de él.
+    """
+
+    SUMMARY_PREFIX = "Resumen de la conversación anterior:\n"
+
+    def __init__(
+        self,
+        budget: int = PROMPT_TOKEN_BUDGET,
+        system_prompt: Optional[str] = None,
+        counter: Optional[TokenCounter] = None,
+        trim_target: float = TRIM_TARGET,
+    ):
+        self.budget = budget
+        self.trim_target = trim_target
+        self.counter = counter or default_counter()
+        # Protege la ventana frente a la compactación en segundo plano
+        self.lock = threading.RLock()
+        self._entries: Deque[Tuple[Dict[str, str], int]] = deque()
+        self._history_tokens = 0
+        self._system: Optional[Dict[str, str]] = None
+        self._system_tokens = 0
+        self._summary: Optional[Dict[str, str]] = None
+        self._summary_tokens = 0
+        # Hay un resumen en curso (lo marca `Compactor`)
+        self.compacting = False
+        self.set_system_prompt(system_prompt)
+
+    @property
+    def tokens(self) -> int:
+        """Tokens del prompt completo (system prompt + resumen + historial)."""
+        return self._system_tokens + self._summary_tokens + self._history_tokens
+
+    @property
+    def summary(self) -> Optional[str]:
+        if self._summary is None:
+            return None
+        return self._summary["content"][len(self.SUMMARY_PREFIX) :]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_system_prompt(self, system_prompt: Optional[str]) -> None:
+        with self.lock:
+            if system_prompt:
+                self._system = {"role": "system", "content": system_prompt}
+                self._system_tokens = self.counter.count_message(self._system)
+            else:
+                self._system = None
+                self._system_tokens = 0
+            self._trim()
+
+    def append(self, role: str, content: str) -> List[Dict[str, str]]:
+        """Añade un mensaje y devuelve los mensajes descartados para caber en el presupuesto."""
+        message = {"role": role, "content": content}
+        tokens = self.counter.count_message(message)
+        with self.lock:
+            self._entries.append((message, tokens))
+            self._history_tokens += tokens
+            return self._trim()
+
+    def pop_oldest(self) -> Dict[str, str]:
+        with self.lock:
+            message, tokens = self._entries.popleft()
+            self._history_tokens -= tokens
+            return message
+
+    def _trim(self) -> List[Dict[str, str]]:
+        dropped: List[Dict[str, str]] = []
+        if self.tokens <= self.budget:
+            return dropped
+        # Se recorta por debajo del presupuesto para que el prefijo no cambie en cada turno.
+        # Siempre se conserva al menos el último mensaje.
+        target = min(self.budget, int(self.budget * self.trim_target))
+        while len(self._entries) > 1 and self.tokens > target:
+            dropped.append(self.pop_oldest())
+        while len(self._entries) > 1 and self._entries[0][0]["role"] == "assistant" and dropped:
+            dropped.append(self.pop_oldest())
+        return dropped
+
+    def oldest(self, keep_tokens: int, keep_messages: int = 2) -> List[Dict[str, str]]:
+        """Mensajes más antiguos que sobran para que el historial quede en
+        `keep_tokens` tokens, conservando al menos `keep_messages` mensajes y
+        cortando en un límite de turno (el siguiente mensaje es del usuario).
+        """
+        with self.lock:
+            entries = list(self._entries)
+            remaining = self._history_tokens
+        count = 0
+        while count < len(entries) - keep_messages and remaining > keep_tokens:
+            remaining -= entries[count][1]
+            count += 1
+        while count < len(entries) - keep_messages and entries[count][0]["role"] == "assistant":
+            count += 1
+        return [message for message, _ in entries[:count]]
+
+    def apply_summary(self, compacted: List[Dict[str, str]], summary: str) -> Optional[List[Dict[str, str]]]:
+        """Sustituye los mensajes `compacted` (los más antiguos) por `summary`.
+
+        Si mientras tanto la ventana ya no empieza por esos mensajes (p. ej.
+        se recortaron o se borró la sesión) no se hace nada y devuelve None;
+        si no, devuelve los mensajes retirados.
+        """
+        with self.lock:
+            head = [message for message, _ in list(self._entries)[: len(compacted)]]
+            if len(head) != len(compacted) or any(a is not b for a, b in zip(head, compacted)):
+                return None
+            removed = [self.pop_oldest() for _ in compacted]
+            self._summary = {"role": "system", "content": self.SUMMARY_PREFIX + summary}
+            self._summary_tokens = self.counter.count_message(self._summary)
+            return removed + self._trim()
+
+    def needs_compaction(self, threshold: float) -> bool:
+        """True si el prompt ocupa al menos `threshold` del presupuesto."""
+        return len(self._entries) > 2 and self.tokens >= threshold * self.budget
+
+    def history(self) -> List[Dict[str, str]]:
+        """Mensajes de la ventana sin el system prompt ni el resumen."""
+        with self.lock:
+            return [message for message, _ in self._entries]
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Mensajes a enviar al modelo: system prompt y resumen fijados + historial."""
+        with self.lock:
+            msgs = [m for m in (self._system, self._summary) if m]
+            msgs.extend(message for message, _ in self._entries)
+            return msgs
+
+
+def window_messages(
+    messages: List[Dict[str, str]],
+    budget: int = PROMPT_TOKEN_BUDGET,
+    system_prompt: Optional[str] = None,
+    counter: Optional[TokenCounter] = None,
+) -> List[Dict[str, str]]:
+    """Devuelve los mensajes más recientes de `messages` que caben en `budget`.
+
+    Se recorre la lista desde el final y se para al agotar el presupuesto, de
+    modo que el coste depende del tamaño de la ventana y no del historial
+    completo. Un mensaje `system` inicial (o `system_prompt`) siempre se
+    mantiene. El último mensaje se incluye aunque no quepa.
+    """
+    counter = counter or default_counter()
+    head: List[Dict[str, str]] = []
+    if system_prompt:
+        head = [{"role": "system", "content": system_prompt}]
+    elif messages and messages[0].get("role") == "system":
+        head, messages = [messages[0]], messages[1:]
+
+    remaining = budget - sum(counter.count_message(m) for m in head)
+    start = len(messages)
+    while start > 0:
+        tokens = counter.count_message(messages[start - 1])
+        if tokens > remaining and start < len(messages):
+            break
+        remaining -= tokens
+        start -= 1
+    # No empezar la ventana con una respuesta huérfana del assistant
+    while start < len(messages) - 1 and messages[start].get("role") == "assistant":
+        start += 1
+    return head + list(messages[start:])
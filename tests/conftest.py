@@ -0,0 +1,33 @@
+"""
+Fixtures comunes de las pruebas de `ollama_backend`.
+
+Las pruebas no necesitan Ollama: usan el servidor simulado
+(`benchmarks.fake_ollama`) y la CLI simulada (`benchmarks/bin/ollama`), los
+mismos que las pruebas de carga.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Permite importar `ollama_backend` y `benchmarks` desde la raíz del repo
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import FakeOllama, Profile  # noqa: E402
+
+
+@pytest.fixture
+def fake_ollama(monkeypatch):
+    """Servidor Ollama simulado y rápido; OLLAMA_HOST apunta a él."""
+    with FakeOllama(Profile(ttft=0.01, tps=1000, jitter=0, tokens=8)) as server:
+        monkeypatch.setenv("OLLAMA_HOST", server.url)
+        yield server
+
+
+@pytest.fixture
+def fake_cli(fake_ollama, monkeypatch):
+    """`ollama` simulado al principio de PATH, servido por `fake_ollama`."""
+    monkeypatch.setenv("PATH", os.path.join(ROOT, "benchmarks", "bin") + os.pathsep + os.environ.get("PATH", ""))
+    return fake_ollama
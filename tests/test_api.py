@@ -0,0 +1,71 @@
+"""Validación de las peticiones de la API compatible con OpenAI (TEST4)."""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "TEST4-GPT_API"))
+import test4_gpt_api as api  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def test_translates_openai_fields_to_backend_parameters():
+    request = api._parse_request(
+        {
+            "model": "qwen2.5",
+            "messages": [{"role": "user", "content": [{"type": "text", "text": "ho"}, {"type": "text", "text": "la"}]}],
+            "temperature": 0,
+            "seed": 7,
+            "max_tokens": 32,
+            "stop": "\n",
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        },
+        {"x-session-id": "s1"},
+    )
+    assert request["model"] == "qwen2.5"
+    assert request["messages"][-1] == {"role": "user", "content": "hola"}
+    assert request["options"] == {"temperature": 0, "seed": 7, "num_predict": 32, "stop": ["\n"]}
+    assert request["stream"] and request["include_usage"]
+    assert request["session_id"] == "s1"
+
+
+def test_defaults():
+    request = api._parse_request({"messages": MESSAGES}, {})
+    assert request["model"] == api.DEFAULT_MODEL
+    assert request["options"] is None and not request["stream"]
+    assert request["session_id"] is None
+    # max_completion_tokens tiene prioridad sobre max_tokens
+    body = {"messages": MESSAGES, "max_completion_tokens": 8, "max_tokens": 64}
+    assert api._parse_request(body, {})["options"] == {"num_predict": 8}
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        [],
+        {"messages": []},
+        {"messages": [{"role": "tool", "content": "x"}]},
+        {"messages": [{"role": "user", "content": 3}]},
+        {"messages": MESSAGES, "temperature": "0.2"},
+        {"messages": MESSAGES, "seed": 1.5},
+        {"messages": MESSAGES, "top_p": True},
+        {"messages": MESSAGES, "max_tokens": 0},
+        {"messages": MESSAGES, "stop": [1]},
+    ],
+)
+def test_rejects_invalid_requests(body):
+    with pytest.raises(api.InvalidRequest):
+        api._parse_request(body, {})
+
+
+def test_cli_backend_rejects_generation_options(monkeypatch):
+    monkeypatch.setattr(api, "API_BACKEND", "cli")
+    assert api._parse_request({"messages": MESSAGES}, {})["options"] is None
+    with pytest.raises(api.InvalidRequest):
+        api._parse_request({"messages": MESSAGES, "temperature": 0.2}, {})
@@ -0,0 +1,73 @@
+"""Caché de respuestas: caducidad, expulsión LRU, streams y nivel en SQLite."""
+
+from ollama_backend import cache as cache_module
+from ollama_backend.cache import ResponseCache
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(enabled=False)
+    cache.put("k", "respuesta")
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = ResponseCache(enabled=True, ttl=10)
+    cache.put("k", "respuesta")
+    assert cache.get("k") == "respuesta"
+
+    now = cache_module.time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 11)
+    assert cache.get("k") is None
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used():
+    cache = ResponseCache(enabled=True, max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    # "b" era la menos usada recientemente
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_by_total_chars():
+    cache = ResponseCache(enabled=True, max_chars=10)
+    cache.put("a", "x" * 6)
+    cache.put("b", "y" * 6)
+    assert cache.get("a") is None
+    assert cache.stats()["chars"] == 6
+    # Una respuesta que no cabe entera no se guarda
+    cache.put("c", "z" * 11)
+    assert cache.get("c") is None and cache.get("b") == "y" * 6
+
+
+def test_stream_records_complete_responses_only():
+    cache = ResponseCache(enabled=True)
+    calls = []
+
+    def _produce():
+        calls.append(1)
+        yield from ["hola ", "mundo"]
+
+    partial = cache.stream("k", _produce)
+    next(partial)
+    partial.close()
+    assert cache.get("k") is None
+
+    assert list(cache.stream("k", _produce)) == ["hola ", "mundo"]
+    assert "".join(cache.stream("k", _produce)) == "hola mundo"
+    assert len(calls) == 2
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(enabled=True, path=path).put("k", "respuesta")
+    cache = ResponseCache(enabled=True, path=path)
+    assert len(cache) == 0
+    assert cache.get("k") == "respuesta"
+    assert len(cache) == 1
@@ -0,0 +1,113 @@
+"""Cancelación de generaciones en curso y métricas del registro."""
+
+import asyncio
+import threading
+
+from ollama_backend.cancellation import CancellationRegistry, on_cancel
+
+
+def _words(n):
+    for i in range(n):
+        yield f"p{i} "
+
+
+def test_new_message_supersedes_the_previous_generation():
+    registry = CancellationRegistry()
+    first = registry.start("s")
+    second = registry.start("s")
+    assert first.cancelled and first.reason == "superseded"
+    assert not second.cancelled
+    # Otra sesión no se ve afectada
+    assert not registry.start("otra").cancelled
+
+
+def test_cancel_cuts_a_blocked_read_without_waiting_for_the_next_fragment():
+    registry = CancellationRegistry()
+    token = registry.start("s")
+    cut = threading.Event()
+
+    def _backend():
+        yield "hola"
+        # Como el proceso de la CLI o el socket: la cancelación corta la espera
+        on_cancel(cut.set)
+        if not cut.wait(5):
+            yield "tarde"
+        raise OSError("conexión cerrada")
+
+    with token:
+        stream = token.guard(_backend())
+        assert next(stream) == "hola"
+        threading.Timer(0.05, registry.cancel, args=("s",)).start()
+        # El corte provocado por la cancelación no se propaga como error
+        assert list(stream) == []
+    assert cut.is_set()
+    assert registry.stats()["cancelled"] == 1 and registry.stats()["in_flight"] == 0
+
+
+def test_abandoned_handler_cancels_and_closes_the_stream():
+    registry = CancellationRegistry()
+    closed = threading.Event()
+
+    def _backend():
+        try:
+            yield from _words(100)
+        finally:
+            closed.set()
+
+    def _handler():
+        with registry.start("s") as token:
+            for fragment in token.guard(_backend()):
+                yield fragment
+
+    handler = _handler()
+    next(handler)
+    # Gradio cierra el handler al desconectarse el cliente
+    handler.close()
+    assert closed.is_set()
+    assert registry.stats()["cancelled"] == 1
+
+
+def test_estimates_the_tokens_saved():
+    registry = CancellationRegistry()
+    with registry.start("s") as token:
+        assert len(list(token.guard(_words(10)))) == 10
+    with registry.start("s") as token:
+        stream = token.guard(_words(10))
+        next(stream)
+        token.cancel()
+        assert list(stream) == []
+    stats = registry.stats()
+    assert stats["completed"] == 1 and stats["cancelled"] == 1
+    assert 0 < registry.tokens_saved < registry.tokens_generated
+
+
+def test_aguard_abandons_the_pending_read():
+    async def _run():
+        registry = CancellationRegistry()
+        token = registry.start("s")
+        cancelled = asyncio.Event()
+
+        async def _backend():
+            yield "hola"
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            yield "tarde"
+
+        received = []
+        asyncio.get_running_loop().call_later(0.05, token.cancel)
+        with token:
+            async for fragment in token.aguard(_backend()):
+                received.append(fragment)
+        return received, cancelled.is_set()
+
+    assert asyncio.run(asyncio.wait_for(_run(), 2)) == (["hola"], True)
+
+
+def test_on_cancel_outside_a_generation_does_nothing():
+    called = []
+    remove = on_cancel(lambda: called.append(True))
+    remove()
+    assert called == []
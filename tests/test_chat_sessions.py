@@ -0,0 +1,101 @@
+"""Flujo de un turno de chat en las apps de Gradio: cola, cancelación y conversación de la sesión."""
+
+from ollama_backend.cancellation import CancellationRegistry
+from ollama_backend.chat_sessions import STOPPED, ChatSessions
+from ollama_backend.scheduler import Scheduler
+
+
+def _sessions(**kwargs):
+    kwargs.setdefault("scheduler", Scheduler(max_in_flight=2, max_queue=2))
+    kwargs.setdefault("cancellations", CancellationRegistry())
+    return ChatSessions(flush_interval=0, flush_chars=1, **kwargs)
+
+
+def _answer(*fragments):
+    def _produce(messages, state):
+        yield from fragments
+
+    return _produce
+
+
+def _contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_streams_the_turn_and_sends_the_history_once():
+    sessions = _sessions()
+    list(sessions.respond("s", "u0", _answer("a0")))
+    seen = []
+
+    def _produce(messages, state):
+        seen.append(_contents(messages))
+        yield from ["ho", "la"]
+
+    updates = list(sessions.respond("s", "u1", _produce, shown=20))
+    # Solo la primera actualización lleva los mensajes anteriores
+    assert updates[0] == ([("user", "u0"), ("assistant", "a0")], [("user", "u1"), ("assistant", "")])
+    assert all(older is None for older, _ in updates[1:])
+    assert updates[-1][1] == [("user", "u1"), ("assistant", "hola")]
+    assert seen == [["u0", "a0", "u1"]]
+    assert _contents(sessions.context.messages("s")) == ["u0", "a0", "u1", "hola"]
+
+
+def test_without_streaming_only_the_final_update_is_produced():
+    sessions = _sessions()
+    updates = list(sessions.respond("s", "u0", _answer("ho", "la"), stream=False))
+    assert updates == [([], [("user", "u0"), ("assistant", "hola")])]
+
+
+def test_full_queue_is_reported_in_the_chat():
+    scheduler = Scheduler(max_in_flight=1, max_queue=0)
+    sessions = _sessions(scheduler=scheduler)
+    with scheduler.enqueue("otra"):
+        updates = list(sessions.respond("s", "u0", _answer("a0")))
+    assert len(updates) == 1
+    role, content = updates[0][1][-1]
+    assert role == "assistant" and content.startswith("[Error]")
+    # El mensaje rechazado no llega al contexto del modelo
+    assert sessions.context.messages("s") == []
+
+
+def test_error_keeps_the_text_received_before_it():
+    sessions = _sessions()
+    updates = list(sessions.respond("s", "u0", _answer("ho", "la", {"error": "[Error] plazo vencido"})))
+    assert updates[-1][1][-1] == ("assistant", "hola\n\n[Error] plazo vencido")
+    # Al contexto del modelo solo va el texto
+    assert _contents(sessions.context.messages("s")) == ["u0", "hola"]
+
+
+def test_stop_keeps_the_partial_answer():
+    sessions = _sessions()
+
+    def _produce(messages, state):
+        yield "hola "
+        sessions.stop("s")
+        # Como el `ollama run` o el socket: la cancelación corta la lectura
+        raise OSError("conexión cerrada")
+
+    updates = list(sessions.respond("s", "u0", _produce))
+    assert updates[-1][1][-1] == ("assistant", f"hola\n\n{STOPPED}")
+    assert _contents(sessions.context.messages("s")) == ["u0", "hola"]
+
+
+def test_superseded_turn_stops_without_touching_the_chat():
+    sessions = _sessions()
+    first = sessions.respond("s", "u0", _answer("a0"))
+    next(first)
+    # Otro mensaje de la misma sesión sustituye al primero y pinta el chat
+    list(sessions.respond("s", "u1", _answer("a1")))
+    assert list(first) == []
+    assert sessions.transcripts.messages("s")[1] == ("assistant", STOPPED)
+
+
+def test_end_frees_the_session():
+    sessions = _sessions()
+    list(sessions.respond("s", "u0", _answer("a0")))
+    sessions.end("s")
+    assert sessions.transcripts.messages("s") == []
+    assert sessions.context.messages("s") == []
+    # Un chat vacío empieza conversación nueva
+    list(sessions.respond("s", "u1", _answer("a1")))
+    assert _contents(sessions.context.messages("s")) == ["u1", "a1"]
@@ -0,0 +1,119 @@
+"""Pool de procesos `ollama run` contra la CLI simulada."""
+
+import os
+import stat
+import sys
+
+import pytest
+
+from ollama_backend import cli_pool
+from ollama_backend.cli_pool import CLIWorkerPool
+
+pytestmark = pytest.mark.skipif(not cli_pool._HAS_PTY, reason="el pool necesita pseudo-terminales (pty)")
+
+MODEL = "llama3.2"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# CLI simulada cuya respuesta incluye una línea `>>> ` (ejemplo de la consola de
+# Python) y se para justo después, como si la lectura cortara ahí
+_REPL_CLI = """#!{python}
+import sys
+import time
+
+sys.path.insert(0, {root!r})
+from benchmarks import fake_cli
+
+
+def generate(host, model, prompt, keep_alive=None):
+    yield "Ejemplo en Python:\\r\\n>>> "
+    time.sleep(0.5)
+    yield "print(1)\\r\\n1"
+
+
+fake_cli.generate = generate
+sys.exit(fake_cli.main())
+"""
+
+
+@pytest.fixture
+def pool(fake_cli):
+    pools = []
+
+    def _make(**kwargs):
+        pools.append(CLIWorkerPool(MODEL, **kwargs))
+        return pools[-1]
+
+    yield _make
+    for p in pools:
+        p.close()
+
+
+def test_reuses_worker_across_requests(pool, fake_cli):
+    p = pool(size=1)
+    assert p.run("hola").startswith("respuesta simulada")
+    worker = p._idle[0]
+    assert p.run("otra vez").startswith("respuesta simulada")
+    assert p._idle == [worker]
+    assert worker.requests_served == 2
+    assert fake_cli.requests == 2
+
+
+def test_recycles_worker_after_max_requests(pool):
+    p = pool(size=1, max_requests=2)
+    p.run("uno")
+    first = p._idle[0]
+    p.run("dos")
+    # Llegó al máximo de peticiones: se cierra en vez de volver al pool
+    assert p._idle == []
+    assert p._total == 0
+    assert not first.is_alive()
+    p.run("tres")
+    assert p._idle[0] is not first
+    assert p._idle[0].requests_served == 1
+
+
+def test_replaces_crashed_worker(pool):
+    p = pool(size=1)
+    p.run("hola")
+    crashed = p._idle[0]
+    crashed._proc.kill()
+    crashed._proc.wait()
+    assert p.run("sigue ahí?").startswith("respuesta simulada")
+    assert p._idle[0] is not crashed
+    assert p._total == 1
+
+
+def test_abandoned_stream_discards_worker(pool):
+    p = pool(size=1)
+    p.run("hola")
+    worker = p._idle[0]
+    stream = p.stream("otra")
+    assert next(stream)
+    # Respuesta leída a medias: el worker queda en mitad de una respuesta
+    stream.close()
+    assert p._idle == []
+    assert p._total == 0
+    assert not worker.is_alive()
+    assert p.run("de nuevo").startswith("respuesta simulada")
+
+
+@pytest.fixture
+def repl_cli(tmp_path, monkeypatch):
+    script = tmp_path / "ollama"
+    script.write_text(_REPL_CLI.format(python=sys.executable, root=ROOT))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ.get("PATH", ""))
+
+
+def test_prompt_like_line_inside_an_answer(repl_cli):
+    p = CLIWorkerPool(MODEL, size=1)
+    try:
+        expected = "Ejemplo en Python:\n>>> print(1)\n1"
+        assert p.run("primera") == expected
+        # El worker volvió al pool al terminar de verdad: nada de la respuesta
+        # anterior se cuela en la siguiente
+        assert p.run("segunda") == expected
+        assert p._idle[0].requests_served == 2
+    finally:
+        p.close()
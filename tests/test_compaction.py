@@ -0,0 +1,112 @@
+"""Compactación en segundo plano: resumen de los turnos antiguos sin perder ninguno."""
+
+import threading
+import time
+
+from ollama_backend.compaction import Compactor
+from ollama_backend.history import SessionHistoryStore
+from ollama_backend.scheduler import Scheduler
+
+BUDGET = 100000
+
+
+class _Summarizer:
+    """Resume concatenando los mensajes; espera a `gate` si se le pide."""
+
+    def __init__(self, blocked=False):
+        self.gate = threading.Event()
+        if not blocked:
+            self.gate.set()
+        self.calls = []
+
+    def __call__(self, previous, messages):
+        self.calls.append([m["content"] for m in messages])
+        self.gate.wait(5)
+        return " ".join(([previous] if previous else []) + [m["content"] for m in messages])
+
+
+def _wait(compactor, store):
+    # Un único thread de trabajo: cada tarea vacía termina después del resumen en curso
+    while True:
+        compactor._executor.submit(lambda: None).result(5)
+        if not store._sessions["s"].compacting:
+            return
+
+
+def _turn(store, i):
+    store.append("s", "user", f"u{i}")
+    store.append("s", "assistant", f"a{i}")
+
+
+def _contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_summarizes_old_turns_before_the_turn_limit():
+    summarizer = _Summarizer()
+    compactor = Compactor(summarizer, threshold=0.75, scheduler=Scheduler())
+    store = SessionHistoryStore(max_turns=4, token_budget=BUDGET, compactor=compactor)
+    for i in range(3):
+        _turn(store, i)
+    _wait(compactor, store)
+    # 6 mensajes >= 0.75 * 8: se resume antes de tener que recortar
+    assert compactor.compactions == 1
+    assert _contents(store.history("s")) == ["u1", "a1", "u2", "a2"]
+    assert store.messages("s")[0]["content"].endswith("u0 a0")
+
+
+def test_next_message_during_a_summary_does_not_lose_turns():
+    summarizer = _Summarizer(blocked=True)
+    compactor = Compactor(summarizer, threshold=0.75, scheduler=Scheduler())
+    store = SessionHistoryStore(max_turns=3, token_budget=BUDGET, compactor=compactor)
+    # El resumen sigue en curso mientras llegan más turnos
+    for i in range(6):
+        _turn(store, i)
+    summarizer.gate.set()
+    _wait(compactor, store)
+    _turn(store, 6)
+    _wait(compactor, store)
+
+    assert compactor.compactions >= 2 and compactor.failures == 0
+    summary = store.messages("s")[0]["content"]
+    history = _contents(store.history("s"))
+    assert history[0].startswith("u") and len(history) <= 6
+    # Cada turno está literal o en el resumen
+    for i in range(7):
+        assert f"u{i}" in history or f"u{i}" in summary
+
+
+def test_one_compaction_per_window_at_a_time():
+    summarizer = _Summarizer(blocked=True)
+    compactor = Compactor(summarizer, threshold=0.75, scheduler=Scheduler())
+    store = SessionHistoryStore(max_turns=2, token_budget=BUDGET, compactor=compactor)
+    for i in range(4):
+        _turn(store, i)
+    deadline = time.monotonic() + 5
+    while not summarizer.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(summarizer.calls) == 1
+    summarizer.gate.set()
+    _wait(compactor, store)
+    # Los turnos que llegaron durante el primer resumen van en el siguiente
+    assert summarizer.calls == [["u0", "a0"], ["u1", "a1", "u2", "a2"]]
+    assert compactor.compactions == 2
+
+
+def test_full_queue_skips_without_counting_a_failure(capsys):
+    scheduler = Scheduler(max_in_flight=1, max_queue=0)
+    busy = scheduler.enqueue("otra")
+    summarizer = _Summarizer()
+    compactor = Compactor(summarizer, threshold=0.75, scheduler=scheduler)
+    store = SessionHistoryStore(max_turns=4, token_budget=BUDGET, compactor=compactor)
+    for i in range(3):
+        _turn(store, i)
+    _wait(compactor, store)
+    assert compactor.skipped == 1 and compactor.failures == 0
+    assert summarizer.calls == [] and "Error" not in capsys.readouterr().out
+
+    # Con hueco libre se resume tras la siguiente respuesta
+    busy.release()
+    _turn(store, 3)
+    _wait(compactor, store)
+    assert compactor.compactions == 1
@@ -0,0 +1,81 @@
+"""Plazos de los streams: primer fragmento, hueco entre fragmentos y total."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ollama_backend.cancellation import CancelToken, Cancelled
+from ollama_backend.deadlines import DeadlineExceeded, Deadlines, aenforce, enforce
+
+
+def _stream(first, gap, count=100):
+    """Fragmentos 0, 1, ... tras esperar `first` s el primero y `gap` s cada uno de los demás."""
+    time.sleep(first)
+    for i in range(count):
+        if i:
+            time.sleep(gap)
+        yield i
+
+
+def _read(stream):
+    items = []
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as exc:
+        for item in stream:
+            items.append(item)
+    return items, exc.value, time.monotonic() - started
+
+
+def test_ttft_deadline():
+    items, error, elapsed = _read(enforce(_stream(first=2, gap=0), Deadlines(ttft=0.1, stall=None, total=None)))
+    assert items == []
+    assert error.kind == "ttft"
+    assert elapsed < 1
+
+
+def test_stall_deadline_keeps_received_items():
+    items, error, elapsed = _read(enforce(_stream(first=0, gap=2, count=3), Deadlines(ttft=1, stall=0.1, total=None)))
+    assert items == [0]
+    assert error.kind == "stall"
+    assert elapsed < 1
+
+
+def test_total_deadline():
+    items, error, elapsed = _read(enforce(_stream(first=0, gap=0.02), Deadlines(ttft=1, stall=1, total=0.2)))
+    assert items
+    assert error.kind == "total"
+    assert elapsed < 1
+
+
+def test_stream_within_deadlines_is_untouched():
+    assert list(enforce(_stream(first=0, gap=0.01, count=5), Deadlines(ttft=1, stall=1, total=5))) == [0, 1, 2, 3, 4]
+
+
+def test_cancel_stops_waiting_for_the_first_item():
+    token = CancelToken("s")
+    with token.active():
+        stream = enforce(_stream(first=2, gap=0), Deadlines(ttft=5, stall=None, total=None))
+        started = time.monotonic()
+        threading.Timer(0.1, token.cancel).start()
+        with pytest.raises(Cancelled):
+            next(stream)
+    assert time.monotonic() - started < 1
+
+
+def test_async_ttft_deadline():
+    async def _slow():
+        await asyncio.sleep(2)
+        yield 0
+
+    async def _main():
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded) as exc:
+            async for _item in aenforce(_slow(), Deadlines(ttft=0.1, stall=None, total=None)):
+                pass
+        return exc.value.kind, time.monotonic() - started
+
+    kind, elapsed = asyncio.run(_main())
+    assert kind == "ttft"
+    assert elapsed < 1
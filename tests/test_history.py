@@ -0,0 +1,98 @@
+"""Historial por sesión (límite de turnos, resumen de los antiguos y expiración) y conversación visible."""
+
+import time
+
+from ollama_backend.history import Conversation, SessionHistoryStore, TranscriptStore
+
+BUDGET = 100000
+
+
+def _conversation(max_turns, turns):
+    conv = Conversation(max_turns, BUDGET)
+    for i in range(turns):
+        conv.add("user", f"u{i}")
+        conv.add("assistant", f"a{i}")
+    return conv
+
+
+def _contents(messages):
+    return [m["content"] for m in messages]
+
+
+def test_turn_limit_drops_whole_turns():
+    conv = _conversation(max_turns=3, turns=3)
+    conv.add("user", "u3")
+    # Sin respuesta huérfana del assistant al principio
+    assert _contents(conv.history()) == ["u1", "a1", "u2", "a2", "u3"]
+    conv.add("assistant", "a3")
+    assert _contents(conv.history()) == ["u1", "a1", "u2", "a2", "u3", "a3"]
+
+
+def test_oldest_cuts_on_a_turn_boundary_with_odd_max_turns():
+    conv = _conversation(max_turns=3, turns=3)
+    # Por tokens no sobra nada, pero por turnos se resume hasta quedar en la mitad
+    compacted = conv.oldest(BUDGET)
+    assert _contents(compacted) == ["u0", "a0", "u1", "a1"]
+    conv.apply_summary(compacted, "Resumen")
+    assert _contents(conv.messages())[1:] == ["u2", "a2"]
+    assert conv.history()[0]["role"] == "user"
+
+
+def test_sessions_are_independent():
+    store = SessionHistoryStore(max_turns=5, token_budget=BUDGET, system_prompt="Eres útil.")
+    store.append("a", "user", "hola")
+    store.append("b", "user", "adiós")
+    assert _contents(store.messages("a")) == ["Eres útil.", "hola"]
+    assert _contents(store.history("b")) == ["adiós"]
+    assert _contents(store.messages("nueva")) == ["Eres útil."]
+
+
+def test_idle_sessions_expire():
+    store = SessionHistoryStore(max_turns=5, token_budget=BUDGET, idle_ttl=0.05)
+    store.append("a", "user", "hola")
+    time.sleep(0.1)
+    store.append("b", "user", "hola")
+    assert store.history("a") == []
+    assert len(store) == 1
+
+
+def test_memory_limit_drops_least_recently_used_sessions():
+    store = SessionHistoryStore(max_turns=5, token_budget=BUDGET, max_total_chars=10)
+    store.append("a", "user", "x" * 6)
+    store.append("b", "user", "y" * 6)
+    assert store.total_chars == 6
+    assert store.history("a") == []
+    assert _contents(store.history("b")) == ["y" * 6]
+
+
+def test_transcript_updates_the_answer_in_place():
+    store = TranscriptStore()
+    store.append("s", "user", "hola")
+    index = store.append("s", "assistant", "")
+    for partial in ("Ho", "Hola, ", "Hola, ¿qué tal?"):
+        store.update("s", index, partial)
+    assert store.messages("s") == [("user", "hola"), ("assistant", "Hola, ¿qué tal?")]
+    assert store.total_chars == len("hola") + len("Hola, ¿qué tal?")
+
+
+def test_transcript_pages_and_current_turn():
+    store = TranscriptStore()
+    for i in range(3):
+        store.append("s", "user", f"u{i}")
+        store.append("s", "assistant", f"a{i}")
+    store.append("s", "user", "u3")
+    start = store.turn_start("s")
+    assert start == 6
+    assert store.messages("s", start) == [("user", "u3")]
+    assert store.messages("s", 2, 4) == [("user", "u1"), ("assistant", "a1")]
+    assert store.turn_start("nueva") == 0
+
+
+def test_transcript_update_after_the_session_is_gone():
+    store = TranscriptStore(max_total_chars=10)
+    index = store.append("a", "assistant", "x" * 6)
+    store.append("b", "user", "y" * 6)
+    # "a" se eliminó por el límite de memoria mientras llegaba su respuesta
+    store.update("a", index, "x" * 8)
+    assert store.messages("a") == []
+    assert store.total_chars == 6
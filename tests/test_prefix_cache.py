@@ -0,0 +1,75 @@
+"""Reutilización del `context` de /api/generate entre turnos."""
+
+from ollama_backend import prefix_cache
+from ollama_backend.prefix_cache import ContextSession
+
+MODEL = "llama3.2"
+SYSTEM = {"role": "system", "content": "Eres útil."}
+
+
+def _user(content):
+    return {"role": "user", "content": content}
+
+
+def _assistant(content):
+    return {"role": "assistant", "content": content}
+
+
+def test_first_turn_sends_the_whole_conversation():
+    session = ContextSession()
+    assert session.plan(MODEL, [SYSTEM, _user("hola")]) == ("hola", "Eres útil.", None)
+    messages = [_user("hola"), _assistant("buenas"), _user("¿qué tal?")]
+    assert session.plan(MODEL, messages) == ("user: hola\nassistant: buenas\nuser: ¿qué tal?\nassistant:", None, None)
+
+
+def test_next_turn_sends_only_the_new_message():
+    session = ContextSession()
+    first = [SYSTEM, _user("hola")]
+    session.commit(MODEL, first, " buenas\n", [1, 2, 3])
+    # La app guarda la respuesta recortada: se compara sin espacios extremos
+    messages = first + [_assistant("buenas"), _user("¿qué tal?")]
+    assert session.plan(MODEL, messages) == ("¿qué tal?", "Eres útil.", [1, 2, 3])
+
+
+def test_changed_history_drops_the_context():
+    session = ContextSession()
+    first = [SYSTEM, _user("hola")]
+    session.commit(MODEL, first, "buenas", [1, 2, 3])
+    follow_up = [_assistant("buenas"), _user("¿qué tal?")]
+    # Otro modelo, otro system prompt o un turno antiguo recortado
+    assert session.plan("otro", first + follow_up)[2] is None
+    assert session.plan(MODEL, [{"role": "system", "content": "Otro."}, _user("hola")] + follow_up)[2] is None
+    assert session.plan(MODEL, [SYSTEM] + follow_up)[2] is None
+    # Y no se vuelve a usar aunque el historial vuelva a coincidir
+    assert session.plan(MODEL, first + follow_up)[2] is None
+
+
+class _GenerateClient:
+    """Cliente con `generate` en streaming que devuelve `context` al terminar."""
+
+    def __init__(self):
+        self.requests = []
+
+    def generate(self, **kwargs):
+        self.requests.append(kwargs)
+        n = len(self.requests)
+        yield {"response": f"respuesta {n}", "done": False}
+        yield {"response": "", "done": True, "context": [n] * 3, "eval_count": 2}
+
+
+def test_chat_reuses_the_context_across_turns():
+    client = _GenerateClient()
+    state = {}
+    messages = [SYSTEM, _user("hola")]
+    for question in ("¿qué tal?", "adiós"):
+        reply = prefix_cache.chat(
+            MODEL, messages, client=client, state=state, reuse_context=True, use_cache=False
+        )
+        assert reply["message"]["content"].startswith("respuesta")
+        messages = messages + [_assistant(reply["message"]["content"]), _user(question)]
+    chunks = prefix_cache.chat(
+        MODEL, messages, stream=True, client=client, state=state, reuse_context=True, use_cache=False
+    )
+    assert "".join(c["message"]["content"] for c in chunks) == "respuesta 3"
+    assert [r["prompt"] for r in client.requests] == ["hola", "¿qué tal?", "adiós"]
+    assert [r["context"] for r in client.requests] == [None, [1, 1, 1], [2, 2, 2]]
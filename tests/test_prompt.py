@@ -0,0 +1,55 @@
+"""Prompt de texto plano para la CLI, construido de forma incremental."""
+
+from ollama_backend.history import SessionHistoryStore
+from ollama_backend.prompt import PromptBuilder
+
+
+class _Render:
+    """Renderiza "Rol: contenido" y cuenta los mensajes renderizados."""
+
+    def __init__(self):
+        self.rendered = 0
+
+    def __call__(self, message):
+        self.rendered += 1
+        return f"{message['role'].capitalize()}: {message['content']}"
+
+
+def test_renders_only_the_new_messages():
+    render = _Render()
+    builder = PromptBuilder(render, suffix="\nAssistant:")
+    store = SessionHistoryStore(max_turns=10, token_budget=100000, system_prompt="Eres útil.")
+    store.append("s", "user", "hola")
+    assert builder.build(store.messages("s")) == "System: Eres útil.\nUser: hola\nAssistant:"
+    store.append("s", "assistant", "buenas")
+    store.append("s", "user", "¿qué tal?")
+    assert builder.build(store.messages("s")) == (
+        "System: Eres útil.\nUser: hola\nAssistant: buenas\nUser: ¿qué tal?\nAssistant:"
+    )
+    assert render.rendered == 4
+    assert builder.rebuilds == 0
+
+
+def test_rebuilds_once_when_the_window_start_changes():
+    render = _Render()
+    builder = PromptBuilder(render)
+    store = SessionHistoryStore(max_turns=1, token_budget=100000)
+    store.append("s", "user", "u0")
+    store.append("s", "assistant", "a0")
+    builder.build(store.messages("s"))
+    # Se recorta el turno antiguo: el prefijo ya no vale
+    store.append("s", "user", "u1")
+    assert builder.build(store.messages("s")) == "User: u1"
+    assert builder.rebuilds == 1
+    store.append("s", "assistant", "a1")
+    assert builder.build(store.messages("s")) == "User: u1\nAssistant: a1"
+    assert builder.rebuilds == 1
+    assert render.rendered == 4
+
+
+def test_equal_but_new_messages_are_not_reused():
+    builder = PromptBuilder(_Render())
+    builder.build([{"role": "user", "content": "hola"}])
+    # Mismo texto pero otro mensaje (p. ej. otra sesión): se reconoce por identidad
+    assert builder.build([{"role": "user", "content": "hola"}]) == "User: hola"
+    assert builder.rebuilds == 1
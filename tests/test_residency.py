@@ -0,0 +1,63 @@
+"""Modelos residentes: `keep_alive`, precarga y descarga LRU con presupuesto de memoria."""
+
+from benchmarks.fake_ollama import MODEL_SIZE
+from ollama_backend import residency
+from ollama_backend.residency import PINNED_KEEP_ALIVE, ResidencyManager
+from ollama_backend.router import Router
+
+GB = 1024**3
+
+
+def _manager(server, **kwargs):
+    router = Router([server.url], health_interval=0)
+    manager = router.residency = ResidencyManager(router, **kwargs)
+    return manager, router.backends[0]
+
+
+def _loaded(server):
+    return sorted(name.split(":")[0] for name in server.loaded)
+
+
+def test_keep_alive_pins_preloaded_models_only():
+    manager = ResidencyManager(Router(["a:1"], health_interval=0), preload=["llama3.2"])
+    assert manager.keep_alive("llama3.2:latest") == PINNED_KEEP_ALIVE
+    assert manager.keep_alive("otro") == residency.KEEP_ALIVE
+    # Con presupuesto es el gestor quien descarga: todo queda fijado
+    manager = ResidencyManager(Router(["a:1"], health_interval=0), budget_gb=8)
+    assert manager.keep_alive("otro") == PINNED_KEEP_ALIVE
+
+
+def test_unloads_the_least_recently_used_model(fake_ollama):
+    manager, backend = _manager(fake_ollama, budget_gb=1.5 * MODEL_SIZE / GB)
+    for model in ("m1", "m2"):
+        assert manager._load(backend, model) is not None
+    manager.touch(backend, "m1")
+    manager.release(backend, "m1")
+    manager._load(backend, "m3")
+    assert _loaded(fake_ollama) == ["m1", "m3"]
+    assert manager.unloads == 1
+    assert manager.stats()["load_times"]["m3:latest"]["loads"] == 1
+
+
+def test_never_unloads_busy_or_pinned_models(fake_ollama):
+    manager, backend = _manager(fake_ollama, preload=["m0"], budget_gb=2.5 * MODEL_SIZE / GB)
+    for model in ("m0", "m1", "m2"):
+        manager._load(backend, model)
+    # m1 es el menos usado, pero tiene una petición en curso
+    manager.touch(backend, "m1")
+    manager.touch(backend, "m2")
+    manager.release(backend, "m2")
+    manager._load(backend, "m3")
+    assert _loaded(fake_ollama) == ["m0", "m1", "m3"]
+    # Terminada la petición, ya se puede descargar
+    manager.release(backend, "m1")
+    manager._load(backend, "m4")
+    assert _loaded(fake_ollama) == ["m0", "m3", "m4"]
+
+
+def test_counts_cold_starts(fake_ollama):
+    manager, backend = _manager(fake_ollama)
+    manager._load(backend, "m1")
+    manager.touch(backend, "m1")
+    manager.touch(backend, "m2")
+    assert manager.stats()["cold_starts"] == 1
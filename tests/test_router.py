@@ -0,0 +1,173 @@
+"""Router: reparto entre servidores, reintento en otro si no conecta, expulsión y cobertura."""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from ollama_backend.cancellation import CancelToken, on_cancel
+from ollama_backend.deadlines import DeadlineExceeded, Deadlines
+from ollama_backend.router import Router
+
+MODEL = "llama3.2"
+
+
+def _router(**kwargs):
+    kwargs.setdefault("health_interval", 0)
+    kwargs.setdefault("deadlines", Deadlines(ttft=None, stall=None, total=None))
+    return Router(["a:1", "b:2"], **kwargs)
+
+
+def _down(host):
+    """`produce` que no conecta con `host` y responde "ok" en los demás."""
+
+    def _produce(backend):
+        if backend.host == host:
+            raise ConnectionError(f"{host} no responde")
+        yield "ok"
+
+    return _produce
+
+
+def test_prefers_the_backend_with_the_model_loaded():
+    router = _router()
+    a, _b = router.backends
+    router._done(router.pick(MODEL), MODEL)
+    assert MODEL in a.models
+    for _ in range(3):
+        backend = router.pick(MODEL)
+        router._done(backend, MODEL)
+        assert backend is a
+
+
+def test_rotates_between_equivalent_backends():
+    router = _router()
+    for backend in [router.pick(MODEL), router.pick(MODEL)]:
+        router._done(backend, MODEL)
+    hosts = []
+    for _ in range(4):
+        backend = router.pick(MODEL)
+        hosts.append(backend.host)
+        router._done(backend, MODEL)
+    assert hosts == ["a:1", "b:2", "a:1", "b:2"]
+
+
+def test_fails_over_when_a_backend_does_not_connect():
+    router = _router()
+    a, b = router.backends
+    assert list(router.stream(MODEL, _down("a:1"))) == ["ok"]
+    assert router.retried == 1
+    assert not a.healthy and a.failures == 1
+    assert b.served == 1
+    assert a.outstanding == b.outstanding == 0
+
+    # Mientras no vuelva a estar sano, no se le envía nada
+    assert router.call(MODEL, lambda backend: backend.host) == "b:2"
+    assert router.retried == 1
+
+
+def test_raises_when_every_backend_is_down():
+    router = _router()
+
+    def _produce(backend):
+        raise ConnectionError(f"{backend.host} no responde")
+        yield
+
+    with pytest.raises(ConnectionError):
+        list(router.stream(MODEL, _produce))
+    assert all(b.failures == 1 for b in router.backends)
+    assert router.retried == 1
+
+
+def test_no_retry_once_the_stream_started():
+    router = _router()
+    calls = []
+
+    def _produce(backend):
+        calls.append(backend.host)
+        yield "parcial"
+        raise ConnectionError("conexión cortada")
+
+    stream = router.stream(MODEL, _produce)
+    assert next(stream) == "parcial"
+    with pytest.raises(ConnectionError):
+        next(stream)
+    # Repetirla en otro servidor duplicaría el texto ya entregado
+    assert len(calls) == 1
+
+
+def test_stalled_backend_is_expelled():
+    router = _router(deadlines=Deadlines(ttft=0.1, stall=None, total=None))
+    a, _b = router.backends
+
+    def _produce(backend):
+        if backend is a:
+            time.sleep(1)
+        yield backend.host
+
+    with pytest.raises(DeadlineExceeded):
+        list(router.stream(MODEL, _produce))
+    assert not a.healthy
+    assert router.stats()["deadlines_exceeded"] == 1
+    assert list(router.stream(MODEL, _produce)) == ["b:2"]
+
+
+def test_fails_over_to_a_live_server(fake_ollama):
+    pytest.importorskip("ollama")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        dead = f"127.0.0.1:{s.getsockname()[1]}"
+    router = Router([dead, fake_ollama.url], health_interval=0)
+    messages = [{"role": "user", "content": "hola"}]
+    reply = router.call(MODEL, lambda backend: backend.client().chat(model=MODEL, messages=messages))
+    assert reply.message.content.startswith("respuesta simulada")
+    assert not router.backends[0].healthy
+    assert fake_ollama.requests == 1
+
+
+class _SlowFirstToken:
+    """`produce` en el que "a:1" no responde hasta que se corta su petición."""
+
+    def __init__(self):
+        self.cut = threading.Event()
+
+    def __call__(self, backend):
+        if backend.host == "a:1":
+            # Como `_abort_on_cancel`: la cancelación cierra la conexión y la lectura falla
+            on_cancel(self.cut.set)
+            if not self.cut.wait(5):
+                yield "a:1"
+            raise ConnectionResetError("conexión cerrada")
+        yield backend.host
+
+
+def _idle(router):
+    deadline = time.monotonic() + 5
+    while any(b.outstanding for b in router.backends) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_hedge_cuts_the_losing_request_right_away():
+    router = _router(hedge=True, hedge_delay=0.05)
+    a, _b = router.backends
+    produce = _SlowFirstToken()
+    assert list(router.stream(MODEL, produce)) == ["b:2"]
+    assert router.hedged == router.hedge_wins == 1
+    # La perdedora no espera a su siguiente fragmento para soltar el servidor
+    assert produce.cut.wait(1)
+    _idle(router)
+    assert a.outstanding == 0
+    # El corte no cuenta como fallo del servidor
+    assert a.healthy and a.failures == 0
+
+
+def test_cancelling_a_hedged_stream_cuts_every_request():
+    router = _router(hedge=True, hedge_delay=10)
+    produce = _SlowFirstToken()
+    token = CancelToken("s")
+    threading.Timer(0.1, token.cancel).start()
+    assert list(token.guard(router.stream(MODEL, produce))) == []
+    assert produce.cut.wait(1)
+    _idle(router)
+    assert router.backends[0].healthy
@@ -0,0 +1,79 @@
+"""Planificador: límite de generaciones, cola acotada y reparto por sesiones."""
+
+import asyncio
+import threading
+
+import pytest
+
+from ollama_backend.scheduler import QueueFull, Scheduler
+
+
+def test_grants_up_to_max_in_flight():
+    scheduler = Scheduler(max_in_flight=2, max_queue=4)
+    first, second, third = (scheduler.enqueue(s) for s in ("a", "b", "c"))
+    assert first.granted and second.granted
+    assert not third.granted and third.position == 1
+    first.release()
+    assert third.granted
+    assert scheduler.stats()["in_flight"] == 2
+
+
+def test_round_robin_between_sessions():
+    scheduler = Scheduler(max_in_flight=1, max_queue=10)
+    running = scheduler.enqueue("a")
+    a1, a2, a3 = (scheduler.enqueue("a") for _ in range(3))
+    b1 = scheduler.enqueue("b")
+    # b1 no espera a que termine toda la ráfaga de "a"
+    assert [t.position for t in (a1, b1, a2, a3)] == [1, 2, 3, 4]
+
+    order = []
+    current = running
+    for _ in range(4):
+        current.release()
+        current = next(t for t in (a1, a2, a3, b1) if t.granted and not t.released)
+        order.append(current)
+    assert order == [a1, b1, a2, a3]
+
+
+def test_rejects_when_queue_is_full():
+    scheduler = Scheduler(max_in_flight=1, max_queue=2)
+    running = scheduler.enqueue("a")
+    queued = [scheduler.enqueue("b"), scheduler.enqueue("c")]
+    with pytest.raises(QueueFull):
+        scheduler.enqueue("d")
+    assert scheduler.stats()["rejected"] == 1
+
+    # Retirarse de la cola libera su sitio
+    queued[0].release()
+    assert scheduler.enqueue("d").position == 2
+    running.release()
+    assert queued[1].granted
+
+
+def test_release_is_idempotent():
+    scheduler = Scheduler(max_in_flight=1, max_queue=2)
+    ticket = scheduler.enqueue("a")
+    waiting = scheduler.enqueue("b")
+    ticket.release()
+    ticket.release()
+    assert scheduler.in_flight == 1
+    assert waiting.granted
+
+
+def test_await_turn_wakes_when_released_from_another_thread():
+    scheduler = Scheduler(max_in_flight=1, max_queue=2)
+    running = scheduler.enqueue("a")
+    waiting = scheduler.enqueue("b")
+
+    async def _wait():
+        positions = [p async for p in waiting.await_turn(interval=5)]
+        return positions
+
+    async def _main():
+        task = asyncio.ensure_future(_wait())
+        await asyncio.sleep(0.05)
+        threading.Thread(target=running.release).start()
+        return await asyncio.wait_for(task, 2)
+
+    assert asyncio.run(_main()) == [1]
+    assert waiting.granted
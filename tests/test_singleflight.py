@@ -0,0 +1,131 @@
+"""Deduplicación de generaciones en curso: reparto, suscriptores que se van y cancelación."""
+
+import asyncio
+import threading
+
+import pytest
+
+from ollama_backend.cancellation import CancelToken, Cancelled, on_cancel
+from ollama_backend.singleflight import SingleFlight
+
+
+class _Generation:
+    """Generación de prueba: produce 1, espera a `gate` y después 2 y 3."""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = threading.Event()
+        self.aborted = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        # Se registra en la generación activa, que es la compartida
+        on_cancel(self.aborted.set)
+        yield 1
+        self.gate.wait(5)
+        yield 2
+        yield 3
+
+
+def test_fans_out_one_generation_to_all_subscribers():
+    sf = SingleFlight(enabled=True)
+    generation = _Generation()
+    leader = sf.stream("k", generation)
+    assert next(leader) == 1
+    # Quien llega tarde recibe primero lo ya generado
+    follower = sf.stream("k", generation)
+    assert next(follower) == 1
+    generation.gate.set()
+    assert list(leader) == [2, 3]
+    assert list(follower) == [2, 3]
+    assert generation.calls == 1
+    assert sf.stats()["joined"] == 1
+    assert sf.in_flight == 0
+
+
+def test_cancelled_follower_detaches_without_stopping_the_leader():
+    sf = SingleFlight(enabled=True)
+    generation = _Generation()
+    leader = sf.stream("k", generation)
+    assert next(leader) == 1
+    token = CancelToken("follower")
+    follower = sf.stream("k", generation)
+    with token.active():
+        assert next(follower) == 1
+    token.cancel()
+    with pytest.raises(Cancelled):
+        next(follower)
+
+    generation.gate.set()
+    assert list(leader) == [2, 3]
+    assert not generation.aborted.is_set()
+
+
+def test_last_subscriber_leaving_cancels_the_generation():
+    sf = SingleFlight(enabled=True)
+    generation = _Generation()
+    first, second = sf.stream("k", generation), sf.stream("k", generation)
+    assert next(first) == 1 and next(second) == 1
+    first.close()
+    assert not generation.aborted.is_set()
+    second.close()
+    assert generation.aborted.wait(2)
+    assert sf.in_flight == 0
+    generation.gate.set()
+
+    # La siguiente petición con la misma clave empieza una generación nueva
+    assert list(sf.stream("k", lambda: iter("ab"))) == ["a", "b"]
+
+
+def test_error_reaches_every_subscriber():
+    sf = SingleFlight(enabled=True)
+    gate = threading.Event()
+
+    def _failing():
+        yield 1
+        gate.wait(5)
+        raise ConnectionError("caído")
+
+    first, second = sf.stream("k", _failing), sf.stream("k", _failing)
+    assert next(first) == 1 and next(second) == 1
+    gate.set()
+    for stream in (first, second):
+        with pytest.raises(ConnectionError):
+            list(stream)
+
+
+def test_bypass_does_not_share():
+    sf = SingleFlight(enabled=True)
+    generation = _Generation()
+    generation.gate.set()
+    assert list(sf.stream("k", generation, bypass=True)) == [1, 2, 3]
+    assert list(sf.stream("k", generation, bypass=True)) == [1, 2, 3]
+    assert generation.calls == 2
+    assert sf.stats()["flights"] == 0
+
+
+def test_async_fan_out_and_detach():
+    sf = SingleFlight(enabled=True)
+    calls = []
+
+    async def _produce():
+        calls.append(1)
+        for i in range(3):
+            await asyncio.sleep(0.02)
+            yield i
+
+    async def _read(limit=None):
+        items = []
+        async for item in sf.astream("k", _produce):
+            items.append(item)
+            if limit is not None and len(items) == limit:
+                break
+        return items
+
+    async def _main():
+        return await asyncio.gather(_read(), _read(), _read(limit=1))
+
+    full, other, partial = asyncio.run(_main())
+    assert full == other == [0, 1, 2]
+    assert partial == [0]
+    assert len(calls) == 1
@@ -0,0 +1,81 @@
+"""Agrupación de fragmentos del stream y lectura en un thread."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ollama_backend.streaming import chunk_text, coalesce, iterate_in_thread
+
+
+def test_coalesce_groups_fragments_and_flushes_the_rest():
+    fragments = ["a"] * 10 + ["", "b" * 70, "c"]
+    blocks = list(coalesce(fragments, interval=60, max_chars=4))
+    assert "".join(blocks) == "a" * 10 + "b" * 70 + "c"
+    assert blocks == ["aaaa", "aaaa", "aa" + "b" * 70, "c"]
+
+
+def test_coalesce_flushes_on_a_timer_during_a_gap():
+    resume = threading.Event()
+
+    def _fragments():
+        yield "hola"
+        # Hueco largo entre tokens (p. ej. el modelo piensa)
+        resume.wait(5)
+        yield " mundo"
+
+    blocks = coalesce(_fragments(), interval=0.05, max_chars=1000)
+    start = time.monotonic()
+    assert next(blocks) == "hola"
+    assert time.monotonic() - start < 1
+    resume.set()
+    assert list(blocks) == [" mundo"]
+
+
+def test_coalesce_raises_after_the_pending_text():
+    def _fragments():
+        yield "parcial"
+        raise ConnectionError("conexión cortada")
+
+    blocks = coalesce(_fragments(), interval=60)
+    assert next(blocks) == "parcial"
+    with pytest.raises(ConnectionError):
+        next(blocks)
+
+
+def test_closing_coalesce_stops_the_reader():
+    closed = threading.Event()
+
+    def _fragments():
+        try:
+            while True:
+                yield "x"
+                time.sleep(0.01)
+        finally:
+            closed.set()
+
+    blocks = coalesce(_fragments(), interval=0, max_chars=1)
+    next(blocks)
+    blocks.close()
+    assert closed.wait(1)
+
+
+def test_iterate_in_thread():
+    async def _read():
+        return [part async for part in iterate_in_thread(iter(["a", "b"]))]
+
+    assert asyncio.run(_read()) == ["a", "b"]
+
+
+def test_chunk_text_shapes():
+    class _Message:
+        content = "objeto"
+
+    class _Chunk:
+        message = _Message()
+
+    assert chunk_text({"message": {"content": " dict"}}) == " dict"
+    assert chunk_text({"content": "plano"}) == "plano"
+    assert chunk_text(_Chunk()) == "objeto"
+    assert chunk_text("texto") == "texto"
@@ -0,0 +1,61 @@
+"""Ventana de historial por presupuesto de tokens."""
+
+from ollama_backend.window import HistoryWindow, TokenCounter, window_messages
+
+# 1 token por carácter + MESSAGE_OVERHEAD (4): cada mensaje de 16 caracteres son 20 tokens
+COUNTER = TokenCounter(len)
+
+
+def _message(i):
+    role = "user" if i % 2 == 0 else "assistant"
+    return role, f"{role[0]}{i:02d}".ljust(16, ".")
+
+
+def _contents(messages):
+    return [m["content"][:3] for m in messages]
+
+
+def test_trims_whole_turns_down_to_the_target():
+    window = HistoryWindow(budget=100, counter=COUNTER, trim_target=0.5)
+    for i in range(5):
+        assert window.append(*_message(i)) == []
+    dropped = window.append(*_message(5))
+    assert _contents(dropped) == ["u00", "a01", "u02", "a03"]
+    assert _contents(window.history()) == ["u04", "a05"]
+    # Por debajo del presupuesto otra vez: el principio del prompt no cambia en varios turnos
+    for i in range(6, 9):
+        assert window.append(*_message(i)) == []
+    assert _contents(window.history())[0] == "u04"
+
+
+def test_keeps_the_system_prompt_and_the_last_message():
+    window = HistoryWindow(budget=30, system_prompt="Eres útil.", counter=COUNTER, trim_target=1)
+    window.append("user", "x" * 100)
+    assert [m["role"] for m in window.messages()] == ["system", "user"]
+    window.append("assistant", "y" * 100)
+    assert [m["role"] for m in window.messages()] == ["system", "assistant"]
+
+
+def test_counts_each_message_once():
+    calls = []
+
+    def _tokenize(text):
+        calls.append(text)
+        return len(text)
+
+    counter = TokenCounter(_tokenize)
+    window = HistoryWindow(budget=1000, counter=counter)
+    for i in range(3):
+        window.append(*_message(i))
+        window.messages()
+    assert counter.count("u00".ljust(16, ".")) == 16
+    assert len(calls) == 3
+
+
+def test_window_messages_walks_back_from_the_end():
+    messages = [{"role": "system", "content": "s"}] + [dict(zip(("role", "content"), _message(i))) for i in range(6)]
+    window = window_messages(messages, budget=70, counter=COUNTER)
+    # system (5 tokens) + 3 mensajes (60); sin respuesta huérfana del assistant al principio
+    assert _contents(window) == ["s", "u04", "a05"]
+    # El último mensaje entra aunque no quepa
+    assert _contents(window_messages(messages[-1:], budget=1, counter=COUNTER)) == ["a05"]